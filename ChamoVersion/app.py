@@ -1,25 +1,50 @@
+import io
 import os
+import re
+import tempfile
 from decimal import Decimal
-from werkzeug.security import generate_password_hash, check_password_hash
+from html import unescape
 import streamlit as st
-import pandas as pd
-from sqlalchemy import func, text
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
-from datetime import datetime
-from fpdf import FPDF
-import base64
+from datetime import date, datetime, timedelta
+
+# pandas, fpdf, werkzeug y forecast (numpy) se importan en las páginas que los usan:
+# el login y el Dashboard no los cargan (ver `python bench.py arranque`)
 
 
 # Importar desde tu db.py
 try:
     from db import (
-        engine, get_session, init_db,
-        Store, Supplier, Ingredient, Product, Order, OrderItem, User, Customer
+        engine, get_read_session, get_session, init_db, usar_marca,
+        Store, Supplier, Ingredient, Product, Order, OrderItem, User, Customer,
+        RecipeItem, IngredientStock, ProductionPlan, ProductPrice, Promotion, Shift
     )
 except ImportError as e:
     st.error(f"Error al importar db.py: {e}")
     st.stop()
 
+from cart_store import carritos, clave_caja
+from catalog import ProductCatalog, agregar_escaneo
+from checkout import procesar_venta
+from costing import motor_costos
+from customer_search import etiqueta, indice_clientes
+from customer_stats import recalcular_estadisticas, top_clientes
+from export import EXPORTS, FORMATOS, exportar
+from history import historial_pedidos
+from importer import IMPORTS, importar_csv
+from product_sales import top_productos, verificar_contadores
+from statements import CATALOGO_ACTIVO, USUARIO_POR_NOMBRE, VENTAS_POR_DIA
+from money import centimos, formato_cantidad, formato_centimos, importe_linea, milesimas, precio_decimal
+from pricing import a_local, cancelar_programado, fin_del_dia, historial, hoy, inicio_del_dia, lista_precios, precios_vigentes, programar_precio
+from promotions import TIPOS as TIPOS_PROMOCION, promociones
+from shifts import METODOS_PAGO, abrir_turno, cerrar_turno, reportes_z, turno_abierto, turnos_recientes, verificar_turnos
+from inventory import registrar_compra, registrar_merma, registrar_movimientos, tomar_snapshot, verificar_stock
+from events import iniciar_listener, ticker
+from receipts import destinos_recibo, iniciar_despachador
+from instrumentation import ACTIVO as SQL_PROFILE_ACTIVO, profiler
+from profiling import ACTIVO as PERFIL_ACTIVO, perfil
+
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(
     page_title="🥖 Panadería - Gestión",
@@ -27,12 +52,30 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Read-your-writes de la réplica por usuario: sus escrituras se marcan en su session_state
+usar_marca(st.session_state)
+
+# Las consultas antes de elegir página (login, datos demo) se cuentan como "(inicio)"
+profiler.iniciar_rerun("(inicio)")
+perfil.iniciar_rerun(perfilar=st.session_state.get("perfilar_rerun", False))
+
+
+def detener():
+    """st.stop() guardando antes las mediciones de este rerun (si no, se atribuirían al siguiente)"""
+    profiler.terminar_rerun()
+    perfil.terminar_rerun()
+    st.stop()
+
 # --- INICIALIZAR DB ---
 try:
-    init_db(drop=False)
+    init_db()
+    iniciar_listener(engine)
+    iniciar_despachador()  # recibos digitales en un hilo de fondo
 except Exception as e:
     st.error(f"Error al inicializar la base de datos: {e}")
 
+perfil.marca("inicializar db")
+
 # --- FUNCIONES HELPER ---
 def format_money(x):
     try:
@@ -40,15 +83,24 @@ def format_money(x):
     except Exception:
         return str(x)
 
-# Función corregida para generar PDF
-from fpdf import FPDF
+def mostrar_reporte_z(rep):
+    """Tabla por medio de pago y cuadre de efectivo de un reporte Z (shifts.reporte_z)"""
+    import pandas as pd
+    st.dataframe(pd.DataFrame([
+        {"Medio de pago": METODOS_PAGO.get(m, m), "Ventas": n, "Total": format_money(t)}
+        for m, (n, t) in sorted(rep["por_metodo"].items())
+    ] + [{"Medio de pago": "TOTAL", "Ventas": rep["ventas"], "Total": format_money(rep["total"])}]),
+        use_container_width=True, hide_index=True)
+    texto = f"Fondo {format_money(rep['fondo'])} · Efectivo esperado {format_money(rep['efectivo_esperado'])}"
+    if rep["efectivo_contado"] is not None:
+        texto += f" · Contado {format_money(rep['efectivo_contado'])} · Diferencia {format_money(rep['diferencia'])}"
+    st.caption(texto)
 
+# Función corregida para generar PDF
 def generar_pdf(ticket_html, filename):
+    from fpdf import FPDF
+
     try:
-        import re
-        from html import unescape
-        from datetime import datetime
-        
         # Función helper para extraer texto del HTML
         def extraer_texto(patron, html, default=""):
             match = re.search(patron, html, re.DOTALL | re.IGNORECASE)
@@ -203,9 +255,11 @@ def generar_pdf(ticket_html, filename):
         except:
             return b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj 2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj 3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 200 400]>>endobj xref\n0 4\n0000000000 65535 f \n0000000009 00000 n \n0000000058 00000 n \n0000000115 00000 n \ntrailer<</Size 4/Root 1 0 R>>\nstartxref\n189\n%%EOF"
 def login_user(username, password):
+    from werkzeug.security import check_password_hash
+
     session = get_session()
     try:
-        user = session.query(User).filter(User.username == username).first()
+        user = session.scalars(USUARIO_POR_NOMBRE, {"username": username}).first()
         if user and check_password_hash(user.password, password) and user.is_active:
             return {"id": user.id, "username": user.username, "role": user.role}
     finally:
@@ -358,11 +412,19 @@ def generate_ticket_html(order, items_data, store_data, customer_data=None):
     """
     return html
 
+def agregar_desde_grid(caja, product_id, qty_key):
+    """Callback del botón del grid: corre antes del rerun, así puede volver la cantidad a 0"""
+    qty = milesimas(st.session_state.get(qty_key, 0.0))
+    if qty > 0:
+        carrito = carritos.obtener(caja)
+        carrito[product_id] = carrito.get(product_id, 0) + qty
+        carritos.guardar(caja, carrito)
+        st.session_state[qty_key] = 0.0
+
 # --- SESSION STATE ---
+# El carrito no vive aquí sino en cart_store (por caja), compartido entre workers
 if "user" not in st.session_state:
     st.session_state["user"] = None
-if "carrito" not in st.session_state:
-    st.session_state["carrito"] = {}
 
 # --- CREAR DATOS DEMO SI NO EXISTEN ---
 try:
@@ -371,6 +433,7 @@ try:
         if session.query(Store).count() == 0:
             session.add(Store(name="Panadería El Buen Pan", address="Av. Principal 123, Lima", phone="999-888-777"))
         if session.query(User).count() == 0:
+            from werkzeug.security import generate_password_hash
             admin_pw = generate_password_hash("admin123")
             session.add(User(username="admin", password=admin_pw, role="admin"))
         if session.query(Ingredient).count() == 0:
@@ -399,6 +462,8 @@ try:
 except Exception as e:
     st.error(f"Error al crear datos demo: {e}")
 
+perfil.marca("datos demo")
+
 # --- SIDEBAR LOGIN / REGISTRO ---
 st.sidebar.title("🥖 Panadería")
 st.sidebar.markdown("---")
@@ -432,6 +497,7 @@ if st.session_state["user"] is None:
         register_btn = st.form_submit_button("✅ Crear cuenta")
         if register_btn:
             if ru and rp:
+                from werkzeug.security import generate_password_hash
                 session = get_session()
                 try:
                     user = User(username=ru, password=generate_password_hash(rp), role=rrole)
@@ -452,49 +518,65 @@ else:
     st.sidebar.success(f"👋 {user.get('username')}")
     st.sidebar.info(f"📋 Rol: **{user.get('role').title()}**")
     if st.sidebar.button("🚪 Cerrar sesión"):
+        if st.session_state.get("caja"):
+            carritos.borrar(st.session_state.pop("caja"))
         st.session_state["user"] = None
-        st.session_state["carrito"] = {}
         st.rerun()
 
 # --- NAVEGACIÓN ---
 st.sidebar.markdown("---")
 st.sidebar.subheader("📋 Menú")
-menu_options = ["🏠 Dashboard", "🛒 Productos", "👥 Clientes", "💰 Ventas (POS)"]
+menu_options = ["🏠 Dashboard", "🛒 Productos", "👥 Clientes", "💰 Ventas (POS)", "🧾 Historial"]
 if require_role("admin"):
     menu_options += ["📊 Reportes", "⚙️ Administración"]
 choice = st.sidebar.radio("Navegación", menu_options, label_visibility="collapsed")
+profiler.iniciar_rerun(choice)
+perfil.pagina(choice)
+perfil.marca("sidebar y menú")
 
 # --- DASHBOARD ---
 if choice == "🏠 Dashboard":
     st.title("🏠 Dashboard Principal")
     try:
-        session = get_session()
+        session = get_read_session()
         try:
             total_prod = session.query(func.count(Product.id)).scalar() or 0
             total_ing = session.query(func.count(Ingredient.id)).scalar() or 0
             total_customers = session.query(func.count(Customer.id)).scalar() or 0
-            total_orders = session.query(func.count(Order.id)).scalar() or 0
-            total_sales = session.query(func.coalesce(func.sum(Order.total), 0)).scalar() or 0
+            # Las ventas salen del ticker en memoria: solo se agregan una vez por proceso
+            if not ticker.listo:
+                ticker.cargar(session)
         finally:
             session.close()
+        perfil.marca("consultas")
         col1, col2, col3, col4, col5 = st.columns(5)
         col1.metric("🛒 Productos", total_prod)
         col2.metric("📦 Ingredientes", total_ing)
         col3.metric("👥 Clientes", total_customers)
-        col4.metric("🧾 Órdenes", total_orders)
-        col5.metric("💰 Ventas Total", format_money(total_sales))
+
+        def ventas_en_vivo():
+            col4.metric("🧾 Órdenes", ticker.ordenes)
+            col5.metric("💰 Ventas Total", format_money(ticker.total))
+
+        # Con st.fragment (Streamlit >= 1.37) las métricas se refrescan solas
+        if hasattr(st, "fragment"):
+            st.fragment(run_every=5)(ventas_en_vivo)()
+        else:
+            ventas_en_vivo()
     except Exception as e:
         st.error(f"Error al cargar dashboard: {e}")
 
 elif choice == "🛒 Productos":
+    import pandas as pd
     st.title("🛒 Gestión de Productos")
     
     try:
-        session = get_session()
+        session = get_read_session()
         try:
             productos = session.query(Product).order_by(Product.name).all()
         finally:
             session.close()
+        perfil.marca("consultas")
         
         col1, col2 = st.columns([2, 1])
         
@@ -512,6 +594,20 @@ elif choice == "🛒 Productos":
                 } for p in productos])
                 
                 st.dataframe(df, use_container_width=True, hide_index=True)
+
+                with st.expander("📅 Lista de precios a una fecha"):
+                    fecha_lista = st.date_input("Fecha", value=hoy(), key="fecha_lista_precios")
+                    session = get_read_session()
+                    try:
+                        # Fin del día: incluye los cambios que entraron esa fecha
+                        precios_fecha = lista_precios(session, fin_del_dia(fecha_lista))
+                    finally:
+                        session.close()
+                    st.dataframe(pd.DataFrame([{
+                        "SKU": p.sku,
+                        "Nombre": p.name,
+                        "Precio": format_money(precios_fecha[p.id]) if p.id in precios_fecha else "—",
+                    } for p in productos]), use_container_width=True, hide_index=True)
             else:
                 st.info("No hay productos registrados")
         
@@ -539,6 +635,10 @@ elif choice == "🛒 Productos":
                 sku = st.text_input("SKU", value=default_sku, placeholder="PAN-001")
                 nombre = st.text_input("Nombre", value=default_name, placeholder="Pan francés")
                 precio = st.number_input("Precio (S/)", min_value=0.01, value=default_price, step=0.10)
+                vigente_desde = st.date_input(
+                    "Precio vigente desde", value=hoy(), min_value=hoy(),
+                    help="Una fecha futura programa el cambio; hasta entonces se cobra el precio actual"
+                )
                 categoria = st.text_input("Categoría", value=default_cat, placeholder="Pan diario")
                 activo = st.checkbox("Producto activo", value=default_active)
                 
@@ -548,16 +648,25 @@ elif choice == "🛒 Productos":
                     if sku and nombre:
                         try:
                             session = get_session()
+                            # Hoy = inmediato; otra fecha = desde la medianoche local de ese día, en UTC (un producto nuevo empieza hoy)
+                            desde = None
+                            if selected[1] > 0 and vigente_desde > hoy():
+                                desde = inicio_del_dia(vigente_desde)
                             try:
                                 if selected[1] > 0:  # Editar
                                     prod = session.query(Product).get(selected[1])
                                     if prod:
                                         prod.sku = sku
                                         prod.name = nombre
-                                        prod.price = Decimal(str(precio))
                                         prod.category = categoria
                                         prod.is_active = activo
-                                        st.success("✅ Producto actualizado")
+                                        # El precio pasa por el historial (cierra el rango vigente o programa uno)
+                                        if desde or Decimal(str(precio)) != prod.price:
+                                            programar_precio(session, prod.id, precio, desde)
+                                        if desde:
+                                            st.success(f"✅ Producto actualizado; {format_money(Decimal(str(precio)))} desde {vigente_desde:%d/%m/%Y}")
+                                        else:
+                                            st.success("✅ Producto actualizado")
                                 else:  # Crear nuevo
                                     nuevo_prod = Product(
                                         sku=sku,
@@ -567,9 +676,16 @@ elif choice == "🛒 Productos":
                                         is_active=activo
                                     )
                                     session.add(nuevo_prod)
+                                    session.flush()
+                                    session.add(ProductPrice(
+                                        product_id=nuevo_prod.id, price=Decimal(str(precio)), valid_from=datetime.utcnow()
+                                    ))
+                                    prod = nuevo_prod
                                     st.success("✅ Producto creado")
-                                
+
                                 session.commit()
+                                if prod and not desde:
+                                    motor_costos.set_precio(prod.id, Decimal(str(precio)))
                                 st.rerun()
                             finally:
                                 session.close()
@@ -579,15 +695,44 @@ elif choice == "🛒 Productos":
                             st.error(f"❌ Error: {e}")
                     else:
                         st.error("❌ SKU y nombre son obligatorios")
+
+            if selected[1] > 0:
+                with st.expander("📜 Historial de precios"):
+                    session = get_session()
+                    try:
+                        filas = historial(session, selected[1])
+                        ahora = datetime.utcnow()
+                        if filas:
+                            st.dataframe(pd.DataFrame([{
+                                "Precio": format_money(f.price),
+                                "Desde": "—" if f.valid_from.year <= 2000 else a_local(f.valid_from).strftime("%d/%m/%Y %H:%M"),
+                                "Hasta": a_local(f.valid_to).strftime("%d/%m/%Y %H:%M") if f.valid_to else "—",
+                                "Estado": "📅 Programado" if f.valid_from > ahora else ("✅ Vigente" if not f.valid_to or f.valid_to > ahora else ""),
+                            } for f in filas]), use_container_width=True, hide_index=True)
+                        else:
+                            st.caption("Sin historial todavía (se crea al abrir el POS o al cambiar el precio)")
+                        programados = [f for f in filas if f.valid_from > ahora]
+                        if programados:
+                            cancelar = st.selectbox(
+                                "Cambio programado", programados,
+                                format_func=lambda f: f"{format_money(f.price)} desde {a_local(f.valid_from):%d/%m/%Y}"
+                            )
+                            if st.button("🗑️ Cancelar cambio programado"):
+                                cancelar_programado(session, cancelar.id)
+                                session.commit()
+                                st.rerun()
+                    finally:
+                        session.close()
     
     except Exception as e:
         st.error(f"Error en gestión de productos: {e}")
 
 elif choice == "👥 Clientes":
+    import pandas as pd
     st.title("👥 Gestión de Clientes")
     
     try:
-        session = get_session()
+        session = get_read_session()
         try:
             clientes = session.query(Customer).filter_by(is_active=True).order_by(Customer.name).all()
         finally:
@@ -660,28 +805,69 @@ elif choice == "👥 Clientes":
         st.error(f"Error en gestión de clientes: {e}")
 
 elif choice == "💰 Ventas (POS)":
+    import pandas as pd
     st.title("💰 Punto de Venta (POS)")
     
     if not require_login():
         st.warning("⚠️ Debes iniciar sesión para usar el POS")
-        st.stop()
+        detener()
     
     try:
         session = get_session()
         try:
-            productos = session.query(Product).filter_by(is_active=True).order_by(Product.name).all()
-            clientes = session.query(Customer).filter_by(is_active=True).order_by(Customer.name).all()
+            # Lista de precios vigente en caché: solo se recarga si cambió el historial o entró un precio programado
+            precios_vigentes.refrescar(session)
+            promociones.refrescar(session)  # recompila las reglas solo si cambió la tabla
+            productos = session.scalars(CATALOGO_ACTIVO).all()
+            # Solo se leen los clientes nuevos desde el último rerun
+            indice_clientes.refrescar(session)
             store = session.query(Store).first()
+            turno = turno_abierto(session, st.session_state["user"].get("id"), store.id if store else 1)
         finally:
             session.close()
+        catalogo = ProductCatalog(productos, precios_vigentes.centimos)
+        perfil.marca("consultas y catálogo")
         
         # Información del cajero
         user = st.session_state["user"]
+        caja = clave_caja(store.id if store else 1, user.get("id"))
+        st.session_state["caja"] = caja
         st.info(f"👤 **Cajero:** {user.get('username')} | 🏪 **Tienda:** {store.name if store else 'N/A'}")
+
+        # Turno de caja: las ventas se acumulan por turno y medio de pago para el reporte Z
+        if st.session_state.get("ultimo_reporte_z"):
+            with st.expander("🧾 Reporte Z del último turno cerrado", expanded=turno is None):
+                mostrar_reporte_z(st.session_state["ultimo_reporte_z"])
+        if turno is None:
+            st.warning("🔓 No tienes un turno abierto en esta tienda")
+            with st.form("abrir_turno_form"):
+                fondo_turno = st.number_input("Fondo inicial de caja (S/)", min_value=0.0, value=0.0, step=10.0)
+                if st.form_submit_button("🔓 Abrir turno", use_container_width=True):
+                    session = get_session()
+                    try:
+                        abrir_turno(session, user.get("id"), store.id if store else 1, Decimal(str(fondo_turno)))
+                    finally:
+                        session.close()
+                    st.session_state.pop("ultimo_reporte_z", None)
+                    st.rerun()
+            detener()
+        with st.expander(f"🕐 Turno #{turno.id} abierto desde {turno.opened_at:%d/%m/%Y %H:%M} · 🔒 Cerrar turno"):
+            with st.form("cerrar_turno_form"):
+                contado_turno = st.number_input("Efectivo contado en caja (S/)", min_value=0.0, value=0.0, step=10.0)
+                if st.form_submit_button("🔒 Cerrar turno y emitir reporte Z", use_container_width=True):
+                    session = get_session()
+                    try:
+                        st.session_state["ultimo_reporte_z"] = cerrar_turno(
+                            session, session.get(Shift, turno.id), Decimal(str(contado_turno))
+                        )
+                    finally:
+                        session.close()
+                    st.rerun()
         
-        # Selección de cliente
+        # Selección de cliente: búsqueda en el servidor, solo se envían las mejores coincidencias
         st.subheader("👥 Seleccionar Cliente")
-        cliente_options = [("VENTA GENERAL", None)] + [(f"{c.name} {c.last_name or ''} - {c.document_type}: {c.document_number}".strip(), c.id) for c in clientes]
+        busqueda_cliente = st.text_input("Buscar cliente", placeholder="Nombre, apellido, documento o teléfono", key="customer_search")
+        cliente_options = [("VENTA GENERAL", None)] + [(etiqueta(c), c.id) for c in indice_clientes.buscar(busqueda_cliente, limite=20)]
         selected_customer = st.selectbox(
             "Cliente para esta venta:", 
             cliente_options, 
@@ -693,8 +879,20 @@ elif choice == "💰 Ventas (POS)":
         
         with col1:
             st.subheader("🛒 Productos Disponibles")
-            
-            if productos:
+
+            # Entrada rápida: SKU o código de barras, con multiplicador opcional
+            with st.form("scan_form", clear_on_submit=True):
+                entrada_sku = st.text_input("Escanear o escribir SKU", placeholder="PAN-001, 3*PAN-002, TORTA-001 x2")
+                if st.form_submit_button("➕ Agregar al carrito", use_container_width=True) and entrada_sku:
+                    carrito = carritos.obtener(caja)
+                    agregados, desconocidos = agregar_escaneo(catalogo, carrito, entrada_sku)
+                    carritos.guardar(caja, carrito)
+                    if desconocidos:
+                        st.error(f"❌ No reconocidos: {', '.join(desconocidos)}")
+
+            # El grid crea dos widgets por producto: solo se dibuja si se pide
+            mostrar_catalogo = st.toggle("📋 Mostrar catálogo completo", key="pos_catalogo")
+            if productos and mostrar_catalogo:
                 # Mostrar productos en grid
                 for i in range(0, len(productos), 2):
                     cols = st.columns(2)
@@ -704,51 +902,43 @@ elif choice == "💰 Ventas (POS)":
                             with col:
                                 with st.container():
                                     st.write(f"**{p.name}**")
-                                    st.caption(f"SKU: {p.sku} | {format_money(p.price)}")
+                                    st.caption(f"SKU: {p.sku} | {format_money(precio_decimal(catalogo.centimos[p.id]))}")
                                     
-                                    # Input de cantidad
+                                    # Input de cantidad (el widget es el único estado por producto)
                                     qty_key = f"qty_pos_{p.id}"
-                                    if qty_key not in st.session_state:
-                                        st.session_state[qty_key] = 0.0
-                                    
-                                    qty = st.number_input(
-                                        "Cantidad",
-                                        min_value=0.0,
-                                        step=1.0,
-                                        value=st.session_state[qty_key],
-                                        key=f"input_{qty_key}"
+                                    st.number_input("Cantidad", min_value=0.0, step=1.0, value=0.0, key=qty_key)
+                                    st.button(
+                                        f"➕ Agregar", key=f"btn_{p.id}", use_container_width=True,
+                                        on_click=agregar_desde_grid, args=(caja, p.id, qty_key)
                                     )
-                                    
-                                    if st.button(f"➕ Agregar", key=f"btn_{p.id}", use_container_width=True):
-                                        if qty > 0:
-                                            carrito = st.session_state.get("carrito", {})
-                                            carrito[p.id] = carrito.get(p.id, 0) + qty
-                                            st.session_state["carrito"] = carrito
-                                            st.session_state[qty_key] = 0.0
-                                            st.rerun()
-            else:
+            elif not productos:
                 st.warning("⚠️ No hay productos activos")
         
         with col2:
             st.subheader("🧾 Carrito de Compras")
             
-            carrito = st.session_state.get("carrito", {})
+            carrito = carritos.obtener(caja)
             
             if carrito:
+                # Cantidades en milésimas y precios en céntimos; cada línea se redondea a céntimos como en checkout
                 items_carrito = []
-                total_venta = Decimal("0")
+                total_venta = 0
+                cliente_carrito = indice_clientes.cliente(selected_customer[1]) if selected_customer[1] else None
+                descuentos = promociones.evaluar(carrito, catalogo, cliente_carrito)
                 
                 for prod_id, qty in carrito.items():
-                    producto = next((p for p in productos if p.id == prod_id), None)
+                    producto = catalogo.por_id.get(prod_id)
                     if producto:
-                        subtotal = Decimal(str(qty)) * producto.price
+                        descuento, promo_id = descuentos.get(prod_id, (0, None))
+                        subtotal = importe_linea(qty, catalogo.centimos[prod_id], descuento)
                         total_venta += subtotal
                         
                         items_carrito.append({
                             "Producto": producto.name,
-                            "Cant.": int(qty),
-                            "Precio": format_money(producto.price),
-                            "Subtotal": format_money(subtotal)
+                            "Cant.": formato_cantidad(qty),
+                            "Precio": format_money(precio_decimal(catalogo.centimos[prod_id])),
+                            "Descuento": f"{format_money(precio_decimal(descuento))} · {promociones.reglas[promo_id].nombre}" if promo_id else "",
+                            "Subtotal": formato_centimos(subtotal)
                         })
                 
                 # Mostrar items del carrito
@@ -757,19 +947,29 @@ elif choice == "💰 Ventas (POS)":
                 
                 # Cliente seleccionado
                 if selected_customer[1]:
-                    cliente_seleccionado = next((c for c in clientes if c.id == selected_customer[1]), None)
+                    cliente_seleccionado = indice_clientes.cliente(selected_customer[1])
                     if cliente_seleccionado:
                         st.info(f"👤 **Cliente:** {cliente_seleccionado.name} {cliente_seleccionado.last_name or ''}")
                 
                 # Total
-                st.markdown(f"### 💰 **Total: {format_money(total_venta)}**")
+                st.markdown(f"### 💰 **Total: {formato_centimos(total_venta)}**")
+                
+                enviar_recibo = False
+                destinos = destinos_recibo(cliente_carrito) if cliente_carrito else []
+                if destinos:
+                    enviar_recibo = st.checkbox(
+                        f"📧 Enviar recibo digital a {', '.join(d for _, d in destinos)}", value=True, key="pos_enviar_recibo"
+                    )
+                metodo_pago = st.radio(
+                    "Medio de pago", list(METODOS_PAGO), format_func=METODOS_PAGO.get, horizontal=True, key="pos_metodo_pago"
+                )
                 
                 # Botones de acción
                 col_btn1, col_btn2 = st.columns(2)
                 
                 with col_btn1:
                     if st.button("🗑️ Limpiar", use_container_width=True):
-                        st.session_state["carrito"] = {}
+                        carritos.borrar(caja)
                         st.rerun()
                 
                 with col_btn2:
@@ -777,49 +977,40 @@ elif choice == "💰 Ventas (POS)":
                         try:
                             session = get_session()
                             try:
-                                # Crear orden con el esquema correcto
-                                orden = Order(
-                                    user_id=user.get("id"), 
+                                orden = procesar_venta(
+                                    session,
+                                    user_id=user.get("id"),
                                     store_id=store.id if store else 1,
-                                    customer_id=selected_customer[1],  # Incluir ID del cliente
-                                    total=total_venta
+                                    customer_id=selected_customer[1],
+                                    carrito=carrito,
+                                    productos=productos,
+                                    llave=carrito.llave,
+                                    precios=catalogo.centimos,
+                                    descuentos=descuentos,
+                                    metodo_pago=metodo_pago,
+                                    turno_id=turno.id,
+                                    enviar_recibo=enviar_recibo
                                 )
-                                session.add(orden)
-                                session.flush()
-                                
-                                # Agregar items
-                                for prod_id, qty in carrito.items():
-                                    producto = session.query(Product).get(prod_id)
-                                    
-                                    # Item de la orden
-                                    session.add(OrderItem(
-                                        order_id=orden.id,
-                                        product_id=prod_id,
-                                        qty=Decimal(str(qty)),
-                                        price=producto.price
-                                    ))
-                                
-                                session.commit()
                                 
                                 # Preparar datos para el ticket
                                 orden_completa = session.query(Order).filter_by(id=orden.id).first()
                                 items_ticket = []
                                 for prod_id, qty in carrito.items():
-                                    producto = next((p for p in productos if p.id == prod_id), None)
+                                    producto = catalogo.por_id.get(prod_id)
                                     if producto:
-                                        subtotal = Decimal(str(qty)) * producto.price
+                                        descuento = descuentos.get(prod_id, (0, None))[0]
                                         items_ticket.append({
-                                            "producto": producto.name,
-                                            "cantidad": int(qty),
-                                            "precio_unit": format_money(producto.price),
-                                            "subtotal": format_money(subtotal)
+                                            "producto": producto.name + (" (promo)" if descuento else ""),
+                                            "cantidad": formato_cantidad(qty),
+                                            "precio_unit": format_money(precio_decimal(catalogo.centimos[prod_id])),
+                                            "subtotal": formato_centimos(importe_linea(qty, catalogo.centimos[prod_id], descuento))
                                         })
                                 
                                 # Datos del cliente
                                 customer_data = None
                                 customer_info = ""
                                 if selected_customer[1]:
-                                    cliente = next((c for c in clientes if c.id == selected_customer[1]), None)
+                                    cliente = indice_clientes.cliente(selected_customer[1])
                                     if cliente:
                                         customer_data = {
                                             "name": cliente.name,
@@ -848,10 +1039,14 @@ elif choice == "💰 Ventas (POS)":
                                 ticket_html = generate_ticket_html(orden_completa, items_ticket, store_data, customer_data)
                                 
                                 # Limpiar carrito
-                                st.session_state["carrito"] = {}
+                                carritos.borrar(caja)
                                 
-                                st.success(f"✅ **Venta registrada exitosamente!**\n\n🧾 **Orden #{orden.id}**\n💰 **Total: {format_money(total_venta)}**")
-                                st.balloons()
+                                if orden.repetida:
+                                    # Doble clic o reintento: la venta ya estaba registrada, no se cobró de nuevo
+                                    st.info(f"ℹ️ Esta venta ya estaba registrada como **Orden #{orden.id}**; no se cobró dos veces.")
+                                else:
+                                    st.success(f"✅ **Venta registrada exitosamente!**\n\n🧾 **Orden #{orden.id}**\n💰 **Total: {formato_centimos(orden.total_centimos)}**")
+                                    st.balloons()
                                 
                                 # Botón para mostrar ticket
                                 # Generar HTML del ticket
@@ -859,7 +1054,8 @@ elif choice == "💰 Ventas (POS)":
                                     ticket_html = generate_ticket_html(orden_completa, items_ticket, store_data, customer_data)
                                     
                                     # Generar PDF del ticket
-                                    pdf_bytes = generar_pdf(ticket_html, f"Ticket_Orden_{orden.id}.pdf")
+                                    with perfil.tramo("pdf"):
+                                        pdf_bytes = generar_pdf(ticket_html, f"Ticket_Orden_{orden.id}.pdf")
                                     
                                     # Botón de descarga directo
                                     st.download_button(
@@ -887,86 +1083,209 @@ elif choice == "💰 Ventas (POS)":
                 
                 # Mostrar cliente seleccionado incluso con carrito vacío
                 if selected_customer[1]:
-                    cliente_seleccionado = next((c for c in clientes if c.id == selected_customer[1]), None)
+                    cliente_seleccionado = indice_clientes.cliente(selected_customer[1])
                     if cliente_seleccionado:
                         st.info(f"👤 **Cliente seleccionado:** {cliente_seleccionado.name} {cliente_seleccionado.last_name or ''}")
     
     except Exception as e:
         st.error(f"Error en POS: {e}")
 
+# --- HISTORIAL DE ÓRDENES ---
+elif choice == "🧾 Historial":
+    import pandas as pd
+    st.title("🧾 Historial de Órdenes")
+
+    if not require_login():
+        st.warning("⚠️ Debes iniciar sesión para ver el historial")
+        detener()
+
+    try:
+        session = get_read_session()
+        try:
+            indice_clientes.refrescar(session)
+            cajeros = session.query(User).order_by(User.username).all()
+            tiendas = session.query(Store).order_by(Store.name).all()
+
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                busqueda_hist = st.text_input("Cliente", placeholder="Nombre, documento o teléfono", key="hist_busqueda")
+                opciones_cliente = [None] + indice_clientes.buscar(busqueda_hist, limite=20)
+                cliente_hist = st.selectbox("Seleccionar cliente", opciones_cliente, format_func=lambda c: etiqueta(c) if c else "Todos")
+            with col2:
+                if require_role("admin"):
+                    cajero_hist = st.selectbox("Cajero", [None] + cajeros, format_func=lambda u: u.username if u else "Todos")
+                    cajero_id = cajero_hist.id if cajero_hist else None
+                else:
+                    # Los cajeros solo ven sus propias ventas
+                    cajero_id = st.session_state["user"].get("id")
+                    st.text_input("Cajero", value=st.session_state["user"].get("username"), disabled=True)
+            with col3:
+                tienda_hist = st.selectbox("Tienda", [None] + tiendas, format_func=lambda t: t.name if t else "Todas")
+
+            # Pila de cursores (ts, id); al cambiar los filtros se vuelve a la primera página
+            filtros = (cliente_hist.id if cliente_hist else None, cajero_id, tienda_hist.id if tienda_hist else None)
+            if st.session_state.get("hist_filtros") != filtros:
+                st.session_state["hist_filtros"] = filtros
+                st.session_state["hist_cursores"] = [None]
+            cursores = st.session_state["hist_cursores"]
+
+            ordenes, siguiente = historial_pedidos(
+                session, customer_id=filtros[0], user_id=filtros[1], store_id=filtros[2], despues=cursores[-1]
+            )
+            if ordenes:
+                for o in ordenes:
+                    titulo = f"#{o.id} · {o.ts.strftime('%d/%m/%Y %H:%M')} · {format_money(o.total)} · {o.user.username}"
+                    if o.customer:
+                        titulo += f" · {o.customer.name} {o.customer.last_name or ''}"
+                    with st.expander(titulo):
+                        st.dataframe(pd.DataFrame([{
+                            "Producto": item.product.name,
+                            "Cant.": float(item.qty),
+                            "Precio": format_money(item.price),
+                            "Descuento": format_money(item.discount),
+                            "Subtotal": formato_centimos(importe_linea(milesimas(item.qty), centimos(item.price), centimos(item.discount)))
+                        } for item in o.items]), use_container_width=True, hide_index=True)
+            else:
+                st.info("No hay órdenes para estos filtros")
+        finally:
+            session.close()
+
+        col_prev, col_pag, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if len(cursores) > 1 and st.button("⬅️ Anterior", use_container_width=True):
+                cursores.pop()
+                st.rerun()
+        with col_pag:
+            st.caption(f"Página {len(cursores)}")
+        with col_next:
+            if siguiente and st.button("Siguiente ➡️", use_container_width=True):
+                cursores.append(siguiente)
+                st.rerun()
+
+    except Exception as e:
+        st.error(f"Error en historial: {e}")
+
 # --- REPORTES ---
 elif choice == "📊 Reportes" and require_role("admin"):
+    import pandas as pd
     st.title("📊 Reportes y Análisis")
     try:
-        session = get_session()
+        session = get_read_session()
         try:
-            # Reportes de ventas por día
-            stmt_ventas = text("""
-            SELECT 
-                DATE(ts) as fecha,
-                COUNT(*) as num_ordenes,
-                SUM(total) as total_ventas
-            FROM orders 
-            GROUP BY DATE(ts) 
-            ORDER BY fecha DESC
-            LIMIT 30
-            """)
-            ventas_result = session.execute(stmt_ventas).all()
+            # Reportes de ventas por día (DATE() existe en PostgreSQL y SQLite)
+            ventas_result = session.execute(VENTAS_POR_DIA, {"limite": 30}).all()
             
             if ventas_result:
                 st.subheader("📈 Ventas por Día (Últimos 30 días)")
                 df_ventas = pd.DataFrame(ventas_result, columns=["Fecha", "Órdenes", "Total Ventas"])
                 df_ventas["Fecha"] = pd.to_datetime(df_ventas["Fecha"])
+                # El texto se formatea desde el Decimal de la base; float solo para el gráfico
+                df_display = df_ventas.copy()
+                df_display["Total Ventas"] = df_display["Total Ventas"].apply(format_money)
                 df_ventas["Total Ventas"] = df_ventas["Total Ventas"].astype(float)
                 st.line_chart(df_ventas.set_index("Fecha")["Total Ventas"])
-                df_display = df_ventas.copy()
-                df_display["Total Ventas"] = df_display["Total Ventas"].apply(lambda x: format_money(x))
                 st.dataframe(df_display, use_container_width=True, hide_index=True)
             
-            # Top productos más vendidos
-            stmt_top_productos = text("""
-            SELECT 
-                p.name as producto,
-                SUM(oi.qty) as total_vendido,
-                SUM(oi.qty * oi.price) as ingresos_totales
-            FROM order_items oi
-            JOIN products p ON p.id = oi.product_id
-            GROUP BY p.name
-            ORDER BY total_vendido DESC
-            LIMIT 10
-            """)
-            top_result = session.execute(stmt_top_productos).all()
+            perfil.marca("ventas por día")
+
+            # Top productos más vendidos (contadores por producto, sin recorrer order_items)
+            top_result = [(f"{nombre} ({sku})", cantidad, ingresos) for _, sku, nombre, cantidad, ingresos in top_productos(session, limite=10)]
             
             if top_result:
                 st.subheader("🏆 Top 10 Productos Más Vendidos")
                 df_top = pd.DataFrame(top_result, columns=["Producto", "Cantidad Vendida", "Ingresos Totales"])
-                df_top["Ingresos Totales"] = df_top["Ingresos Totales"].apply(lambda x: format_money(float(x)))
+                df_top["Ingresos Totales"] = df_top["Ingresos Totales"].apply(format_money)
                 chart_data = pd.DataFrame(top_result, columns=["Producto", "Cantidad", "Ingresos"])
+                chart_data["Cantidad"] = chart_data["Cantidad"].astype(float)
                 st.bar_chart(chart_data.set_index("Producto")["Cantidad"])
                 st.dataframe(df_top, use_container_width=True, hide_index=True)
+            if st.button("🔍 Verificar contadores de productos"):
+                # Las reparaciones leen y escriben en el primario, no en la réplica
+                session_rw = get_session()
+                try:
+                    diferencias_diario, diferencias_total = verificar_contadores(session_rw, reparar=True)
+                finally:
+                    session_rw.close()
+                if diferencias_diario or diferencias_total:
+                    st.warning(f"⚠️ Contadores reconstruidos desde order_items ({diferencias_diario} filas diarias, {diferencias_total} productos no coincidían)")
+                else:
+                    st.success("✅ Los contadores coinciden con order_items")
             
-            # Reporte de clientes frecuentes
-            stmt_clientes = text("""
-            SELECT 
-                CONCAT(c.name, ' ', COALESCE(c.last_name, '')) as cliente,
-                COUNT(o.id) as total_compras,
-                SUM(o.total) as total_gastado
-            FROM customers c
-            LEFT JOIN orders o ON c.id = o.customer_id
-            WHERE c.is_active = true
-            GROUP BY c.id, c.name, c.last_name
-            HAVING COUNT(o.id) > 0
-            ORDER BY total_compras DESC
-            LIMIT 10
-            """)
-            clientes_result = session.execute(stmt_clientes).all()
+            perfil.marca("top productos")
+
+            # Reporte de clientes frecuentes (acumulados de customer_stats, sin recorrer orders)
+            clientes_result = top_clientes(session, limite=10)
             
             if clientes_result:
                 st.subheader("🌟 Top 10 Clientes Frecuentes")
-                df_clientes = pd.DataFrame(clientes_result, columns=["Cliente", "Total Compras", "Total Gastado"])
-                df_clientes["Total Gastado"] = df_clientes["Total Gastado"].apply(lambda x: format_money(float(x)))
+                df_clientes = pd.DataFrame(clientes_result, columns=["Cliente", "Total Compras", "Total Gastado", "Última Compra"])
+                df_clientes["Total Gastado"] = df_clientes["Total Gastado"].apply(format_money)
                 st.dataframe(df_clientes, use_container_width=True, hide_index=True)
-            
+            if st.button("🔁 Recalcular acumulados de clientes"):
+                session_rw = get_session()
+                try:
+                    filas = recalcular_estadisticas(session_rw)
+                finally:
+                    session_rw.close()
+                st.success(f"✅ {filas} clientes recalculados desde las órdenes")
+
+            perfil.marca("top clientes")
+
+            # Turnos de caja: reportes Z desde los acumulados por turno (una consulta para todos)
+            st.subheader("🧾 Turnos de Caja")
+            turnos = turnos_recientes(session, limite=20)
+            if turnos:
+                for turno_rep, rep in zip(turnos, reportes_z(session, turnos)):
+                    estado = f"cerrado {rep['cerrado']:%d/%m %H:%M}" if rep["cerrado"] else "abierto"
+                    with st.expander(
+                        f"#{rep['turno']} · {turno_rep.user.username} · {turno_rep.store.name} · "
+                        f"{rep['abierto']:%d/%m/%Y %H:%M} ({estado}) · {rep['ventas']} ventas · {format_money(rep['total'])}"
+                    ):
+                        mostrar_reporte_z(rep)
+            else:
+                st.info("Aún no hay turnos registrados")
+            if st.button("🔍 Verificar acumulados de turnos"):
+                session_rw = get_session()
+                try:
+                    diferencias_turnos = verificar_turnos(session_rw, reparar=True)
+                finally:
+                    session_rw.close()
+                if diferencias_turnos:
+                    st.warning(f"⚠️ {diferencias_turnos} acumulados de turno no coincidían con las órdenes y se reconstruyeron")
+                else:
+                    st.success("✅ Los acumulados de turnos coinciden con las órdenes")
+
+            perfil.marca("turnos")
+
+            # Plan de producción (generado por forecast.py o desde aquí)
+            st.subheader("🥖 Producción Sugerida para Mañana")
+            manana = date.today() + timedelta(days=1)
+            if st.button("🔄 Generar plan de producción"):
+                from forecast import generar_plan
+                session_rw = get_session()
+                try:
+                    resumen = generar_plan(session_rw, fecha=manana, workers=1)
+                finally:
+                    session_rw.close()
+                st.success(f"✅ Plan generado en {resumen['tiempos']['total'] * 1000:.0f} ms ({resumen['filas']} productos)")
+            plan = session.query(ProductionPlan, Product.name, Store.name).join(
+                Product, Product.id == ProductionPlan.product_id
+            ).join(Store, Store.id == ProductionPlan.store_id).filter(ProductionPlan.day == manana).order_by(
+                Store.name, Product.name
+            ).all()
+            if plan:
+                df_plan = pd.DataFrame([{
+                    "Tienda": tienda,
+                    "Producto": producto,
+                    "Demanda estimada": float(pp.forecast or 0),
+                    "A producir": pp.qty
+                } for pp, producto, tienda in plan])
+                st.dataframe(df_plan, use_container_width=True, hide_index=True)
+            else:
+                st.info("Aún no hay plan de producción para mañana")
+
+            perfil.marca("plan de producción")
+
             st.subheader("📋 Resumen General")
             total_productos = session.query(func.count(Product.id)).scalar() or 0
             total_usuarios = session.query(func.count(User.id)).scalar() or 0
@@ -988,9 +1307,10 @@ elif choice == "📊 Reportes" and require_role("admin"):
 
 # --- ADMIN ---
 elif choice == "⚙️ Administración" and require_role("admin"):
+    import pandas as pd
     st.title("⚙️ Panel de Administración")
     
-    tabs = st.tabs(["👥 Usuarios", "🏪 Tiendas", "🚚 Proveedores", "🧾 Ingredientes", "👤 Gestión Clientes"])
+    tabs = st.tabs(["👥 Usuarios", "🏪 Tiendas", "🚚 Proveedores", "🧾 Ingredientes", "👤 Gestión Clientes", "🥣 Recetas", "📤 Exportar", "📥 Importar", "📈 Consultas SQL", "⏱️ Rendimiento", "🏷️ Promociones"])
     
     # TAB: Usuarios
     with tabs[0]:
@@ -1034,6 +1354,7 @@ elif choice == "⚙️ Administración" and require_role("admin"):
                 
                 if submit_user:
                     if new_username and new_password:
+                        from werkzeug.security import generate_password_hash
                         try:
                             session = get_session()
                             try:
@@ -1060,6 +1381,8 @@ elif choice == "⚙️ Administración" and require_role("admin"):
         except Exception as e:
             st.error(f"Error en gestión de usuarios: {e}")
     
+    perfil.marca("tab usuarios")
+
     # TAB: Tiendas
     with tabs[1]:
         st.subheader("🏪 Gestión de Tiendas")
@@ -1116,6 +1439,8 @@ elif choice == "⚙️ Administración" and require_role("admin"):
         except Exception as e:
             st.error(f"Error en gestión de tiendas: {e}")
     
+    perfil.marca("tab tiendas")
+
     # TAB: Proveedores
     with tabs[2]:
         st.subheader("🚚 Gestión de Proveedores")
@@ -1182,6 +1507,8 @@ elif choice == "⚙️ Administración" and require_role("admin"):
         except Exception as e:
             st.error(f"Error en gestión de proveedores: {e}")
     
+    perfil.marca("tab proveedores")
+
     # TAB: Ingredientes
     with tabs[3]:
         st.subheader("🧾 Gestión de Ingredientes")
@@ -1190,6 +1517,8 @@ elif choice == "⚙️ Administración" and require_role("admin"):
             session = get_session()
             try:
                 ingredientes = session.query(Ingredient).order_by(Ingredient.name).all()
+                stock_actual = dict(session.query(IngredientStock.ingredient_id, IngredientStock.qty).all())
+                proveedores_activos = session.query(Supplier).filter_by(is_active=True).order_by(Supplier.name).all()
             finally:
                 session.close()
             
@@ -1198,7 +1527,8 @@ elif choice == "⚙️ Administración" and require_role("admin"):
                     "ID": i.id,
                     "Nombre": i.name,
                     "Unidad": i.unit,
-                    "Costo por Unidad": format_money(i.cost_per_unit) if i.cost_per_unit else "N/A"
+                    "Costo por Unidad": format_money(i.cost_per_unit) if i.cost_per_unit else "N/A",
+                    "Stock": f"{stock_actual.get(i.id, 0):.2f} {i.unit}"
                 } for i in ingredientes])
                 
                 st.dataframe(df_ingredients, use_container_width=True, hide_index=True)
@@ -1234,6 +1564,7 @@ elif choice == "⚙️ Administración" and require_role("admin"):
                                 )
                                 session.add(nuevo_ingrediente)
                                 session.commit()
+                                motor_costos.set_costo_ingrediente(nuevo_ingrediente.id, Decimal(str(ingredient_cost)))
                                 st.success("✅ Ingrediente creado exitosamente")
                                 st.rerun()
                             finally:
@@ -1243,10 +1574,101 @@ elif choice == "⚙️ Administración" and require_role("admin"):
                             st.error(f"❌ Error: {e}")
                     else:
                         st.error("❌ El nombre es obligatorio")
+
+            if ingredientes:
+                st.markdown("---")
+                st.subheader("💲 Actualizar Costo")
+
+                with st.form("ingredient_cost_form"):
+                    col1, col2 = st.columns(2)
+
+                    with col1:
+                        ingrediente_costo = st.selectbox("Ingrediente", ingredientes, format_func=lambda i: f"{i.name} ({i.unit})")
+
+                    with col2:
+                        nuevo_costo = st.number_input("Nuevo costo por unidad (S/)", min_value=0.0001, value=1.00, step=0.10, format="%.4f")
+
+                    submit_costo = st.form_submit_button("💾 Actualizar Costo", use_container_width=True)
+
+                    if submit_costo:
+                        try:
+                            session = get_session()
+                            try:
+                                ing = session.get(Ingredient, ingrediente_costo.id)
+                                ing.cost_per_unit = Decimal(str(nuevo_costo))
+                                session.commit()
+                            finally:
+                                session.close()
+                            # Solo se recalculan los productos cuya receta usa este ingrediente
+                            afectados = motor_costos.set_costo_ingrediente(ingrediente_costo.id, Decimal(str(nuevo_costo)))
+                            st.success(f"✅ Costo actualizado ({len(afectados)} productos recalculados)")
+                        except Exception as e:
+                            st.error(f"❌ Error: {e}")
+
+                st.markdown("---")
+                st.subheader("📦 Movimiento de Inventario")
+
+                with st.form("inventory_form"):
+                    col1, col2, col3 = st.columns(3)
+
+                    with col1:
+                        ingrediente_mov = st.selectbox("Ingrediente", ingredientes, format_func=lambda i: f"{i.name} ({i.unit})", key="mov_ingrediente")
+                        tipo_mov = st.selectbox("Tipo", ["compra", "merma", "ajuste"])
+
+                    with col2:
+                        cantidad_mov = st.number_input("Cantidad", value=1.0, step=0.5, format="%.4f", help="En ajustes, negativo descuenta stock")
+                        proveedor_mov = st.selectbox("Proveedor (compras)", [None] + proveedores_activos, format_func=lambda s: s.name if s else "—")
+
+                    with col3:
+                        nota_mov = st.text_input("Nota", placeholder="Factura 001-123")
+
+                    submit_mov = st.form_submit_button("💾 Registrar Movimiento", use_container_width=True)
+
+                    if submit_mov:
+                        try:
+                            session = get_session()
+                            try:
+                                cantidad = Decimal(str(cantidad_mov))
+                                if tipo_mov == "compra":
+                                    registrar_compra(session, ingrediente_mov.id, cantidad, proveedor_mov.id if proveedor_mov else None, nota_mov or None)
+                                elif tipo_mov == "merma":
+                                    registrar_merma(session, ingrediente_mov.id, cantidad, nota_mov or None)
+                                else:
+                                    registrar_movimientos(session, [{"ingredient_id": ingrediente_mov.id, "kind": "ajuste", "qty": cantidad, "note": nota_mov or None}])
+                                session.commit()
+                                st.success("✅ Movimiento registrado")
+                                st.rerun()
+                            finally:
+                                session.close()
+                        except Exception as e:
+                            st.error(f"❌ Error: {e}")
+
+                col_snap, col_verif = st.columns(2)
+                with col_snap:
+                    if st.button("📸 Tomar snapshot de stock", use_container_width=True):
+                        session = get_session()
+                        try:
+                            hasta = tomar_snapshot(session)
+                            st.success(f"✅ Snapshot hasta el movimiento #{hasta}" if hasta else "No hay movimientos registrados")
+                        finally:
+                            session.close()
+                with col_verif:
+                    if st.button("🔍 Verificar y reparar stock", use_container_width=True):
+                        session = get_session()
+                        try:
+                            diferencias = verificar_stock(session, reparar=True)
+                            if diferencias:
+                                st.warning(f"⚠️ {len(diferencias)} ingredientes corregidos desde el libro de movimientos")
+                            else:
+                                st.success("✅ El stock coincide con el libro de movimientos")
+                        finally:
+                            session.close()
         
         except Exception as e:
             st.error(f"Error en gestión de ingredientes: {e}")
     
+    perfil.marca("tab ingredientes")
+
     # TAB: Gestión de Clientes (Admin)
     with tabs[4]:
         st.subheader("👤 Gestión Avanzada de Clientes")
@@ -1287,12 +1709,334 @@ elif choice == "⚙️ Administración" and require_role("admin"):
         except Exception as e:
             st.error(f"Error en gestión avanzada de clientes: {e}")
 
+    perfil.marca("tab gestión de clientes")
+
+    # TAB: Recetas y costos
+    with tabs[5]:
+        st.subheader("🥣 Recetas y Márgenes")
+
+        try:
+            session = get_session()
+            try:
+                productos_receta = session.query(Product).order_by(Product.name).all()
+                ingredientes_receta = session.query(Ingredient).order_by(Ingredient.name).all()
+                motor_costos.refrescar(session)
+            finally:
+                session.close()
+
+            if productos_receta:
+                filas_margen = []
+                for p in productos_receta:
+                    margen, margen_pct = motor_costos.margen(p.id)
+                    filas_margen.append({
+                        "SKU": p.sku,
+                        "Producto": p.name,
+                        "Precio": format_money(p.price),
+                        "Costo": format_money(motor_costos.costo(p.id)),
+                        "Margen": format_money(margen),
+                        "Margen %": f"{margen_pct:.1f}%"
+                    })
+                st.dataframe(pd.DataFrame(filas_margen), use_container_width=True, hide_index=True)
+
+            if productos_receta and ingredientes_receta:
+                st.markdown("---")
+                st.subheader("✏️ Editar Receta")
+
+                producto_receta = st.selectbox("Producto", productos_receta, format_func=lambda p: f"{p.name} ({p.sku})", key="receta_producto")
+                receta_actual = motor_costos.recetas.get(producto_receta.id, {})
+
+                with st.form("recipe_form"):
+                    st.caption("Cantidad de cada ingrediente por unidad de producto (0 = no se usa)")
+                    cantidades = {}
+                    for ing in ingredientes_receta:
+                        cantidades[ing.id] = st.number_input(
+                            f"{ing.name} ({ing.unit})",
+                            min_value=0.0,
+                            value=float(receta_actual.get(ing.id, 0)),
+                            step=0.01,
+                            format="%.4f",
+                            key=f"receta_{producto_receta.id}_{ing.id}"
+                        )
+
+                    submit_receta = st.form_submit_button("💾 Guardar Receta", use_container_width=True)
+
+                    if submit_receta:
+                        receta = {ing_id: Decimal(str(qty)) for ing_id, qty in cantidades.items() if qty > 0}
+                        try:
+                            session = get_session()
+                            try:
+                                session.query(RecipeItem).filter_by(product_id=producto_receta.id).delete()
+                                session.add_all([
+                                    RecipeItem(product_id=producto_receta.id, ingredient_id=ing_id, qty=qty)
+                                    for ing_id, qty in receta.items()
+                                ])
+                                session.commit()
+                            finally:
+                                session.close()
+                            motor_costos.set_receta(producto_receta.id, receta)
+                            st.success("✅ Receta guardada")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"❌ Error: {e}")
+
+        except Exception as e:
+            st.error(f"Error en recetas: {e}")
+
+    perfil.marca("tab recetas y costos")
+
+    # TAB: Exportar
+    with tabs[6]:
+        st.subheader("📤 Exportar Datos")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            tipo_export = st.selectbox("Datos", list(EXPORTS), format_func=lambda t: {"orders": "🧾 Órdenes (con items)", "customers": "👥 Clientes", "products": "🛒 Productos"}[t])
+        with col2:
+            formato_export = st.selectbox("Formato", FORMATOS)
+
+        def descartar_export():
+            """Borra el archivo temporal de la exportación anterior de esta sesión"""
+            anterior = st.session_state.pop("export", None)
+            if anterior and os.path.exists(anterior[0]):
+                os.remove(anterior[0])
+
+        if st.button("📦 Generar archivo", use_container_width=True):
+            descartar_export()
+            ruta_export = None
+            try:
+                # El archivo se escribe por lotes en disco; nunca se cargan todas las filas en memoria.
+                # Un archivo propio por pedido: dos exportaciones simultáneas no se pisan
+                fd, ruta_export = tempfile.mkstemp(prefix=f"chamo_{tipo_export}_", suffix=f".{formato_export}")
+                os.close(fd)
+                session = get_read_session()
+                try:
+                    filas_export = exportar(session, tipo_export, ruta_export)
+                finally:
+                    session.close()
+                st.session_state["export"] = (ruta_export, filas_export, f"chamo_{tipo_export}.{formato_export}")
+            except Exception as e:
+                if ruta_export and os.path.exists(ruta_export):
+                    os.remove(ruta_export)
+                st.error(f"❌ Error al exportar: {e}")
+
+        if st.session_state.get("export"):
+            ruta_export, filas_export, nombre_export = st.session_state["export"]
+            st.success(f"✅ {filas_export} filas exportadas")
+            with open(ruta_export, "rb") as archivo_export:
+                st.download_button(
+                    "⬇️ Descargar",
+                    data=archivo_export,
+                    file_name=nombre_export,
+                    mime="text/csv" if ruta_export.endswith(".csv") else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    on_click=descartar_export  # los datos ya se entregaron al navegador
+                )
+
+    perfil.marca("tab exportar")
+
+    # TAB: Importar
+    with tabs[7]:
+        st.subheader("📥 Importación Masiva (CSV)")
+
+        tipo_import = st.selectbox("Datos a importar", list(IMPORTS), format_func=lambda t: {"products": "🛒 Productos (por SKU)", "customers": "👥 Clientes", "ingredients": "🧾 Ingredientes (por nombre)", "suppliers": "🚚 Proveedores (por nombre)"}[t])
+        st.caption("Columnas: " + ", ".join(
+            f"**{c}**" if obligatoria else c for c, (_, obligatoria) in IMPORTS[tipo_import]["columnas"].items()
+        ) + " (en negrita las obligatorias). Las filas existentes se actualizan.")
+        archivo_import = st.file_uploader("Archivo CSV", type=["csv"])
+
+        if archivo_import and st.button("🚀 Importar", use_container_width=True):
+            try:
+                session = get_session()
+                try:
+                    resultado = importar_csv(session, tipo_import, io.TextIOWrapper(archivo_import, encoding="utf-8-sig", newline=""))
+                finally:
+                    session.close()
+                if tipo_import in ("products", "ingredients"):
+                    motor_costos.listo = False  # precios y costos cambiaron: recargar
+                st.success(f"✅ {resultado['escritas']} filas importadas")
+                if resultado["errores"]:
+                    st.warning(f"⚠️ {len(resultado['errores'])} filas con errores")
+                    st.dataframe(pd.DataFrame(resultado["errores"], columns=["Línea", "Error"]), use_container_width=True, hide_index=True)
+            except Exception as e:
+                st.error(f"❌ Error al importar: {e}")
+
+    perfil.marca("tab importar")
+
+    # TAB: Consultas SQL
+    with tabs[8]:
+        st.subheader("📈 Instrumentación de Consultas SQL")
+
+        if not SQL_PROFILE_ACTIVO:
+            st.info("💡 La instrumentación está desactivada. Inicia la app con `CHAMO_SQL_PROFILE=1` "
+                    "(umbrales opcionales: `CHAMO_SLOW_QUERY_MS`, `CHAMO_N1_THRESHOLD`).")
+        else:
+            st.caption(f"Consulta lenta: ≥ {profiler.lenta_ms:.0f} ms · Posible N+1: ≥ {profiler.umbral_n1} ejecuciones de la misma sentencia en un rerun")
+
+            st.markdown("**Por página**")
+            df_paginas = pd.DataFrame([
+                {"Página": p, "Reruns": v["reruns"], "Consultas": v["consultas"],
+                 "Consultas/rerun": v["consultas"] / v["reruns"] if v["reruns"] else 0, "Tiempo SQL (ms)": v["segundos"] * 1000}
+                for p, v in list(profiler.paginas.items())
+            ])
+            st.dataframe(df_paginas, use_container_width=True, hide_index=True)
+
+            st.markdown("**Sentencias (por tiempo total)**")
+            resumen_sql = profiler.resumen()
+            if resumen_sql:
+                df_sql = pd.DataFrame(resumen_sql[:50]).rename(columns={
+                    "id": "ID", "sql": "SQL", "count": "Ejecuciones", "total_ms": "Total (ms)", "avg_ms": "Promedio (ms)", "max_ms": "Máx (ms)"
+                })
+                st.dataframe(df_sql, use_container_width=True, hide_index=True)
+            else:
+                st.info("Aún no hay consultas registradas")
+
+            if profiler.n_mas_1:
+                st.markdown("**⚠️ Posibles N+1**")
+                st.dataframe(pd.DataFrame(
+                    [{"Página": p, "Ejecuciones en un rerun": n, "SQL": sql} for (p, sql), n in list(profiler.n_mas_1.items())]
+                ), use_container_width=True, hide_index=True)
+
+            if profiler.lentas:
+                st.markdown("**🐢 Consultas lentas (últimas 100)**")
+                st.dataframe(pd.DataFrame([
+                    {"Hora": datetime.fromtimestamp(l["ts"]).strftime("%H:%M:%S"), "Página": l["pagina"], "ms": l["ms"], "SQL": l["sql"], "Parámetros": l["parametros"]}
+                    for l in reversed(list(profiler.lentas))
+                ]), use_container_width=True, hide_index=True)
+
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.download_button("💾 Descargar JSON", data=profiler.a_json(), file_name="consultas_sql.json", mime="application/json", use_container_width=True)
+            with col2:
+                st.download_button("💾 Descargar Prometheus", data=profiler.a_prometheus(), file_name="consultas_sql.prom", mime="text/plain", use_container_width=True)
+            with col3:
+                if st.button("🗑️ Reiniciar métricas", use_container_width=True):
+                    profiler.reiniciar()
+                    st.rerun()
+
+    perfil.marca("tab consultas sql")
+
+    # TAB: Rendimiento por página
+    with tabs[9]:
+        st.subheader("⏱️ Tiempos por Página (p50 / p95)")
+
+        if not PERFIL_ACTIVO:
+            st.info("💡 El perfilado está desactivado. Inicia la app con `CHAMO_PROFILE=1`; "
+                    "con `CHAMO_SQL_PROFILE=1` además se separa el tiempo SQL de cada tramo.")
+        else:
+            st.caption(f"Últimos reruns por página y tramo, guardados en `{perfil.ruta}`")
+            try:
+                filas_perf = perfil.percentiles()
+            except Exception as e:
+                filas_perf = []
+                st.error(f"❌ Error al leer métricas: {e}")
+            if filas_perf:
+                pagina_perf = st.selectbox("Página", sorted({f["pagina"] for f in filas_perf}), key="perf_pagina")
+                st.dataframe(pd.DataFrame([
+                    {"Tramo": f["tramo"], "Reruns": f["n"], "p50 (ms)": round(f["p50"], 1), "p95 (ms)": round(f["p95"], 1), "SQL p50 (ms)": round(f["sql_p50"], 1)}
+                    for f in filas_perf if f["pagina"] == pagina_perf
+                ]), use_container_width=True, hide_index=True)
+            else:
+                st.info("Aún no hay métricas registradas")
+            if st.button("🗑️ Borrar métricas de rendimiento"):
+                perfil.borrar()
+                st.rerun()
+
+    # TAB: Promociones
+    with tabs[10]:
+        st.subheader("🏷️ Promociones")
+        st.caption("Por línea del carrito se aplica la promoción que más descuenta; los campos vacíos no restringen.")
+
+        try:
+            session = get_session()
+            try:
+                promos = session.query(Promotion).order_by(Promotion.id.desc()).all()
+                productos_promo = session.query(Product).filter(Product.is_active == True).order_by(Product.name).all()
+                nombres_prod = {p.id: p.name for p in productos_promo}
+
+                if promos:
+                    st.dataframe(pd.DataFrame([{
+                        "ID": p.id,
+                        "Nombre": p.name,
+                        "Tipo": TIPOS_PROMOCION.get(p.kind, p.kind),
+                        "Producto": nombres_prod.get(p.product_id, "—") if p.product_id else "—",
+                        "Categoría": p.category or "—",
+                        "Cliente / Doc.": f"#{p.customer_id}" if p.customer_id else (p.document_type or "—"),
+                        "Desde cant.": float(p.min_qty or 0),
+                        "Precio / monto": format_money(p.price) if p.price is not None else "—",
+                        "%": float(p.percent) if p.percent is not None else "—",
+                        "Estado": "✅ Activa" if p.is_active else "⏸️ Pausada",
+                    } for p in promos]), use_container_width=True, hide_index=True)
+
+                    promo_sel = st.selectbox("Promoción", promos, format_func=lambda p: f"#{p.id} {p.name}", key="promo_sel")
+                    if st.button("⏯️ Activar / pausar", key="promo_toggle"):
+                        promo_sel.is_active = not promo_sel.is_active
+                        session.commit()
+                        st.rerun()
+            finally:
+                session.close()
+
+            st.markdown("---")
+            st.subheader("➕ Nueva Promoción")
+
+            with st.form("promo_form"):
+                promo_nombre = st.text_input("Nombre", placeholder="50 panes franceses a precio mayorista")
+                promo_tipo = st.selectbox("Tipo", list(TIPOS_PROMOCION), format_func=TIPOS_PROMOCION.get)
+                promo_producto = st.selectbox("Producto", [None] + productos_promo, format_func=lambda p: p.name if p else "(cualquiera)")
+                promo_categoria = st.text_input("Categoría", placeholder="(cualquiera)")
+                promo_documento = st.selectbox("Tipo de documento del cliente", [None, "RUC", "DNI", "CE"],
+                                               format_func=lambda d: d or "(cualquiera)")
+                promo_combo = st.selectbox("Combo con", [None] + productos_promo, format_func=lambda p: p.name if p else "(solo para combos)")
+                promo_min = st.number_input("Desde la cantidad", min_value=0.0, value=0.0, step=1.0)
+                promo_precio = st.number_input("Precio unitario (mayorista) o monto por combo (S/)", min_value=0.0, value=0.0, step=0.10)
+                promo_pct = st.number_input("Porcentaje de descuento", min_value=0.0, max_value=100.0, value=0.0, step=1.0)
+
+                if st.form_submit_button("💾 Crear Promoción", use_container_width=True):
+                    if not promo_nombre:
+                        st.error("❌ El nombre es obligatorio")
+                    elif promo_tipo == "combo" and not (promo_producto and promo_combo):
+                        st.error("❌ Un combo necesita producto y producto de combo")
+                    else:
+                        try:
+                            session = get_session()
+                            try:
+                                session.add(Promotion(
+                                    name=promo_nombre,
+                                    kind=promo_tipo,
+                                    product_id=promo_producto.id if promo_producto else None,
+                                    category=promo_categoria.strip() or None,
+                                    document_type=promo_documento,
+                                    combo_product_id=promo_combo.id if promo_combo and promo_tipo == "combo" else None,
+                                    min_qty=Decimal(str(promo_min)),
+                                    price=Decimal(str(promo_precio)) if promo_tipo in ("mayorista", "combo") else None,
+                                    percent=Decimal(str(promo_pct)) if promo_tipo == "porcentaje" else None,
+                                ))
+                                session.commit()
+                                st.success("✅ Promoción creada")
+                                st.rerun()
+                            finally:
+                                session.close()
+                        except Exception as e:
+                            st.error(f"❌ Error: {e}")
+
+        except Exception as e:
+            st.error(f"Error en promociones: {e}")
+
 else:
     if not require_login():
         st.warning("⚠️ Debes iniciar sesión para acceder a esta sección")
     elif not require_role("admin"):
         st.error("❌ No tienes permisos para acceder a esta sección")
 
+profiler.terminar_rerun()
+tramos_rerun, texto_perfil = perfil.terminar_rerun()
+if PERFIL_ACTIVO:
+    with st.sidebar.expander("⏱️ Perfil del rerun"):
+        for nombre, ms, sql_ms in tramos_rerun:
+            st.caption(f"{nombre}: {ms:.0f} ms" + (f" · SQL {sql_ms:.0f} ms" if sql_ms >= 1 else ""))
+        st.checkbox("🔬 Perfilar reruns (cProfile/pyinstrument)", key="perfilar_rerun")
+    if texto_perfil:
+        with st.expander("🔬 Perfil de este rerun"):
+            st.code(texto_perfil)
+
 st.markdown("---")
 st.markdown("""
 <div style='text-align: center; color: #666; padding: 20px;'>
@@ -0,0 +1,1098 @@
+"""Benchmarks del sistema de panadería
+
+Uso: python bench.py <nombre>   (sin nombre lista los disponibles)
+"""
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+BENCHES = {}
+os.environ.setdefault("CHAMO_DB", "sqlite")  # cada benchmark crea su propia base; db.py solo necesita una URL
+
+def bench(fn):
+    BENCHES[fn.__name__] = fn
+    return fn
+
+def cronometrar(etiqueta, fn, *args):
+    inicio = time.perf_counter()
+    resultado = fn(*args)
+    print(f"{etiqueta}: {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    return resultado
+
+def sesion_sqlite(ruta=":memory:"):
+    """Sesión sobre una base SQLite nueva con todas las tablas creadas"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from db import Base
+
+    engine = create_engine(f"sqlite:///{ruta}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+def poblar(session, ordenes=10_000, items_por_orden=3, productos=200, clientes=2000, tiendas=3):
+    """Inserta datos sintéticos: tiendas, un cajero, clientes, productos y órdenes con items"""
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+    from db import Customer, Order, OrderItem, Product, Store, User
+
+    rnd = random.Random(7)
+    session.execute(insert(Store), [{"id": i, "name": f"Tienda {i}"} for i in range(1, tiendas + 1)])
+    session.execute(insert(User), [{"id": 1, "username": "cajero", "password": "-", "role": "cajero"}])
+    session.execute(insert(Customer), [
+        {"id": i, "name": f"Cliente{i}", "last_name": f"Apellido{i % 97}", "document_type": "DNI",
+         "document_number": f"{10000000 + i}", "phone": f"999-{i:06d}"}
+        for i in range(1, clientes + 1)
+    ])
+    precios = {i: Decimal(rnd.randint(40, 2000)) / 100 for i in range(1, productos + 1)}
+    session.execute(insert(Product), [
+        {"id": i, "sku": f"SKU-{i:05d}", "name": f"Producto {i}", "price": precio, "category": f"Cat {i % 8}"}
+        for i, precio in precios.items()
+    ])
+
+    inicio = datetime.utcnow() - timedelta(days=90)
+    lote_ordenes, lote_items = [], []
+    item_id = 1
+    for orden_id in range(1, ordenes + 1):
+        lineas = [(rnd.randint(1, productos), Decimal(rnd.randint(1, 20))) for _ in range(items_por_orden)]
+        for product_id, qty in lineas:
+            lote_items.append({"id": item_id, "order_id": orden_id, "product_id": product_id,
+                               "qty": qty, "price": precios[product_id]})
+            item_id += 1
+        lote_ordenes.append({
+            "id": orden_id, "user_id": 1, "store_id": rnd.randint(1, tiendas),
+            "customer_id": rnd.choice([None, rnd.randint(1, clientes)]),
+            "total": sum(qty * precios[p] for p, qty in lineas),
+            "ts": inicio + timedelta(seconds=orden_id * 90 * 86400 // ordenes),
+        })
+        if len(lote_ordenes) == 5000:
+            session.execute(insert(Order), lote_ordenes)
+            session.execute(insert(OrderItem), lote_items)
+            lote_ordenes, lote_items = [], []
+    if lote_ordenes:
+        session.execute(insert(Order), lote_ordenes)
+        session.execute(insert(OrderItem), lote_items)
+    session.commit()
+
+
+# === COSTOS POR RECETA ===
+
+@bench
+def costos(n_productos=5000, n_ingredientes=300, por_receta=8, cambios=1000):
+    """Carga completa vs recálculo incremental al cambiar costos de ingredientes"""
+    from costing import CostEngine
+
+    rnd = random.Random(42)
+    ingredientes = [(i, Decimal(rnd.randint(50, 2000)) / 100) for i in range(n_ingredientes)]
+    productos = [(p, Decimal(rnd.randint(40, 5000)) / 100) for p in range(n_productos)]
+    recetas = [
+        (p, i, Decimal(rnd.randint(1, 500)) / 1000)
+        for p in range(n_productos)
+        for i in rnd.sample(range(n_ingredientes), por_receta)
+    ]
+
+    motor = CostEngine()
+    cronometrar(f"Carga inicial ({n_productos} recetas)", motor.cargar_datos, ingredientes, productos, recetas)
+
+    motor.recalculos = 0
+    def incremental():
+        for _ in range(cambios):
+            motor.set_costo_ingrediente(rnd.randrange(n_ingredientes), Decimal(rnd.randint(50, 2000)) / 100)
+    cronometrar(f"{cambios} cambios de costo (incremental)", incremental)
+    print(f"  productos recalculados: {motor.recalculos} (vs {cambios * n_productos} recalculando todo)")
+
+    def completo():
+        for _ in range(10):
+            motor.cargar_datos(list(motor.costo_ingrediente.items()), productos, recetas)
+    cronometrar("10 recálculos completos", completo)
+
+    # Contra la base: otro worker cambia un costo, una receta y borra una línea
+    from sqlalchemy import delete, insert, update
+    from db import Ingredient, Product, RecipeItem
+    session = sesion_sqlite()
+    session.execute(insert(Ingredient), [{"id": i + 1, "name": f"Ing {i}", "unit": "kg", "cost_per_unit": c}
+                                         for i, c in ingredientes])
+    session.execute(insert(Product), [{"id": p + 1, "sku": f"SKU-{p}", "name": f"P {p}", "price": precio}
+                                      for p, precio in productos])
+    session.execute(insert(RecipeItem), [{"product_id": p + 1, "ingredient_id": i + 1, "qty": q} for p, i, q in recetas])
+    session.commit()
+    motor = CostEngine()
+    cronometrar("refrescar: carga inicial desde la base", motor.refrescar, session)
+    repeticiones = 200
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        assert not motor.refrescar(session)
+    print(f"refrescar sin cambios: {(time.perf_counter() - inicio) / repeticiones * 1e6:.0f} µs")
+
+    ing_id, product_id = recetas[0][1] + 1, recetas[0][0] + 1
+    time.sleep(0.01)  # updated_at posterior a la última marca vista
+    session.execute(update(Ingredient).where(Ingredient.id == ing_id).values(cost_per_unit=Decimal("99")))
+    session.execute(update(RecipeItem).where(RecipeItem.product_id == product_id, RecipeItem.ingredient_id == ing_id)
+                    .values(qty=Decimal("2")))
+    session.commit()
+    motor.recalculos = 0
+    assert cronometrar("refrescar tras cambiar un costo y una receta", motor.refrescar, session)
+    print(f"  productos recalculados: {motor.recalculos}")
+    assert motor.recetas[product_id][ing_id] == 2 and motor.costo_ingrediente[ing_id] == 99
+
+    session.execute(delete(RecipeItem).where(RecipeItem.product_id == product_id, RecipeItem.ingredient_id == ing_id))
+    session.commit()
+    assert motor.refrescar(session) and ing_id not in motor.recetas[product_id]
+    esperado = CostEngine()
+    esperado.cargar(session)
+    assert motor.costos == esperado.costos
+    session.close()
+
+
+# === EXPORTACIÓN EN STREAMING ===
+
+@bench
+def exportar(ordenes=100_000):
+    """Filas/segundo y memoria pico del export de órdenes (streaming vs .all())"""
+    import os
+    import resource
+    import tempfile
+    import tracemalloc
+    from db import Order
+    from export import EXPORTS, exportar_csv
+
+    with tempfile.TemporaryDirectory() as tmp:
+        session = sesion_sqlite(os.path.join(tmp, "bench.db"))
+        cronometrar(f"Datos de prueba ({ordenes} órdenes)", poblar, session, ordenes)
+
+        for chunk in (1000, 5000):
+            tracemalloc.start()
+            inicio = time.perf_counter()
+            with open(os.devnull, "w", newline="") as destino:
+                filas = exportar_csv(session, "orders", destino, chunk)
+            segundos = time.perf_counter() - inicio
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"streaming chunk={chunk}: {filas} filas, {filas / segundos:,.0f} filas/s, pico {pico / 1e6:.1f} MB")
+
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        filas = len(session.execute(EXPORTS["orders"][1]()).all())
+        segundos = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"materializando .all(): {filas} filas, {filas / segundos:,.0f} filas/s, pico {pico / 1e6:.1f} MB")
+        print(f"RSS máximo del proceso: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+        # Una orden sin items (p. ej. anulada) también sale en el export
+        session.add(Order(id=ordenes + 1, user_id=1, store_id=1, total=0))
+        session.commit()
+        with open(os.path.join(tmp, "orders.csv"), "w+", newline="") as destino:
+            exportar_csv(session, "orders", destino)
+            destino.seek(0)
+            assert sum(fila.startswith(f"{ordenes + 1},") for fila in destino) == 1
+        session.close()
+
+
+# === IMPORTACIÓN MASIVA ===
+
+@bench
+def importar(filas=5000):
+    """Filas/segundo del import por lotes vs un add + commit por fila (ruta de los formularios)"""
+    import io
+    from db import Product
+    from importer import importar_csv
+
+    csv_productos = "sku,name,price,category\n" + "".join(
+        f"SKU-{i:06d},Producto {i},{(i % 500) / 10 + 0.4:.2f},Cat {i % 8}\n" for i in range(filas)
+    )
+
+    session = sesion_sqlite()
+    inicio = time.perf_counter()
+    for fila in csv_productos.splitlines()[1:]:
+        sku, name, price, category = fila.split(",")
+        session.add(Product(sku=sku, name=name, price=Decimal(price), category=category))
+        session.commit()
+    segundos = time.perf_counter() - inicio
+    print(f"ORM fila por fila: {filas / segundos:,.0f} filas/s")
+    session.close()
+
+    session = sesion_sqlite()
+    for etiqueta in ("import por lotes (insert)", "import por lotes (upsert sobre existentes)"):
+        inicio = time.perf_counter()
+        resultado = importar_csv(session, "products", io.StringIO(csv_productos))
+        segundos = time.perf_counter() - inicio
+        print(f"{etiqueta}: {resultado['escritas'] / segundos:,.0f} filas/s, {len(resultado['errores'])} errores")
+    session.close()
+
+
+# === BÚSQUEDA DE CLIENTES ===
+
+@bench
+def busqueda(clientes=50_000, consultas=1000):
+    """Carga del índice de clientes y latencia de búsqueda por prefijo"""
+    from customer_search import CustomerIndex
+
+    session = sesion_sqlite()
+    poblar(session, ordenes=0, clientes=clientes)
+    indice = CustomerIndex()
+    cronometrar(f"Carga inicial ({clientes} clientes)", indice.refrescar, session)
+    cronometrar("Refresco sin clientes nuevos", indice.refrescar, session)
+
+    rnd = random.Random(3)
+    textos = [rnd.choice([f"cliente{rnd.randint(1, clientes)}", f"apellido{rnd.randint(0, 96)} cli",
+                          f"{10000000 + rnd.randint(1, clientes)}"[:6], "cli"]) for _ in range(consultas)]
+    inicio = time.perf_counter()
+    for texto in textos:
+        indice.buscar(texto, limite=20)
+    print(f"{consultas} búsquedas: {(time.perf_counter() - inicio) / consultas * 1000:.3f} ms por búsqueda")
+    session.close()
+
+
+# === RERUN DEL POS SEGÚN TAMAÑO DEL CATÁLOGO ===
+
+_POS_GRID = """
+import streamlit as st
+productos = [(i, f"SKU-{i:05d}", f"Producto {i}") for i in range({n})]
+for i in range(0, len(productos), 2):
+    cols = st.columns(2)
+    for j, col in enumerate(cols):
+        if i + j < len(productos):
+            pid, sku, nombre = productos[i + j]
+            with col:
+                st.write(f"**{nombre}**")
+                st.caption(f"SKU: {sku}")
+                st.number_input("Cantidad", min_value=0.0, step=1.0, key=f"input_qty_pos_{pid}")
+                st.button("➕ Agregar", key=f"btn_{pid}", use_container_width=True)
+"""
+
+_POS_ESCANEO = """
+import streamlit as st
+from decimal import Decimal
+from types import SimpleNamespace
+from catalog import ProductCatalog, agregar_escaneo
+catalogo = ProductCatalog([SimpleNamespace(id=i, sku=f"SKU-{i:05d}", price=Decimal("1.50")) for i in range({n})])
+with st.form("scan_form", clear_on_submit=True):
+    entrada = st.text_input("Escanear o escribir SKU")
+    if st.form_submit_button("Agregar") and entrada:
+        agregar_escaneo(catalogo, st.session_state.setdefault("carrito", {}), entrada)
+st.toggle("Mostrar catálogo completo", key="pos_catalogo")
+"""
+
+@bench
+def pos(tamanos=(50, 200, 800)):
+    """Tiempo de rerun del POS: grid completo vs modo escaneo, según tamaño del catálogo"""
+    from streamlit.testing.v1 import AppTest
+
+    for n in tamanos:
+        for etiqueta, script in (("grid", _POS_GRID), ("escaneo", _POS_ESCANEO)):
+            app = AppTest.from_string(script.replace("{n}", str(n)), default_timeout=120)
+            app.run()  # primer render
+            assert not app.exception, app.exception
+            inicio = time.perf_counter()
+            for _ in range(5):
+                app.run()
+            assert not app.exception, app.exception
+            print(f"{n:>5} productos, {etiqueta:<8}: {(time.perf_counter() - inicio) / 5 * 1000:8.1f} ms por rerun")
+
+
+# === HISTORIAL DE ÓRDENES ===
+
+def contar_consultas(engine):
+    """Lista que se llena con cada sentencia ejecutada en el engine"""
+    from sqlalchemy import event
+
+    sentencias = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cur, stmt, *args: sentencias.append(stmt))
+    return sentencias
+
+@bench
+def historial(ordenes=20_000, paginas=5):
+    """Consultas y tiempo por página del historial (debe ser constante, sin N+1)"""
+    from history import historial_pedidos
+
+    session = sesion_sqlite()
+    poblar(session, ordenes=ordenes, clientes=50)
+    sentencias = contar_consultas(session.get_bind())
+
+    for etiqueta, filtro in (("cliente", {"customer_id": 7}), ("cajero", {"user_id": 1}), ("tienda", {"store_id": 2})):
+        cursor = None
+        por_pagina = []
+        inicio = time.perf_counter()
+        for _ in range(paginas):
+            sentencias.clear()
+            ordenes_pagina, cursor = historial_pedidos(session, despues=cursor, **filtro)
+            for o in ordenes_pagina:  # tocar todo lo que muestra la UI
+                o.user.username, o.customer, [(i.product.name, i.qty) for i in o.items]
+            por_pagina.append(len(sentencias))
+            session.expunge_all()
+        ms = (time.perf_counter() - inicio) / paginas * 1000
+        print(f"por {etiqueta:<8}: consultas por página {por_pagina}, {ms:.1f} ms por página")
+        assert len(set(por_pagina)) == 1, "el número de consultas por página no es constante"
+    session.close()
+
+
+# === ARRANQUE EN FRÍO ===
+
+# Presupuestos: imports del proceso del servidor (nivel superior de app.py) y
+# primer render de la página de login con la base ya creada
+PRESUPUESTO_IMPORTS_MS = 1500
+PRESUPUESTO_PRIMER_RENDER_MS = 1000
+DIFERIDOS = ("pandas", "fpdf", "werkzeug.security", "forecast")
+
+def _imports_nivel_superior(ruta="app.py"):
+    """Módulos que app.py importa al cargar (fuera de funciones y ramas de página)"""
+    import ast
+
+    with open(ruta, encoding="utf-8") as f:
+        nodos = list(ast.parse(f.read()).body)
+    modulos = []
+    while nodos:
+        nodo = nodos.pop(0)
+        if isinstance(nodo, ast.Try):
+            nodos = nodo.body + nodos
+        elif isinstance(nodo, ast.Import):
+            modulos += [a.name for a in nodo.names]
+        elif isinstance(nodo, ast.ImportFrom) and nodo.level == 0:
+            modulos.append(nodo.module)
+    return list(dict.fromkeys(modulos))
+
+def _importtime(codigo):
+    """[(módulo, ms acumulados)] de nivel superior según `python -X importtime`"""
+    import os
+    import subprocess
+
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+    ).stderr
+    modulos = []
+    for linea in salida.splitlines():
+        partes = linea.split("|")
+        if len(partes) != 3 or not partes[1].strip().isdigit():
+            continue
+        nombre = partes[2]
+        if len(nombre) - len(nombre.lstrip()) == 1:  # sin sangría extra: import de nivel superior
+            modulos.append((nombre.strip(), int(partes[1]) / 1000))
+    return modulos
+
+@bench
+def arranque(top=12):
+    """Imports del servidor (-X importtime) y primer render del login contra los presupuestos"""
+    import os
+    import tempfile
+
+    modulos = _imports_nivel_superior()
+    tiempos = _importtime("import " + ", ".join(modulos))
+    total_imports = sum(ms for _, ms in tiempos)
+    print(f"Imports de nivel superior de app.py: {total_imports:.0f} ms (presupuesto {PRESUPUESTO_IMPORTS_MS} ms)")
+    for nombre, ms in sorted(tiempos, key=lambda t: t[1], reverse=True)[:top]:
+        print(f"  {nombre:<28} {ms:8.1f} ms")
+
+    print("Diferidos (solo en las páginas que los usan):")
+    for modulo in DIFERIDOS:
+        tiempos_dif = _importtime(f"import {', '.join(modulos)}; import {modulo}")
+        nombres = [n for n, _ in tiempos_dif]
+        # lo que se importa después del último módulo del servidor es el costo propio del diferido
+        corte = max(nombres.index(n) for n in nombres if n in modulos or n.split(".")[0] in modulos)
+        print(f"  {modulo:<28} {sum(ms for _, ms in tiempos_dif[corte + 1:]):8.1f} ms")
+
+    # Primer render del login sobre una base SQLite temporal (mismo proceso, imports en frío)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'arranque.sqlite3')}"
+    from streamlit.testing.v1 import AppTest
+    import db
+
+    db.init_db()
+
+    app = AppTest.from_file("app.py", default_timeout=120)
+    inicio = time.perf_counter()
+    app.run()
+    primer_render = (time.perf_counter() - inicio) * 1000
+    inicio = time.perf_counter()
+    app.run()
+    segundo = (time.perf_counter() - inicio) * 1000
+    print(f"Primer render (login): {primer_render:.0f} ms (presupuesto {PRESUPUESTO_PRIMER_RENDER_MS} ms), rerun: {segundo:.0f} ms")
+    cargados = [m for m in ("fpdf", "werkzeug.security", "forecast", "pandas") if m in sys.modules]
+    print(f"Módulos pesados cargados tras el login: {', '.join(cargados) or 'ninguno'}")
+
+    assert not app.exception, app.exception
+    assert total_imports <= PRESUPUESTO_IMPORTS_MS, "imports de arranque fuera de presupuesto"
+    assert primer_render <= PRESUPUESTO_PRIMER_RENDER_MS, "primer render fuera de presupuesto"
+
+
+# === RÉPLICA DE LECTURA ===
+
+@bench
+def replica(ventas=20):
+    """Read-your-writes tras el checkout con réplica (ver docker-compose.replica.yml)"""
+    import db
+    from checkout import procesar_venta
+    from db import Order, Product, Store, User, get_read_session, get_session
+
+    if db.replica_engine is None:
+        print("Definir DATABASE_URL y DATABASE_REPLICA_URL (docker compose -f docker-compose.replica.yml up -d)")
+        sys.exit(1)
+    db.init_db()
+    session = get_session()
+    try:
+        if not session.query(Product).filter_by(sku="BENCH-RPL").first():
+            session.add_all([Store(name="Tienda réplica"), User(username="bench-replica", password="-", role="cajero"),
+                             Product(sku="BENCH-RPL", name="Pan réplica", price=Decimal("1.50"))])
+            session.commit()
+        producto = session.query(Product).filter_by(sku="BENCH-RPL").one()
+        tienda = session.query(Store).filter_by(name="Tienda réplica").first()
+        cajero = session.query(User).filter_by(username="bench-replica").one()
+    finally:
+        session.close()
+
+    en_replica = visibles = 0
+    inicio = time.perf_counter()
+    for _ in range(ventas):
+        session = get_session()
+        try:
+            orden_id = procesar_venta(session, cajero.id, tienda.id, None, {producto.id: 1000}, [producto]).id
+        finally:
+            session.close()
+        lectura = get_read_session()
+        try:
+            en_replica += lectura.info.get("replica") is not None
+            visibles += lectura.get(Order, orden_id) is not None
+        finally:
+            lectura.close()
+    ms = (time.perf_counter() - inicio) / ventas * 1000
+    print(f"{ventas} ventas: {visibles} visibles al leer de inmediato, {en_replica} lecturas servidas por la réplica, {ms:.1f} ms por venta+lectura")
+    assert visibles == ventas, "una lectura posterior al checkout no vio la orden"
+
+    time.sleep(db.REPLICA_LAG_S + 0.5)
+    lectura = get_read_session()
+    try:
+        assert lectura.info.get("replica") is not None, "pasada la ventana las lecturas deberían ir a la réplica"
+    finally:
+        lectura.close()
+    print(f"Pasados {db.REPLICA_LAG_S:.0f} s sin escrituras las lecturas vuelven a la réplica")
+
+
+# === CARRITOS COMPARTIDOS ===
+
+def _agregar_en_otro_worker(url, clave):
+    from cart_store import crear_store
+
+    store = crear_store(url)
+    carrito = store.obtener(clave)
+    carrito[999] = carrito.get(999, 0) + 2500
+    store.guardar(clave, carrito)
+
+@bench
+def carritos(lineas=20, operaciones=2000):
+    """Tamaño serializado y latencia obtener+guardar por backend del carrito"""
+    import json
+    import os
+    import pickle
+    import tempfile
+    from multiprocessing import Process
+    import struct
+    from cart_store import Carrito, crear_store, deserializar, serializar
+
+    carrito = Carrito({i * 37: (i % 5 + 1) * 1000 for i in range(1, lineas + 1)})
+    compacto = len(serializar(carrito))
+    con_pickle = len(pickle.dumps((carrito.llave, dict(carrito))))
+    print(f"Carrito de {lineas} líneas (con llave): {compacto} bytes compacto, "
+          f"{con_pickle} bytes pickle, {len(json.dumps([carrito.llave, carrito]))} bytes JSON")
+    assert compacto < con_pickle
+    rnd = random.Random(5)
+    for _ in range(2000):  # ida y vuelta, incluidos ids grandes y cantidades negativas o en cero
+        prueba = Carrito({rnd.randint(1, 2**31 - 1): rnd.randint(-10**6, 10**7) for _ in range(rnd.randint(0, 30))})
+        vuelta = deserializar(serializar(prueba))
+        assert vuelta == prueba and vuelta.llave == prueba.llave
+    viejo = Carrito({5: 1500, 9: 2000})  # un carrito guardado en v2 se sigue leyendo
+    v2 = bytes([2]) + bytes.fromhex(viejo.llave) + b"".join(struct.pack("<Ii", p, q) for p, q in sorted(viejo.items()))
+    assert deserializar(v2) == viejo and deserializar(v2).llave == viejo.llave
+
+    urls = ["memory", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'carritos.db')}"]
+    if os.environ.get("CHAMO_BENCH_REDIS"):
+        urls.append(os.environ["CHAMO_BENCH_REDIS"])
+    for url in urls:
+        store = crear_store(url)
+        inicio = time.perf_counter()
+        for i in range(operaciones):
+            clave = f"carrito:1:{i % 50}"
+            actual = store.obtener(clave) or dict(carrito)
+            actual[1] = actual.get(1, 0) + 1000
+            store.guardar(clave, actual)
+        us = (time.perf_counter() - inicio) / operaciones * 1e6
+        print(f"{url.split(':')[0]:<7}: {us:8.1f} µs por obtener+guardar")
+
+        if url != "memory":
+            # Otro proceso (otro worker) modifica el mismo carrito y este lo ve
+            store.guardar("carrito:1:compartido", {1: 1000})
+            worker = Process(target=_agregar_en_otro_worker, args=(url, "carrito:1:compartido"))
+            worker.start()
+            worker.join()
+            assert store.obtener("carrito:1:compartido") == {1: 1000, 999: 2500}, "el carrito no se compartió entre procesos"
+            print("         carrito visible desde otro proceso: ok")
+
+
+# === CHECKOUT POR MOTOR ===
+
+@bench
+def checkout(ventas=500, lineas=4):
+    """Latencia del checkout (p50/p95) en el perfil SQLite y, con CHAMO_BENCH_PG, en PostgreSQL"""
+    import os
+    import tempfile
+    from sqlalchemy import text
+    from sqlalchemy.orm import sessionmaker
+    from checkout import procesar_venta
+    from db import Base, Product, crear_engine
+
+    motores = [("sqlite (WAL)", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'checkout.sqlite3')}")]
+    if os.environ.get("CHAMO_BENCH_PG"):
+        motores.append(("postgresql", os.environ["CHAMO_BENCH_PG"]))  # base desechable: se borra y recrea
+
+    for etiqueta, url in motores:
+        engine = crear_engine(url)
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        Sesion = sessionmaker(bind=engine)
+        session = Sesion()
+        poblar(session, ordenes=2000, clientes=200)
+        if engine.dialect.name == "postgresql":
+            # poblar usa ids explícitos: adelantar las secuencias
+            for tabla in ("orders", "order_items"):
+                session.execute(text(f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), (SELECT max(id) FROM {tabla}))"))
+            session.commit()
+        productos = session.query(Product).all()
+        session.close()
+
+        rnd = random.Random(3)
+        tiempos = []
+        for _ in range(ventas):
+            carrito = {rnd.randint(1, len(productos)): rnd.randint(1, 3) * 1000 for _ in range(lineas)}
+            session = Sesion()
+            inicio = time.perf_counter()
+            try:
+                procesar_venta(session, 1, 1, rnd.choice([None, rnd.randint(1, 200)]), carrito, productos)
+            finally:
+                session.close()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        print(f"{etiqueta:<14}: p50 {tiempos[len(tiempos) // 2]:6.2f} ms, p95 {tiempos[int(len(tiempos) * 0.95)]:6.2f} ms ({ventas} ventas)")
+        engine.dispose()
+
+
+# === DINERO EN ENTEROS ===
+
+@bench
+def dinero(lineas=20, reruns=20_000, casos=50_000):
+    """Precio del carrito en enteros vs Decimal, y comprobación de que los totales coinciden"""
+    from decimal import ROUND_HALF_UP
+    from sqlalchemy import select
+    from checkout import procesar_venta
+    from db import Order, Product
+    from events import CANAL_VENTAS, bus
+    from money import centimos, formato_centimos, importe, importe_linea, milesimas, precio_decimal
+    from product_sales import verificar_contadores
+    from receipts import texto_recibo
+
+    def linea_decimal(q, p):  # como Numeric(…,2) en PostgreSQL
+        return (Decimal(str(q)) * p).quantize(Decimal("0.01"), ROUND_HALF_UP)
+
+    rnd = random.Random(11)
+    precios = {i: Decimal(rnd.randint(1, 99_999)) / 100 for i in range(1, lineas + 1)}
+    carrito_float = {i: rnd.randint(1, 20_000) / 1000 for i in precios}
+    carrito = {i: milesimas(q) for i, q in carrito_float.items()}
+    en_centimos = {i: centimos(p) for i, p in precios.items()}
+
+    def con_decimal():
+        for _ in range(reruns):
+            sum((Decimal(str(q)) * precios[i] for i, q in carrito_float.items()), Decimal("0"))
+    def con_enteros():
+        for _ in range(reruns):
+            sum(importe(q, en_centimos[i]) for i, q in carrito.items())
+    cronometrar(f"Decimal: {reruns} carritos de {lineas} líneas", con_decimal)
+    cronometrar(f"Enteros: {reruns} carritos de {lineas} líneas", con_enteros)
+
+    # Propiedad: para cualquier carrito, líneas redondeadas en enteros == Decimal redondeado por línea
+    for _ in range(casos):
+        lineas_caso = [(rnd.randint(0, 50_000) / 1000, Decimal(rnd.randint(0, 999_999)) / 100)
+                       for _ in range(rnd.randint(1, 8))]
+        esperado = sum((linea_decimal(q, p) for q, p in lineas_caso), Decimal("0"))
+        total = sum(importe_linea(milesimas(q), centimos(p)) for q, p in lineas_caso)
+        assert precio_decimal(total) == esperado, (lineas_caso, total, esperado)
+        assert formato_centimos(total) == f"S/ {esperado:.2f}", (lineas_caso, formato_centimos(total), esperado)
+    print(f"{casos} carritos aleatorios: totales idénticos a Decimal redondeado por línea")
+
+    # Medio céntimo con cantidades fraccionarias: 0.5 x 0.01 y 0.5 x 0.25 -> 0.01 + 0.13
+    session = sesion_sqlite()
+    poblar(session, ordenes=0, clientes=1)
+    productos = session.query(Product).order_by(Product.id).limit(2).all()
+    productos[0].price, productos[1].price = Decimal("0.01"), Decimal("0.25")
+    session.commit()
+    publicados = []
+    bus.subscribe(CANAL_VENTAS, publicados.append)
+    orden = procesar_venta(session, 1, 1, None, {productos[0].id: 500, productos[1].id: 500}, productos)
+    assert orden.total_centimos == 14, orden.total_centimos
+    assert [p["total_centimos"] for p in publicados] == [14], publicados
+    guardado = session.scalar(select(Order.total).where(Order.id == orden.id))
+    assert guardado == Decimal("0.14"), guardado
+    recibo = texto_recibo(session.get(Order, orden.id))
+    assert "S/      0.01" in recibo and "S/      0.13" in recibo and "TOTAL: S/ 0.14" in recibo, recibo
+    assert verificar_contadores(session) == (0, 0)
+    print(f"Venta 0.5 x 0.01 + 0.5 x 0.25: orders.total {guardado}, ticket y contadores coinciden")
+    # Milésimas en los contadores: 0.125 no debe verse como diferencia (ni "repararse" a 0.13)
+    procesar_venta(session, 1, 1, None, {productos[1].id: 125}, productos)
+    assert verificar_contadores(session, reparar=True) == (0, 0)
+
+
+# === CHECKOUT IDEMPOTENTE ===
+
+@bench
+def idempotencia(envios=8, ventas=50):
+    """Envíos duplicados simultáneos y reintentos de la misma venta: una sola orden"""
+    import os
+    import tempfile
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import sessionmaker
+    from checkout import procesar_venta
+    from db import Base, Order, Product, crear_engine
+
+    engine = crear_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'idempotencia.sqlite3')}")
+    Base.metadata.create_all(engine)
+    Sesion = sessionmaker(bind=engine)
+    session = Sesion()
+    poblar(session, ordenes=100, clientes=20)
+    productos = session.query(Product).all()
+    session.close()
+
+    def cobrar(llave):
+        session = Sesion()
+        try:
+            orden = procesar_venta(session, 1, 1, None, {1: 2000, 2: 500}, productos, llave=llave)
+            return orden.id, orden.repetida
+        finally:
+            session.close()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(envios) as pool:
+        for _ in range(ventas):
+            llave = uuid.uuid4().hex
+            resultados = list(pool.map(cobrar, [llave] * envios))
+            assert len({orden_id for orden_id, _ in resultados}) == 1, resultados
+            assert sum(not repetida for _, repetida in resultados) == 1, resultados
+    ms = (time.perf_counter() - inicio) / ventas * 1000
+    print(f"{ventas} ventas x {envios} envíos simultáneos: una orden por llave, {ms:.1f} ms por ráfaga")
+
+    sentencias = contar_consultas(engine)
+    llave = uuid.uuid4().hex
+    cobrar(llave)
+    sentencias.clear()
+    inicio = time.perf_counter()
+    orden_id, repetida = cobrar(llave)
+    ms = (time.perf_counter() - inicio) * 1000
+    escrituras = [s for s in sentencias if not s.lstrip().upper().startswith("SELECT")]
+    print(f"Reintento tras éxito: orden #{orden_id}, {len(sentencias)} consultas, {len(escrituras)} escrituras, {ms:.2f} ms")
+    assert repetida and not escrituras
+
+    session = Sesion()
+    total = session.scalar(select(func.count(Order.id)).where(Order.idempotency_key.is_not(None)))
+    session.close()
+    assert total == ventas + 1, total
+
+
+# === SENTENCIAS PRECONSTRUIDAS ===
+
+@bench
+def sentencias(llamadas=5000):
+    """Costo por llamada: consulta armada en cada rerun vs sentencia del registro, con y sin caché"""
+    from sqlalchemy import select
+    from sqlalchemy.orm import sessionmaker
+    from db import Base, Product, User, crear_engine
+    from statements import CATALOGO_ACTIVO, USUARIO_POR_NOMBRE, VENTAS_POR_DIA
+    import db
+
+    def medir(etiqueta, fn):
+        fn()  # calentar el caché
+        inicio = time.perf_counter()
+        for _ in range(llamadas):
+            fn()
+        print(f"  {etiqueta:<34} {(time.perf_counter() - inicio) / llamadas * 1e6:8.1f} µs/llamada")
+
+    for cache in (db.QUERY_CACHE_SIZE, 0):
+        db.QUERY_CACHE_SIZE = cache
+        engine = crear_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        poblar(session, ordenes=2000, clientes=100, productos=50)
+        print(f"query_cache_size={cache}:")
+        medir("login: session.query cada vez",
+              lambda: session.query(User).filter(User.username == "cajero").first())
+        medir("login: select() cada vez",
+              lambda: session.scalars(select(User).where(User.username == "cajero")).first())
+        medir("login: registro",
+              lambda: session.scalars(USUARIO_POR_NOMBRE, {"username": "cajero"}).first())
+        medir("catálogo: session.query cada vez",
+              lambda: session.query(Product).filter_by(is_active=True).order_by(Product.name).all())
+        medir("catálogo: registro", lambda: session.scalars(CATALOGO_ACTIVO).all())
+        medir("ventas por día: registro", lambda: session.execute(VENTAS_POR_DIA, {"limite": 30}).all())
+        session.close()
+        engine.dispose()
+
+
+# === HISTORIAL DE PRECIOS ===
+
+@bench
+def precios(productos=2000, cambios=50, consultas=2000):
+    """Precio a una fecha y lista de precios sobre el historial, plan de consulta y costo del caché vigente"""
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert, text
+    from db import ProductPrice
+    from pricing import INICIO, PriceListCache, lista_precios, precio_en
+
+    session = sesion_sqlite()
+    poblar(session, ordenes=100, productos=productos, clientes=10)
+    # `cambios` rangos contiguos por producto, uno por semana hasta hoy
+    ahora = datetime.utcnow()
+    rnd = random.Random(11)
+    filas = []
+    for pid in range(1, productos + 1):
+        fechas = [INICIO] + [ahora - timedelta(weeks=cambios - k) for k in range(1, cambios)]
+        for k, desde in enumerate(fechas):
+            hasta = fechas[k + 1] if k + 1 < len(fechas) else None
+            filas.append({"product_id": pid, "price": Decimal(rnd.randint(40, 2000)) / 100,
+                          "valid_from": desde, "valid_to": hasta})
+    session.execute(insert(ProductPrice), filas)
+    session.commit()
+    print(f"{len(filas)} filas de historial")
+
+    plan = session.execute(text(
+        "EXPLAIN QUERY PLAN SELECT price, valid_to FROM product_prices "
+        "WHERE product_id = 1 AND valid_from <= '2024-01-01' ORDER BY valid_from DESC LIMIT 1"
+    )).all()
+    print("plan:", "; ".join(f[-1] for f in plan))
+
+    momentos = [ahora - timedelta(days=rnd.randint(0, cambios * 7)) for _ in range(consultas)]
+    inicio = time.perf_counter()
+    for momento in momentos:
+        precio_en(session, rnd.randint(1, productos), momento)
+    print(f"precio a una fecha: {(time.perf_counter() - inicio) / consultas * 1e6:.1f} µs/consulta")
+    lista = cronometrar("lista de precios a una fecha", lista_precios, session, ahora - timedelta(weeks=10))
+    assert len(lista) == productos, len(lista)
+
+    cache = PriceListCache()
+    cronometrar("caché: primera carga", cache.refrescar, session)
+    inicio = time.perf_counter()
+    for _ in range(consultas):
+        assert not cache.refrescar(session)
+    print(f"caché: rerun sin cambios {(time.perf_counter() - inicio) / consultas * 1e6:.1f} µs")
+    assert cache.precios == lista_precios(session, datetime.utcnow())
+
+
+# === PROMOCIONES ===
+
+@bench
+def promociones(reglas=500, productos=2000, tamanos=(20, 200, 800), repeticiones=200):
+    """Evaluación del carrito con cientos de reglas: índices compilados vs recorrer todas las reglas"""
+    from datetime import datetime
+    from types import SimpleNamespace
+    from catalog import ProductCatalog
+    from db import Promotion
+    from money import importe, redondear_a_centimos
+    from promotions import MotorPromociones
+
+    rnd = random.Random(5)
+    catalogo = ProductCatalog([
+        SimpleNamespace(id=i, sku=f"SKU-{i:05d}", price=Decimal(rnd.randint(40, 2000)) / 100, category=f"Cat {i % 40}")
+        for i in range(1, productos + 1)
+    ])
+    promos = []
+    for i in range(1, reglas + 1):
+        tipo = rnd.choice(["mayorista", "porcentaje", "combo"])
+        alcance = rnd.random()
+        promos.append(Promotion(
+            id=i, name=f"Promo {i}", kind=tipo, is_active=True,
+            product_id=rnd.randint(1, productos) if tipo == "combo" or alcance < 0.6 else None,
+            category=f"Cat {rnd.randint(0, 39)}" if tipo != "combo" and 0.6 <= alcance < 0.85 else None,
+            customer_id=rnd.randint(1, 50) if 0.85 <= alcance < 0.92 else None,
+            document_type="RUC" if alcance >= 0.92 else None,
+            combo_product_id=rnd.randint(1, productos) if tipo == "combo" else None,
+            min_qty=Decimal(rnd.choice([0, 10, 50])),
+            price=Decimal(rnd.randint(10, 300)) / 100 if tipo != "porcentaje" else None,
+            percent=Decimal(rnd.randint(5, 30)) if tipo == "porcentaje" else None,
+        ))
+    motor = MotorPromociones(promos)
+    todas = list(motor.reglas.values())
+
+    def evaluar_lineal(carrito, cliente):
+        # Referencia: cada línea recorre todas las reglas
+        momento = datetime.utcnow()
+        resultado = {}
+        for pid, qty in carrito.items():
+            p, precio = catalogo.por_id[pid], catalogo.centimos[pid]
+            mejor, mejor_id = 0, None
+            for r in todas:
+                if r.aplica(pid, p.category, cliente.id, cliente.document_type, momento):
+                    valor = r.descuento(qty, precio, carrito)
+                    if valor > mejor:
+                        mejor, mejor_id = valor, r.id
+            if mejor_id is not None:
+                resultado[pid] = (redondear_a_centimos(min(mejor, importe(qty, precio))), mejor_id)
+        return resultado
+
+    cliente = SimpleNamespace(id=7, document_type="RUC")
+    for tamano in tamanos:
+        carrito = {pid: rnd.choice([1, 5, 50, 100]) * 1000 for pid in rnd.sample(range(1, productos + 1), tamano)}
+        esperado = evaluar_lineal(carrito, cliente)
+        assert motor.evaluar(carrito, catalogo, cliente) == esperado
+        for etiqueta, fn in (("índices", lambda: motor.evaluar(carrito, catalogo, cliente)),
+                             ("lineal", lambda: evaluar_lineal(carrito, cliente))):
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                fn()
+            print(f"{tamano:>4} líneas, {reglas} reglas, {etiqueta:<8}: "
+                  f"{(time.perf_counter() - inicio) / repeticiones * 1000:7.3f} ms ({len(esperado)} con descuento)")
+
+
+# === TURNOS DE CAJA ===
+
+@bench
+def turnos(ordenes=100_000, n_turnos=200, ventas=200):
+    """Reporte Z desde los acumulados vs agregar orders, y verificación masiva de los acumulados"""
+    from datetime import datetime
+    from sqlalchemy import func, insert, select, text
+    from checkout import procesar_venta
+    from db import Order, Product, Shift
+    from receipts import texto_recibo
+    from shifts import abrir_turno, reporte_z, verificar_turnos
+
+    session = sesion_sqlite()
+    poblar(session, ordenes=ordenes, items_por_orden=1, clientes=100)
+    # Turnos ya cerrados: solo puede haber uno abierto por cajero y tienda
+    session.execute(insert(Shift), [{"id": i, "user_id": 1, "store_id": 1, "closed_at": datetime.utcnow()}
+                                    for i in range(1, n_turnos + 1)])
+    session.execute(text(
+        f"UPDATE orders SET shift_id = id % {n_turnos} + 1, "
+        "payment_method = CASE id % 4 WHEN 0 THEN 'tarjeta' WHEN 1 THEN 'yape' ELSE 'efectivo' END"
+    ))
+    session.commit()
+    diferencias = cronometrar("verificación masiva (reconstruye)", verificar_turnos, session, True)
+    print(f"  {diferencias} filas reconstruidas")
+
+    # Ventas reales por el checkout dentro de un turno abierto, con cantidades
+    # fraccionarias (pan al peso) para que haya medios céntimos en las líneas
+    turno = abrir_turno(session, 1, 1)
+    productos = session.query(Product).all()
+    rnd = random.Random(9)
+    impreso = Decimal("0")
+    for _ in range(ventas):
+        carrito = {rnd.randint(1, len(productos)): rnd.randint(1, 3000) for _ in range(3)}
+        orden = procesar_venta(session, 1, 1, None, carrito, productos,
+                               metodo_pago=rnd.choice(["efectivo", "tarjeta", "yape"]), turno_id=turno.id)
+        # Lo que ve el cliente: la suma de los subtotales impresos en el recibo
+        recibo = texto_recibo(session.get(Order, orden.id)).splitlines()
+        impreso += sum(Decimal(linea.rsplit("S/", 1)[1]) for linea in recibo[3:3 + len(carrito)])
+    assert cronometrar("verificación masiva (sin cambios)", verificar_turnos, session) == 0
+
+    rep = reporte_z(session, turno)
+    assert rep["ventas"] == ventas, rep
+    assert rep["total"] == impreso, (rep["total"], impreso)
+    print(f"  reporte Z = suma de recibos impresos ({impreso})")
+    objetivo = n_turnos // 2
+    consultas = 1000
+    inicio = time.perf_counter()
+    for _ in range(consultas):
+        reporte_z(session, session.get(Shift, objetivo))
+    print(f"reporte Z desde acumulados: {(time.perf_counter() - inicio) / consultas * 1e6:.1f} µs")
+    inicio = time.perf_counter()
+    for _ in range(consultas // 20):
+        session.execute(
+            select(Order.payment_method, func.count(Order.id), func.sum(Order.total))
+            .where(Order.shift_id == objetivo).group_by(Order.payment_method)
+        ).all()
+    print(f"reporte Z agregando orders: {(time.perf_counter() - inicio) / (consultas // 20) * 1e6:.1f} µs "
+          f"({ordenes // n_turnos} órdenes por turno)")
+
+
+# === RECIBOS DIGITALES ===
+
+@bench
+def recibos(n=2000, lotes=(1, 50)):
+    """Recibos por segundo contra el SMTP local: por lote con conexión reutilizada vs una conexión por recibo"""
+    import os
+    import tempfile
+    from sqlalchemy import text
+    from sqlalchemy.orm import sessionmaker
+    from db import Base, ReceiptOutbox, crear_engine
+    from receipts import DespachadorRecibos, encolar_recibos
+    from smtp_local import ServidorSMTPLocal
+
+    engine = crear_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'recibos.sqlite3')}")
+    Base.metadata.create_all(engine)
+    Sesion = sessionmaker(bind=engine)
+    session = Sesion()
+    poblar(session, ordenes=n, clientes=n, items_por_orden=4)
+    session.execute(text("UPDATE customers SET email = 'cliente' || id || '@ejemplo.pe'"))
+    session.commit()
+
+    for reutilizar in (True, False):
+        for lote in lotes:
+            session.execute(text("DELETE FROM receipt_outbox"))
+            session.commit()
+            inicio = time.perf_counter()
+            for order_id in range(1, n + 1):
+                encolar_recibos(session, order_id, order_id)
+            session.commit()
+            encolado_us = (time.perf_counter() - inicio) / n * 1e6
+
+            servidor = ServidorSMTPLocal(puerto=0).iniciar()
+            despachador = DespachadorRecibos(sesiones=Sesion, smtp_url=servidor.url, lote=lote)
+            despachador.reutilizar = reutilizar
+            inicio = time.perf_counter()
+            while despachador.despachar_lote():
+                pass
+            segundos = time.perf_counter() - inicio
+            despachador._cerrar_smtp()
+            servidor.shutdown()
+            servidor.server_close()
+            assert len(servidor.mensajes) == n, len(servidor.mensajes)
+            assert session.query(ReceiptOutbox).filter_by(status="enviado").count() == n
+            print(f"lote {lote:>3}, {'conexión reutilizada' if reutilizar else 'conexión por recibo'}: "
+                  f"{n / segundos:7.0f} recibos/s ({servidor.conexiones} conexiones SMTP; encolar {encolado_us:.0f} µs)")
+    session.close()
+    engine.dispose()
+
+
+# === MIGRACIONES EN LÍNEA ===
+
+def _esquema_inicial():
+    """MetaData con las tablas de la primera versión de db.py (sin columnas, índices ni tablas posteriores)"""
+    from sqlalchemy import MetaData, Table
+    from db import Base
+
+    posteriores = {"orders": {"idempotency_key", "payment_method", "shift_id"}, "order_items": {"discount", "promotion_id"}}
+    meta = MetaData()
+    for nombre in ("users", "stores", "customers", "suppliers", "ingredients", "products", "orders", "order_items"):
+        Table(nombre, meta, *[c._copy() for c in Base.metadata.tables[nombre].columns
+                              if c.name not in posteriores.get(nombre, ())])
+    return meta
+
+
+def _describir(engine):
+    from sqlalchemy import inspect
+    insp = inspect(engine)
+    return {
+        t: ({c["name"] for c in insp.get_columns(t)}, {i["name"] for i in insp.get_indexes(t)})
+        for t in insp.get_table_names() if t != "schema_version"
+    }
+
+
+@bench
+def migraciones(ordenes=200_000, items_por_orden=3, lote=5000):
+    """Migración de una base de la primera versión con datos, con ventas concurrentes (CHAMO_BENCH_PG=url para PostgreSQL)"""
+    import os
+    import tempfile
+    import threading
+    from datetime import datetime, timedelta
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import Session
+    import migrations
+    from product_sales import verificar_contadores
+
+    url = os.environ.get("CHAMO_BENCH_PG") or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'migrar.sqlite3')}"
+    engine = create_engine(url, connect_args={} if url.startswith("postgresql") else {"timeout": 60})
+    inicial = _esquema_inicial()
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("DROP SCHEMA public CASCADE; CREATE SCHEMA public"))
+    inicial.create_all(engine)
+
+    rnd = random.Random(11)
+    t = inicial.tables
+    with engine.begin() as conn:
+        conn.execute(t["stores"].insert(), [{"id": i, "name": f"Tienda {i}"} for i in range(1, 4)])
+        conn.execute(t["users"].insert(), [{"id": 1, "username": "cajero", "password": "-", "role": "cajero"}])
+        conn.execute(t["customers"].insert(), [{"id": i, "name": f"Cliente{i}"} for i in range(1, 2001)])
+        conn.execute(t["products"].insert(), [
+            {"id": i, "sku": f"SKU-{i:05d}", "name": f"Producto {i}", "price": Decimal(rnd.randint(40, 2000)) / 100}
+            for i in range(1, 201)
+        ])
+    inicio_ts = datetime.utcnow() - timedelta(days=365)
+    item_id = 1
+    inicio = time.perf_counter()
+    for desde in range(1, ordenes + 1, 10_000):
+        filas_o, filas_i = [], []
+        for orden_id in range(desde, min(desde + 10_000, ordenes + 1)):
+            total = Decimal(0)
+            for _ in range(items_por_orden):
+                precio = Decimal(rnd.randint(40, 2000)) / 100
+                qty = Decimal(rnd.randint(1, 20))
+                filas_i.append({"id": item_id, "order_id": orden_id, "product_id": rnd.randint(1, 200), "qty": qty, "price": precio})
+                item_id += 1
+                total += qty * precio
+            filas_o.append({"id": orden_id, "user_id": 1, "store_id": rnd.randint(1, 3),
+                            "customer_id": rnd.choice([None, rnd.randint(1, 2000)]), "total": total,
+                            "ts": inicio_ts + timedelta(seconds=orden_id * 365 * 86400 // ordenes)})
+        with engine.begin() as conn:
+            conn.execute(t["orders"].insert(), filas_o)
+            conn.execute(t["order_items"].insert(), filas_i)
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            for tabla in ("orders", "order_items"):
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), (SELECT max(id) FROM {tabla}))"))
+    print(f"{engine.dialect.name}: {ordenes} órdenes / {item_id - 1} items de la primera versión "
+          f"cargadas en {time.perf_counter() - inicio:.1f} s")
+
+    # Ventas concurrentes durante la migración: la peor latencia de un INSERT muestra cuánto bloquea
+    latencias, parar = [], threading.Event()
+
+    def vender():
+        while not parar.is_set():
+            t0 = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text("INSERT INTO orders (user_id, store_id, total, ts) VALUES (1, 1, 10, :ts)"),
+                                 {"ts": datetime.utcnow()})
+                latencias.append(time.perf_counter() - t0)
+            except Exception as e:  # columnas o tablas a medio crear: se cuenta como venta fallida
+                latencias.append(float("inf"))
+                print(f"  venta fallida: {e.__class__.__name__}")
+            time.sleep(0.01)
+
+    hilo = threading.Thread(target=vender, daemon=True)
+    hilo.start()
+    inicio = time.perf_counter()
+    hechas = migrations.migrar(engine, lote=lote)
+    total_s = time.perf_counter() - inicio
+    parar.set()
+    hilo.join()
+    print(f"migración completa: {total_s:.1f} s")
+    for version, nombre, segundos in hechas:
+        print(f"  {version:03d} {nombre:<70} {segundos:7.2f} s")
+    latencias.sort()
+    print(f"ventas durante la migración: {len(latencias)}, p50 {latencias[len(latencias) // 2] * 1000:.1f} ms, "
+          f"máx {latencias[-1] * 1000:.1f} ms")
+
+    assert [v for v, _, _ in hechas] == sorted(migrations.MIGRACIONES), "la base inicial debe recorrer todas las migraciones"
+    assert all(aplicada for _, _, aplicada, _ in migrations.estado(engine))
+    with Session(engine) as session:
+        assert verificar_contadores(session) == (0, 0)
+    assert migrations.migrar(engine, salida=lambda *_: None) == [], "la segunda corrida debe ser un no-op"
+
+    # El esquema migrado debe coincidir con el de una base nueva
+    if engine.dialect.name == "postgresql":
+        print("(comparación con base nueva solo en SQLite)")
+        return
+    nueva = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'nueva.sqlite3')}")
+    migrations.migrar(nueva, salida=lambda *_: None)
+    assert all(aplicada for _, _, aplicada, _ in migrations.estado(nueva)), "base nueva sin migrar por completo"
+    migrado, esperado = _describir(engine), _describir(nueva)
+    assert set(migrado) == set(esperado), set(migrado) ^ set(esperado)
+    for tabla, (columnas, indices) in esperado.items():
+        assert migrado[tabla][0] == columnas, (tabla, migrado[tabla][0] ^ columnas)
+        assert indices <= migrado[tabla][1], (tabla, indices - migrado[tabla][1])
+    print("esquema migrado = esquema nuevo")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHES:
+        print("Benchmarks disponibles:")
+        for nombre, fn in BENCHES.items():
+            print(f"  {nombre:<12} {fn.__doc__}")
+        sys.exit(1)
+    BENCHES[sys.argv[1]]()
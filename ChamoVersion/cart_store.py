@@ -0,0 +1,188 @@
+"""Carritos del POS fuera del proceso de Streamlit
+
+El backend se elige con CHAMO_CART_STORE:
+  memory (por defecto)          un solo proceso
+  sqlite:///ruta/carritos.db    varios workers en el mismo equipo
+  redis://host:6379/0           varios equipos (Redis o compatible)
+Cada carrito se guarda por caja (tienda + cajero), así cualquier worker puede
+atender cualquier caja sin sesiones pegajosas.
+"""
+import os
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+
+TTL_S = int(os.environ.get("CHAMO_CART_TTL", str(12 * 3600)))  # carritos abandonados caducan
+
+# Formato v3: versión (1 byte) + llave de la venta (16 bytes) + por línea, en orden de
+# product_id, la diferencia con el product_id anterior y la cantidad en milésimas (zigzag),
+# ambas como varint: 3-4 bytes por línea en vez de 8. v1 y v2 (struct fijo) se siguen leyendo.
+_VERSION = 3
+_LINEA = struct.Struct("<Ii")
+
+
+def _varint(valor, datos):
+    while valor >= 0x80:
+        datos.append(valor & 0x7F | 0x80)
+        valor >>= 7
+    datos.append(valor)
+
+
+def _varints(datos):
+    valor = desplazamiento = 0
+    for byte in datos:
+        valor |= (byte & 0x7F) << desplazamiento
+        if byte & 0x80:
+            desplazamiento += 7
+        else:
+            yield valor
+            valor = desplazamiento = 0
+
+
+class Carrito(dict):
+    """{product_id: milésimas} más la llave de idempotencia con que se cobrará
+
+    La llave nace con el carrito y muere con él: un doble clic o un reintento
+    de COBRAR usa la misma llave y checkout devuelve la orden ya registrada.
+    """
+
+    def __init__(self, *args, llave=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.llave = llave or uuid.uuid4().hex
+
+
+def clave_caja(store_id, user_id):
+    return f"carrito:{store_id}:{user_id}"
+
+
+def serializar(carrito):
+    llave = getattr(carrito, "llave", None) or uuid.uuid4().hex
+    datos = bytearray([_VERSION]) + bytes.fromhex(llave)
+    anterior = 0
+    for product_id, qty in sorted(carrito.items()):
+        _varint(product_id - anterior, datos)
+        _varint(qty << 1 if qty >= 0 else (-qty << 1) - 1, datos)  # zigzag: una línea negativa no rompe el formato
+        anterior = product_id
+    return bytes(datos)
+
+
+def deserializar(datos):
+    if not datos:
+        return Carrito()
+    if datos[0] == 1:  # formatos anteriores: sin llave, y con llave y struct fijo
+        return Carrito(_LINEA.iter_unpack(datos[1:]))
+    if datos[0] == 2:
+        return Carrito(_LINEA.iter_unpack(datos[17:]), llave=datos[1:17].hex())
+    if datos[0] != _VERSION:
+        raise ValueError(f"Versión de carrito desconocida: {datos[0]}")
+    carrito = Carrito(llave=datos[1:17].hex())
+    valores = _varints(datos[17:])
+    product_id = 0
+    for delta, qty in zip(valores, valores):
+        product_id += delta
+        carrito[product_id] = qty >> 1 if not qty & 1 else -((qty + 1) >> 1)
+    return carrito
+
+
+class MemoryCartStore:
+    """Diccionario en memoria del proceso (una sola instancia de la app)"""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            datos, vence = self._datos.get(clave, (None, 0))
+        return deserializar(datos) if vence > time.time() else Carrito()
+
+    def guardar(self, clave, carrito):
+        if not carrito:
+            return self.borrar(clave)
+        with self._lock:
+            self._datos[clave] = (serializar(carrito), time.time() + TTL_S)
+
+    def borrar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+
+class SQLiteCartStore:
+    """Archivo SQLite compartido por los workers de un mismo equipo (WAL, una conexión por hilo)"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        conn = self._conexion()
+        conn.execute("CREATE TABLE IF NOT EXISTS carritos (clave TEXT PRIMARY KEY, datos BLOB NOT NULL, vence REAL NOT NULL)")
+        conn.execute("DELETE FROM carritos WHERE vence < ?", (time.time(),))
+        conn.commit()
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def obtener(self, clave):
+        fila = self._conexion().execute(
+            "SELECT datos FROM carritos WHERE clave = ? AND vence >= ?", (clave, time.time())
+        ).fetchone()
+        return deserializar(fila[0]) if fila else Carrito()
+
+    def guardar(self, clave, carrito):
+        if not carrito:
+            return self.borrar(clave)
+        conn = self._conexion()
+        with conn:
+            conn.execute(
+                "INSERT INTO carritos (clave, datos, vence) VALUES (?, ?, ?) "
+                "ON CONFLICT (clave) DO UPDATE SET datos = excluded.datos, vence = excluded.vence",
+                (clave, serializar(carrito), time.time() + TTL_S)
+            )
+
+    def borrar(self, clave):
+        conn = self._conexion()
+        with conn:
+            conn.execute("DELETE FROM carritos WHERE clave = ?", (clave,))
+
+
+class RedisCartStore:
+    """Redis (o compatible: Valkey, KeyDB, Dragonfly) para varios equipos"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CHAMO_CART_STORE=redis://... requiere el paquete redis (pip install redis)")
+        self._redis = redis.Redis.from_url(url)
+
+    def obtener(self, clave):
+        return deserializar(self._redis.get(clave))
+
+    def guardar(self, clave, carrito):
+        if not carrito:
+            return self.borrar(clave)
+        self._redis.set(clave, serializar(carrito), ex=TTL_S)
+
+    def borrar(self, clave):
+        self._redis.delete(clave)
+
+
+def crear_store(url=None):
+    url = url or os.environ.get("CHAMO_CART_STORE", "memory")
+    if url == "memory":
+        return MemoryCartStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteCartStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCartStore(url)
+    raise ValueError(f"CHAMO_CART_STORE no reconocido: {url}")
+
+
+carritos = crear_store()
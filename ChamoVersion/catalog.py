@@ -0,0 +1,76 @@
+import re
+
+from money import centimos, milesimas
+
+# "PAN-001", "3*PAN-001", "PAN-001*3", "3x PAN-001", "PAN-001 x3"; varias separadas por coma o salto de línea
+# La "x" exige un espacio del lado del SKU para no partir códigos como "MIX5"
+_PATRON_CANTIDAD_ANTES = re.compile(r"^(\d+(?:[.,]\d+)?)\s*(?:\*|[xX]\s)\s*(\S+)$")
+_PATRON_CANTIDAD_DESPUES = re.compile(r"^(\S+?)\s*(?:\*|\s[xX])\s*(\d+(?:[.,]\d+)?)$")
+
+
+def normalizar_sku(sku):
+    return sku.strip().upper()
+
+
+class ProductCatalog:
+    """Índice hash de productos activos por SKU (columna única) y por id, con precios en céntimos
+
+    `precios` ({product_id: céntimos}) es la lista vigente de pricing.precios_vigentes;
+    un producto que no figure en ella usa products.price.
+    """
+
+    def __init__(self, productos=(), precios=None):
+        self.por_id = {}
+        self.por_sku = {}
+        self.centimos = {}
+        self.cargar(productos, precios)
+
+    def cargar(self, productos, precios=None):
+        precios = precios or {}
+        self.por_id = {p.id: p for p in productos}
+        self.por_sku = {normalizar_sku(p.sku): p for p in productos}
+        self.centimos = {p.id: precios.get(p.id) or centimos(p.price) for p in productos}
+
+    def resolver(self, sku):
+        """Producto por SKU o código de barras en O(1); None si no existe o está inactivo"""
+        return self.por_sku.get(normalizar_sku(sku))
+
+
+def parsear_entrada(texto):
+    """Convierte lo escaneado/tecleado en [(sku, milésimas)]; devuelve también las partes inválidas"""
+    lineas, invalidas = [], []
+    for parte in re.split(r"[,\n;]+", texto or ""):
+        parte = parte.strip()
+        if not parte:
+            continue
+        antes = _PATRON_CANTIDAD_ANTES.match(parte)
+        despues = _PATRON_CANTIDAD_DESPUES.match(parte)
+        if antes:
+            cantidad, sku = antes.groups()
+        elif despues:
+            sku, cantidad = despues.groups()
+        elif " " not in parte:
+            sku, cantidad = parte, "1"
+        else:
+            invalidas.append(parte)
+            continue
+        cantidad = milesimas(cantidad.replace(",", "."))
+        if cantidad <= 0:
+            invalidas.append(parte)
+            continue
+        lineas.append((sku, cantidad))
+    return lineas, invalidas
+
+
+def agregar_escaneo(catalogo, carrito, texto):
+    """Agrega al carrito lo escaneado; devuelve (agregados, códigos no reconocidos)"""
+    lineas, desconocidos = parsear_entrada(texto)
+    agregados = 0
+    for sku, cantidad in lineas:
+        producto = catalogo.resolver(sku)
+        if producto is None:
+            desconocidos.append(sku)
+            continue
+        carrito[producto.id] = carrito.get(producto.id, 0) + cantidad
+        agregados += 1
+    return agregados, desconocidos
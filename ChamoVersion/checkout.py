@@ -0,0 +1,103 @@
+from sqlalchemy.exc import IntegrityError
+
+from customer_stats import registrar_compra_cliente
+from db import Order
+from events import publicar_venta
+from inventory import consumir_por_venta
+from money import centimos, importe_linea, precio_decimal, qty_decimal
+from product_sales import registrar_ventas_productos
+from receipts import encolar_recibos
+from shifts import registrar_venta_turno
+from statements import INSERTAR_ITEMS, ORDEN_POR_LLAVE
+
+
+def orden_por_llave(session, llave):
+    return session.scalars(ORDEN_POR_LLAVE, {"llave": llave}).first()
+
+
+def procesar_venta(session, user_id, store_id, customer_id, carrito, productos, llave=None, precios=None,
+                   descuentos=None, metodo_pago="efectivo", turno_id=None, enviar_recibo=False):
+    """Registra la orden del carrito ({product_id: milésimas}) en una sola transacción y publica la venta
+
+    Cada línea se redondea a céntimos una vez (money.importe_linea) y el total es
+    su suma, en enteros; a Decimal solo se pasa al escribir las filas. La orden
+    devuelta lleva `total_centimos`.
+    Con `llave` la venta es idempotente: si ya existe una orden con esa llave
+    (reintento o doble envío simultáneo) se devuelve esa sin escribir nada, y la
+    orden queda marcada con `repetida = True`.
+    `precios` ({product_id: céntimos}) es la lista vigente con que se mostró el
+    carrito; sin ella se cobra products.price. `descuentos` es lo que devolvió
+    promotions.MotorPromociones.evaluar ({product_id: (céntimos, promotion_id)}):
+    queda registrado por OrderItem y la orden guarda el total neto.
+    Con `turno_id` la venta se suma a los acumulados del turno por medio de pago.
+    Con `enviar_recibo` el recibo digital queda en la bandeja de salida en esta
+    misma transacción; lo envía el despachador de receipts.py.
+    """
+    if llave is not None:
+        existente = orden_por_llave(session, llave)
+        if existente is not None:
+            existente.repetida = True
+            return existente
+
+    precios = precios or {}
+    descuentos = descuentos or {}
+    por_id = {p.id: p for p in productos}
+    lineas = []
+    for prod_id, qty in carrito.items():
+        if prod_id not in por_id:
+            continue
+        precio = precios[prod_id] if prod_id in precios else centimos(por_id[prod_id].price)
+        descuento, promo_id = descuentos.get(prod_id, (0, None))
+        neto = importe_linea(qty, precio, descuento)
+        lineas.append((por_id[prod_id], qty, precio, descuento, promo_id, neto))
+    total_centimos = sum(linea[-1] for linea in lineas)
+    total = precio_decimal(total_centimos)
+    lineas = [
+        (p, qty_decimal(qty), precio_decimal(precio), precio_decimal(descuento), promo_id, precio_decimal(neto))
+        for p, qty, precio, descuento, promo_id, neto in lineas
+    ]
+
+    orden = Order(
+        user_id=user_id,
+        store_id=store_id,
+        customer_id=customer_id,
+        total=total,
+        idempotency_key=llave,
+        payment_method=metodo_pago,
+        shift_id=turno_id
+    )
+    session.add(orden)
+    try:
+        # La orden se inserta antes que todo lo demás: un duplicado concurrente
+        # choca aquí con el índice único (esperando a que el otro confirme)
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        existente = orden_por_llave(session, llave) if llave is not None else None
+        if existente is None:
+            raise
+        existente.repetida = True
+        return existente
+
+    if lineas:
+        # Inserción en bloque con la sentencia ya construida (sin unit of work por item)
+        session.execute(INSERTAR_ITEMS, [
+            {"order_id": orden.id, "product_id": p.id, "qty": qty, "price": precio,
+             "discount": descuento, "promotion_id": promo_id}
+            for p, qty, precio, descuento, promo_id, _ in lineas
+        ])
+    # El stock de ingredientes se descuenta en la misma transacción que la venta
+    consumir_por_venta(session, orden.id, [(p.id, qty) for p, qty, *_ in lineas])
+    registrar_ventas_productos(session, store_id, orden.ts, [(p.id, qty, neto) for p, qty, *_, neto in lineas])
+    if customer_id:
+        registrar_compra_cliente(session, customer_id, total, orden.ts)
+    if turno_id:
+        registrar_venta_turno(session, turno_id, metodo_pago, total)
+    if enviar_recibo and customer_id:
+        encolar_recibos(session, orden.id, customer_id)
+
+    orden.total_centimos = total_centimos
+    publicar_venta(session, orden)
+    session.commit()
+    orden.repetida = False
+    return orden
@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import func, select
+
+from db import Ingredient, Product, RecipeItem
+
+RECARGA_S = 600  # recarga completa periódica: cubre commits tardíos con un updated_at ya superado
+
+_TABLAS = (Ingredient, Product, RecipeItem)
+
+
+def _version(session):
+    """(filas, último updated_at) de ingredientes, productos y recetas: tres agregados baratos"""
+    return tuple(tuple(session.execute(select(func.count(), func.max(m.updated_at)).select_from(m)).one()) for m in _TABLAS)
+
+
+class CostEngine:
+    """Costo y margen por producto, cacheados y recalculados solo donde cambian
+
+    Es uno por proceso: refrescar() compara la versión de las tablas y, si otro
+    worker (o el importador) cambió algo, relee solo las filas con updated_at
+    nuevo. Las bajas no dejan marca; se notan porque los conteos no cuadran y
+    ahí se recarga todo.
+    """
+
+    def __init__(self):
+        self.costo_ingrediente = {}   # ingredient_id -> costo por unidad
+        self.precios = {}             # product_id -> precio de venta
+        self.recetas = {}             # product_id -> {ingredient_id: cantidad}
+        self.usos = defaultdict(set)  # ingredient_id -> productos que lo usan
+        self.costos = {}              # product_id -> costo unitario (cache)
+        self.recalculos = 0
+        self.listo = False
+        self._lock = threading.Lock()
+        self._version = None
+        self._cargado = 0.0           # time.monotonic() de la última carga completa
+
+    def refrescar(self, session):
+        """Pone el motor al día con la base; devuelve True si hubo que leer algo"""
+        version = _version(session)
+        if self.listo and version == self._version and time.monotonic() - self._cargado < RECARGA_S:
+            return False
+        with self._lock:
+            if not self.listo or self._version is None or time.monotonic() - self._cargado >= RECARGA_S:
+                self.cargar(session)
+            else:
+                self._recargar_cambios(session, [marca for _, marca in self._version], [filas for filas, _ in version])
+            self._version = version
+        return True
+
+    def _recargar_cambios(self, session, desde, filas):
+        """Aplica las filas con updated_at >= la última marca vista (reaplicar es inocuo)"""
+        def nuevas(modelo, marca, *columnas):
+            consulta = select(*columnas).where(modelo.updated_at.is_not(None))
+            return session.execute(consulta if marca is None else consulta.where(modelo.updated_at >= marca)).all()
+
+        for ing_id, costo in nuevas(Ingredient, desde[0], Ingredient.id, Ingredient.cost_per_unit):
+            self.set_costo_ingrediente(ing_id, costo or 0)
+        for product_id, precio in nuevas(Product, desde[1], Product.id, Product.price):
+            self.set_precio(product_id, precio or 0)
+        productos = {p for p, in nuevas(RecipeItem, desde[2], RecipeItem.product_id)}
+        if productos:
+            recetas = defaultdict(dict)
+            for product_id, ing_id, qty in session.execute(
+                select(RecipeItem.product_id, RecipeItem.ingredient_id, RecipeItem.qty)
+                .where(RecipeItem.product_id.in_(productos))
+            ):
+                recetas[product_id][ing_id] = qty
+            for product_id in productos:
+                self.set_receta(product_id, recetas[product_id])
+
+        cacheadas = (len(self.costo_ingrediente), len(self.precios), sum(len(r) for r in self.recetas.values()))
+        if cacheadas != tuple(filas):
+            self.cargar(session)
+
+    def cargar(self, session):
+        """Carga ingredientes, precios y recetas y calcula todos los costos"""
+        ingredientes = session.query(Ingredient.id, Ingredient.cost_per_unit).all()
+        productos = session.query(Product.id, Product.price).all()
+        recetas = session.query(RecipeItem.product_id, RecipeItem.ingredient_id, RecipeItem.qty).all()
+        self.cargar_datos(ingredientes, productos, recetas)
+
+    def cargar_datos(self, ingredientes, productos, recetas):
+        self.costo_ingrediente = {i: Decimal(c or 0) for i, c in ingredientes}
+        self.precios = {p: Decimal(precio or 0) for p, precio in productos}
+        self.recetas = defaultdict(dict)
+        self.usos = defaultdict(set)
+        for product_id, ingredient_id, qty in recetas:
+            self.recetas[product_id][ingredient_id] = Decimal(qty)
+            self.usos[ingredient_id].add(product_id)
+        self.costos = {}
+        for product_id in self.precios:
+            self._recalcular(product_id)
+        self.listo = True
+        self._cargado = time.monotonic()
+
+    def _recalcular(self, product_id):
+        receta = self.recetas.get(product_id, {})
+        self.costos[product_id] = sum(
+            (qty * self.costo_ingrediente.get(ing_id, Decimal("0")) for ing_id, qty in receta.items()),
+            Decimal("0")
+        )
+        self.recalculos += 1
+
+    # --- CAMBIOS INCREMENTALES ---
+
+    def set_costo_ingrediente(self, ingredient_id, costo):
+        """Actualiza el costo de un ingrediente y recalcula solo los productos afectados"""
+        self.costo_ingrediente[ingredient_id] = Decimal(costo)
+        afectados = self.usos.get(ingredient_id, set())
+        for product_id in afectados:
+            self._recalcular(product_id)
+        return afectados
+
+    def set_receta(self, product_id, receta):
+        """Reemplaza la receta de un producto ({ingredient_id: cantidad})"""
+        for ing_id in self.recetas.get(product_id, {}):
+            self.usos[ing_id].discard(product_id)
+        self.recetas[product_id] = {i: Decimal(q) for i, q in receta.items()}
+        for ing_id in self.recetas[product_id]:
+            self.usos[ing_id].add(product_id)
+        self._recalcular(product_id)
+
+    def set_precio(self, product_id, precio):
+        self.precios[product_id] = Decimal(precio)
+        if product_id not in self.costos:
+            self._recalcular(product_id)
+
+    # --- CONSULTAS ---
+
+    def costo(self, product_id):
+        return self.costos.get(product_id, Decimal("0"))
+
+    def margen(self, product_id):
+        """Margen unitario (precio - costo) y porcentaje sobre el precio"""
+        precio = self.precios.get(product_id, Decimal("0"))
+        margen = precio - self.costo(product_id)
+        pct = (margen / precio * 100) if precio else Decimal("0")
+        return margen, pct
+
+
+motor_costos = CostEngine()
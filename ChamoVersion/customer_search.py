@@ -0,0 +1,130 @@
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from db import Customer
+
+ClienteResumen = namedtuple(
+    "ClienteResumen", "id name last_name document_type document_number phone email"
+)
+
+MAX_CANDIDATOS = 2000  # tope de ids revisados por búsqueda
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, para que 'garcia' encuentre 'García'"""
+    texto = unicodedata.normalize("NFKD", texto or "").lower()
+    return "".join(ch for ch in texto if not unicodedata.combining(ch))
+
+
+def _compactar(token):
+    """Tokens con dígitos sin separadores: '999-111' y '999111' son el mismo teléfono o documento"""
+    if any(ch.isdigit() for ch in token):
+        return "".join(ch for ch in token if ch.isalnum())
+    return token
+
+
+def _tokens(c):
+    tokens = normalizar(f"{c.name} {c.last_name or ''}").split()
+    if c.document_number:
+        tokens.append(normalizar(c.document_number))
+    if c.phone:
+        tokens.append("".join(ch for ch in c.phone if ch.isdigit()))
+    return [t for t in map(_compactar, tokens) if t]
+
+
+class CustomerIndex:
+    """Índice en memoria por prefijo sobre nombre, apellido, documento y teléfono
+
+    Los tokens se guardan ordenados; un prefijo es un rango contiguo que se ubica
+    con bisect, así cada búsqueda es O(log n + resultados).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = []   # [(token, customer_id)] ordenada
+        self._tokens = {}     # customer_id -> tokens
+        self.clientes = {}    # customer_id -> ClienteResumen
+        self.ultimo_id = 0
+
+    def refrescar(self, session):
+        """Agrega al índice solo los clientes creados desde el último refresco"""
+        nuevos = session.query(
+            Customer.id, Customer.name, Customer.last_name, Customer.document_type,
+            Customer.document_number, Customer.phone, Customer.email
+        ).filter(Customer.id > self.ultimo_id, Customer.is_active == True).order_by(Customer.id).all()
+        if not nuevos:
+            return 0
+        with self._lock:
+            # Pocos clientes nuevos: inserción ordenada; carga inicial: un solo sort
+            masivo = len(nuevos) > 100
+            for fila in nuevos:
+                self._agregar(ClienteResumen(*fila), ordenar=not masivo)
+            if masivo:
+                self._entradas.sort()
+        return len(nuevos)
+
+    def actualizar(self, cliente):
+        """Reindexa un cliente editado (ClienteResumen)"""
+        with self._lock:
+            self._quitar(cliente.id)
+            self._agregar(cliente)
+
+    def quitar(self, customer_id):
+        """Saca del índice un cliente desactivado"""
+        with self._lock:
+            self._quitar(customer_id)
+
+    def _agregar(self, cliente, ordenar=True):
+        tokens = _tokens(cliente)
+        self.clientes[cliente.id] = cliente
+        self._tokens[cliente.id] = tokens
+        for token in tokens:
+            if ordenar:
+                insort(self._entradas, (token, cliente.id))
+            else:
+                self._entradas.append((token, cliente.id))
+        self.ultimo_id = max(self.ultimo_id, cliente.id)
+
+    def _quitar(self, customer_id):
+        for token in self._tokens.pop(customer_id, []):
+            i = bisect_left(self._entradas, (token, customer_id))
+            if i < len(self._entradas) and self._entradas[i] == (token, customer_id):
+                del self._entradas[i]
+        self.clientes.pop(customer_id, None)
+
+    def buscar(self, texto, limite=20):
+        """Clientes cuyo cada término sea prefijo de algún token, ordenados por nombre"""
+        terminos = [t for t in map(_compactar, normalizar(texto).split()) if t]
+        if not terminos:
+            return []
+        # El término más largo suele ser el más selectivo: define los candidatos
+        terminos.sort(key=len, reverse=True)
+        principal, resto = terminos[0], terminos[1:]
+        with self._lock:
+            candidatos = []
+            vistos = set()
+            i = bisect_left(self._entradas, (principal,))
+            while i < len(self._entradas) and len(candidatos) < MAX_CANDIDATOS:
+                token, customer_id = self._entradas[i]
+                if not token.startswith(principal):
+                    break
+                if customer_id not in vistos:
+                    vistos.add(customer_id)
+                    tokens = self._tokens[customer_id]
+                    if all(any(t.startswith(term) for t in tokens) for term in resto):
+                        candidatos.append(self.clientes[customer_id])
+                i += 1
+        candidatos.sort(key=lambda c: (normalizar(c.name), normalizar(c.last_name)))
+        return candidatos[:limite]
+
+    def cliente(self, customer_id):
+        return self.clientes.get(customer_id)
+
+
+def etiqueta(c):
+    return f"{c.name} {c.last_name or ''} - {c.document_type}: {c.document_number}".strip()
+
+
+indice_clientes = CustomerIndex()
@@ -0,0 +1,77 @@
+"""Acumulados por cliente (órdenes, total gastado, primera y última compra)
+
+Uso: python customer_stats.py   (recalcula todo desde orders, por lotes)
+"""
+import time
+
+from sqlalchemy import func, select
+
+from db import Customer, CustomerStats, Order, get_session, upsert
+from statements import TOP_CLIENTES
+
+LOTE = 1000  # clientes por transacción en el recálculo
+
+
+def registrar_compra_cliente(session, customer_id, total, ts):
+    """Suma una compra a los acumulados del cliente (dentro de la transacción del checkout)"""
+    stmt = upsert(session, CustomerStats).values(
+        customer_id=customer_id, order_count=1, total_spent=total, first_purchase=ts, last_purchase=ts
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CustomerStats.customer_id],
+        set_={
+            "order_count": CustomerStats.order_count + 1,
+            "total_spent": CustomerStats.total_spent + stmt.excluded.total_spent,
+            "first_purchase": func.coalesce(CustomerStats.first_purchase, stmt.excluded.first_purchase),
+            "last_purchase": stmt.excluded.last_purchase,
+        }
+    )
+    session.execute(stmt)
+
+
+def recalcular_estadisticas(session, lote=LOTE):
+    """Reconstruye customer_stats desde orders, por rangos de ids para no bloquear mucho tiempo
+
+    Sirve para el backfill inicial y para corregir desvíos. Conviene correrlo con
+    poca actividad: una venta que confirme a mitad de un lote puede quedar fuera.
+    """
+    ultimo_id = session.query(func.max(Customer.id)).scalar() or 0
+    filas_total = 0
+    for desde in range(0, ultimo_id + 1, lote):
+        agregados = select(
+            Order.customer_id,
+            func.count(Order.id),
+            func.coalesce(func.sum(Order.total), 0),
+            func.min(Order.ts),
+            func.max(Order.ts),
+        ).where(Order.customer_id > desde, Order.customer_id <= desde + lote).group_by(Order.customer_id)
+        filas = [
+            {"customer_id": cid, "order_count": n, "total_spent": total, "first_purchase": primera, "last_purchase": ultima}
+            for cid, n, total, primera, ultima in session.execute(agregados)
+        ]
+        if filas:
+            stmt = upsert(session, CustomerStats)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[CustomerStats.customer_id],
+                set_={c: stmt.excluded[c] for c in ("order_count", "total_spent", "first_purchase", "last_purchase")}
+            )
+            session.execute(stmt, filas)
+        session.commit()
+        filas_total += len(filas)
+    return filas_total
+
+
+def top_clientes(session, limite=10, por="order_count"):
+    """Clientes activos con más compras (o más gasto), servido desde el índice de customer_stats"""
+    stmt = TOP_CLIENTES["order_count" if por == "order_count" else "total_spent"]
+    return session.execute(stmt, {"limite": limite}).all()
+
+
+if __name__ == "__main__":
+    session = get_session()
+    try:
+        inicio = time.perf_counter()
+        filas = recalcular_estadisticas(session)
+        print(f"{filas} clientes recalculados en {time.perf_counter() - inicio:.1f} s")
+    finally:
+        session.close()
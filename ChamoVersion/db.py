@@ -1,24 +1,122 @@
 import os
+import threading
+import time
 from datetime import datetime
 from decimal import Decimal
 from sqlalchemy import (
-    create_engine, Column, Integer, String, DateTime, Boolean,
-    ForeignKey, Numeric, Text, func
+    create_engine, event, text, Column, Integer, String, Date, DateTime, Boolean,
+    ForeignKey, Index, Numeric, Text, UniqueConstraint, func
 )
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.engine import URL
+from sqlalchemy.orm import Session, declarative_base, relationship, sessionmaker
+from sqlalchemy.sql.selectable import Select
 
-# === DATOS DE CONEXIÓN AIVEN POSTGRESQL ===
-DB_HOST = "pg-39dfce5c-togata.d.aivencloud.com"
-DB_NAME = "defaultdb"
-DB_USER = "avnadmin"
-DB_PASS = "AVNS_8t_NfZ6Pe0Q9s8RqL6x"
-DB_PORT = 11620
+# === CONFIGURACIÓN DE CONEXIÓN ===
+# Prioridad: DATABASE_URL; luego CHAMO_DB=sqlite (archivo local, una sola tienda);
+# si no, PostgreSQL armado con DB_HOST, DB_PORT (5432), DB_NAME, DB_USER y DB_PASS.
+# Sin valores por defecto: las credenciales no van en el código.
+SQLITE_PATH = os.environ.get("CHAMO_SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chamo.sqlite3"))
+
+
+def _url_postgres():
+    faltan = [v for v in ("DB_HOST", "DB_NAME", "DB_USER", "DB_PASS") if not os.environ.get(v)]
+    if faltan:
+        raise RuntimeError(
+            f"Falta configurar la base: {', '.join(faltan)}. "
+            "Definir DATABASE_URL, o CHAMO_DB=sqlite, o DB_HOST, DB_NAME, DB_USER y DB_PASS (y DB_PORT)"
+        )
+    return URL.create(
+        "postgresql+psycopg2", username=os.environ["DB_USER"], password=os.environ["DB_PASS"],
+        host=os.environ["DB_HOST"], port=int(os.environ.get("DB_PORT", "5432")), database=os.environ["DB_NAME"],
+    ).render_as_string(hide_password=False)
+
+
+if os.environ.get("DATABASE_URL"):
+    DATABASE_URL = os.environ["DATABASE_URL"]
+elif os.environ.get("CHAMO_DB") == "sqlite":
+    DATABASE_URL = f"sqlite:///{SQLITE_PATH}"
+else:
+    DATABASE_URL = _url_postgres()
+
+# Caché de SQL compilado del engine (SQLAlchemy usa 500 por defecto); las sentencias
+# de statements.py más las del ORM y los reportes caben holgadas
+QUERY_CACHE_SIZE = int(os.environ.get("CHAMO_QUERY_CACHE_SIZE", "1200"))
+# psycopg 3 (postgresql+psycopg://) prepara en el servidor una sentencia tras N usos;
+# "off" lo desactiva (necesario detrás de pgbouncer en modo transacción)
+PREPARE_THRESHOLD = os.environ.get("CHAMO_PREPARE_THRESHOLD", "5")
+
+# Perfil SQLite: se aplican a cada conexión nueva
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # los lectores no bloquean al que escribe
+    "PRAGMA synchronous=NORMAL",    # con WAL sigue siendo consistente; fsync solo en checkpoints
+    "PRAGMA cache_size=-32000",     # 32 MB de caché de páginas por conexión
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",     # esperar al otro escritor en vez de fallar con "database is locked"
+    "PRAGMA foreign_keys=ON",       # mismas reglas de integridad que PostgreSQL
+)
+
+# Réplica de solo lectura opcional para reportes y listados
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+# Segundos tras una escritura en que las lecturas verifican que la réplica ya la tiene
+REPLICA_LAG_S = float(os.environ.get("CHAMO_REPLICA_LAG_S", "5"))
+
+
+class RoutingSession(Session):
+    """Sesión que manda las lecturas a la réplica (si se le asignó una) y todo lo demás al primario
+
+    Solo un SELECT sin FOR UPDATE es lectura; text(), LOCK, DDL, funciones con
+    efectos y cualquier cosa que no se reconozca van al primario.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if (replica is not None and not self._flushing
+                and isinstance(clause, Select) and clause._for_update_arg is None):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
 
-DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 # === CONEXIÓN A LA DB ===
-engine = create_engine(DATABASE_URL, echo=False, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+
+def crear_engine(url):
+    """Engine con el perfil del motor: en SQLite, pragmas de WAL y conexiones usables desde cualquier hilo
+
+    Cada hilo de Streamlit toma su propia conexión del pool mientras la usa; no se
+    usa SingletonThreadPool porque Streamlit crea hilos nuevos en cada rerun.
+    """
+    if url.startswith("postgresql+psycopg:"):
+        umbral = None if PREPARE_THRESHOLD == "off" else int(PREPARE_THRESHOLD)
+        return create_engine(url, echo=False, future=True, query_cache_size=QUERY_CACHE_SIZE,
+                             connect_args={"prepare_threshold": umbral})
+    if not url.startswith("sqlite"):
+        # psycopg2 no tiene sentencias preparadas del lado del servidor
+        return create_engine(url, echo=False, future=True, query_cache_size=QUERY_CACHE_SIZE)
+
+    # cached_statements: caché de sentencias preparadas de sqlite3 por conexión (128 por defecto)
+    nuevo = create_engine(url, echo=False, future=True, query_cache_size=QUERY_CACHE_SIZE,
+                          connect_args={"check_same_thread": False, "timeout": 5, "cached_statements": 256})
+
+    @event.listens_for(nuevo, "connect")
+    def _pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return nuevo
+
+engine = crear_engine(DATABASE_URL)
+replica_engine = crear_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+SessionLocal = sessionmaker(bind=engine, class_=RoutingSession, autoflush=False, autocommit=False, future=True)
+
+# Instrumentación de consultas (opcional, CHAMO_SQL_PROFILE=1)
+if os.environ.get("CHAMO_SQL_PROFILE") == "1":
+    from instrumentation import profiler
+    profiler.instalar(engine)
+    if replica_engine is not None:
+        profiler.instalar(replica_engine)
+
 Base = declarative_base()
 
 # === MODELOS ===
@@ -74,6 +172,8 @@ class Ingredient(Base):
     name = Column(String(120), nullable=False, unique=True)
     unit = Column(String(20), nullable=False)
     cost_per_unit = Column(Numeric(12,4), nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # versión del motor de costos
+    recipe_items = relationship("RecipeItem", back_populates="ingredient")
 
 
 class Product(Base):
@@ -85,7 +185,64 @@ class Product(Base):
     price = Column(Numeric(12,2), nullable=False, default=0)
     category = Column(String(80))
     is_active = Column(Boolean, default=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     order_items = relationship("OrderItem", back_populates="product")
+    recipe = relationship("RecipeItem", back_populates="product", cascade="all, delete-orphan")
+    prices = relationship("ProductPrice", back_populates="product", cascade="all, delete-orphan",
+                          order_by="ProductPrice.valid_from")
+
+
+class ProductPrice(Base):
+    """Historial de precios: cada fila vale en [valid_from, valid_to); valid_to NULL = sin fin
+
+    Los rangos de un producto no se solapan; products.price es siempre el precio vigente.
+    El índice (product_id, valid_from) resuelve "precio en la fecha X" leyendo una sola fila.
+    """
+    __tablename__ = "product_prices"
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    price = Column(Numeric(12,2), nullable=False)
+    valid_from = Column(DateTime, nullable=False)
+    valid_to = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("product_id", "valid_from", name="uq_product_prices_product_from"),
+    )
+
+    product = relationship("Product", back_populates="prices")
+
+
+class Shift(Base):
+    """Turno de caja de un cajero en una tienda; closed_at NULL = abierto"""
+    __tablename__ = "shifts"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    opened_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    closed_at = Column(DateTime, nullable=True)
+    opening_cash = Column(Numeric(12,2), nullable=False, default=0)
+    counted_cash = Column(Numeric(12,2), nullable=True)
+
+    # Un solo turno abierto por cajero y tienda
+    __table_args__ = (
+        Index("uq_shifts_abierto", "user_id", "store_id", unique=True,
+              postgresql_where=text("closed_at IS NULL"), sqlite_where=text("closed_at IS NULL")),
+        Index("ix_shifts_store_opened", "store_id", "opened_at"),
+    )
+
+    user = relationship("User")
+    store = relationship("Store")
+    totals = relationship("ShiftTotal", cascade="all, delete-orphan")
+
+
+class ShiftTotal(Base):
+    """Acumulados del turno por medio de pago, actualizados en cada checkout (el reporte Z los lee tal cual)"""
+    __tablename__ = "shift_totals"
+    shift_id = Column(Integer, ForeignKey("shifts.id"), primary_key=True)
+    payment_method = Column(String(20), primary_key=True)
+    sales_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Numeric(14,2), nullable=False, default=0)
 
 
 class Order(Base):
@@ -96,6 +253,20 @@ class Order(Base):
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=True)
     total = Column(Numeric(12,2), default=0)
     ts = Column(DateTime, default=datetime.utcnow)
+    # Llave generada con el carrito: un reintento de la misma venta no crea otra orden
+    idempotency_key = Column(String(64), unique=True, nullable=True)
+    payment_method = Column(String(20), nullable=False, default="efectivo")
+    shift_id = Column(Integer, ForeignKey("shifts.id"), nullable=True)
+
+    # Historial por cliente/cajero/tienda con paginación por (ts, id); en PostgreSQL
+    # el total va incluido en el índice para no visitar la tabla al listar
+    __table_args__ = (
+        Index("ix_orders_ts_id", "ts", "id", postgresql_include=["total"]),
+        Index("ix_orders_customer_ts_id", "customer_id", "ts", "id", postgresql_include=["total"]),
+        Index("ix_orders_user_ts_id", "user_id", "ts", "id", postgresql_include=["total"]),
+        Index("ix_orders_store_ts_id", "store_id", "ts", "id", postgresql_include=["total"]),
+        Index("ix_orders_shift_id", "shift_id", "payment_method", postgresql_include=["total"]),
+    )
 
     user = relationship("User", back_populates="orders")
     store = relationship("Store", back_populates="orders")
@@ -108,25 +279,247 @@ class OrderItem(Base):
     id = Column(Integer, primary_key=True)
     order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
-    qty = Column(Numeric(12,2), nullable=False, default=1)
+    qty = Column(Numeric(12,3), nullable=False, default=1)  # hasta milésimas (ESCALA_QTY)
     price = Column(Numeric(12,2), nullable=False, default=0)
+    discount = Column(Numeric(12,2), nullable=False, default=0)  # importe descontado de la línea (qty * price - discount)
+    promotion_id = Column(Integer, ForeignKey("promotions.id"), nullable=True)
+
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id", postgresql_include=["product_id", "qty", "price"]),
+    )
 
     order = relationship("Order", back_populates="items")
     product = relationship("Product", back_populates="order_items")
 
 
+class ReceiptOutbox(Base):
+    """Recibos digitales por enviar; se escriben en la transacción del checkout y los despacha receipts.py"""
+    __tablename__ = "receipt_outbox"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
+    channel = Column(String(10), nullable=False)        # email, sms
+    destination = Column(String(200), nullable=False)
+    status = Column(String(10), nullable=False, default="pendiente")  # pendiente, enviado, fallido
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+    # El despachador toma los pendientes vencidos en orden
+    __table_args__ = (
+        Index("ix_receipt_outbox_pendientes", "status", "next_attempt_at", "id"),
+    )
+
+
+class Promotion(Base):
+    """Regla de descuento; los campos de alcance vacíos no restringen
+
+    kind:
+      mayorista   desde min_qty unidades el precio unitario pasa a `price`
+      porcentaje  `percent` % de descuento sobre la línea (desde min_qty)
+      combo       por cada unidad de product_id con una de combo_product_id se descuenta `price`
+    """
+    __tablename__ = "promotions"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(120), nullable=False)
+    kind = Column(String(20), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
+    category = Column(String(80), nullable=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=True)
+    document_type = Column(String(20), nullable=True)  # p. ej. RUC: precio para empresas
+    combo_product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
+    min_qty = Column(Numeric(12,3), nullable=False, default=0)
+    price = Column(Numeric(12,2), nullable=True)
+    percent = Column(Numeric(5,2), nullable=True)
+    starts_at = Column(DateTime, nullable=True)
+    ends_at = Column(DateTime, nullable=True)
+    is_active = Column(Boolean, default=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class RecipeItem(Base):
+    __tablename__ = "recipe_items"
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), nullable=False, index=True)
+    qty = Column(Numeric(12,4), nullable=False)  # cantidad de ingrediente por unidad de producto
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (UniqueConstraint("product_id", "ingredient_id"),)
+
+    product = relationship("Product", back_populates="recipe")
+    ingredient = relationship("Ingredient", back_populates="recipe_items")
+
+
+class InventoryMovement(Base):
+    """Libro de movimientos de inventario (solo se agregan filas)"""
+    __tablename__ = "inventory_movements"
+    id = Column(Integer, primary_key=True)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), nullable=False, index=True)
+    kind = Column(String(20), nullable=False)  # compra, consumo, merma, ajuste
+    qty = Column(Numeric(14,4), nullable=False)  # positivo entra, negativo sale
+    supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+    note = Column(String(200))
+    ts = Column(DateTime, default=datetime.utcnow)
+
+
+class IngredientStock(Base):
+    """Stock actual materializado, actualizado junto con cada lote de movimientos"""
+    __tablename__ = "ingredient_stock"
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), primary_key=True)
+    qty = Column(Numeric(14,4), nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class StockSnapshot(Base):
+    """Foto del stock hasta un movimiento; se reconstruye con foto + movimientos posteriores"""
+    __tablename__ = "stock_snapshots"
+    id = Column(Integer, primary_key=True)
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), nullable=False)
+    movement_id = Column(Integer, nullable=False, index=True)  # último movimiento incluido
+    qty = Column(Numeric(14,4), nullable=False)
+    ts = Column(DateTime, default=datetime.utcnow)
+
+
+class DailyProductSales(Base):
+    """Contadores de ventas por tienda, producto y día, actualizados en cada checkout"""
+    __tablename__ = "daily_product_sales"
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    qty = Column(Numeric(14,3), nullable=False, default=0)
+    revenue = Column(Numeric(14,2), nullable=False, default=0)
+
+
+class ProductSalesTotal(Base):
+    """Contadores históricos por producto: el top de productos es un ORDER BY ... LIMIT"""
+    __tablename__ = "product_sales_totals"
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    qty = Column(Numeric(14,3), nullable=False, default=0, index=True)
+    revenue = Column(Numeric(14,2), nullable=False, default=0)
+
+
+class CustomerStats(Base):
+    """Acumulados de compras por cliente, actualizados en cada checkout"""
+    __tablename__ = "customer_stats"
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    total_spent = Column(Numeric(14,2), nullable=False, default=0)
+    first_purchase = Column(DateTime)
+    last_purchase = Column(DateTime)
+
+    # Top de clientes = ORDER BY ... LIMIT sobre estos índices
+    __table_args__ = (
+        Index("ix_customer_stats_order_count", "order_count"),
+        Index("ix_customer_stats_total_spent", "total_spent"),
+    )
+
+
+class ProductionPlan(Base):
+    __tablename__ = "production_plans"
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    qty = Column(Integer, nullable=False)  # unidades a producir
+    forecast = Column(Numeric(14,2))  # demanda estimada
+    generated_at = Column(DateTime, default=datetime.utcnow)
+
+
 # === FUNCIONES ===
 
-def init_db(drop=False):
-    """Inicializa la base de datos"""
-    if drop:
-        Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
+def init_db():
+    """Lleva el esquema a la última versión con las migraciones de migrations.py (sin borrar datos)"""
+    from migrations import asegurar_esquema
+    asegurar_esquema(engine)
 
 def get_session():
     """Obtiene una sesión de base de datos"""
     return SessionLocal()
 
+def get_read_session():
+    """Sesión para reportes y listados: lee de la réplica si existe y está al día
+
+    Durante REPLICA_LAG_S segundos después de una escritura confirmada por el
+    mismo usuario (ver usar_marca; p. ej. un checkout) se compara el LSN de esa
+    escritura con el que la réplica ya aplicó; si va atrasada se lee del primario
+    (read-your-writes). Las escrituras que se hagan con esta sesión igual van al
+    primario.
+    """
+    session = SessionLocal()
+    if replica_engine is not None and _replica_al_dia():
+        session.info["replica"] = replica_engine
+    return session
+
+# === RÉPLICA: READ-YOUR-WRITES ===
+
+# La última escritura se guarda en el estado del usuario (st.session_state), no
+# en el proceso: con varios workers cada uno solo ve las escrituras que pasaron
+# por él. Fuera de Streamlit (CLI, benchmarks) se usa un estado del proceso.
+_marca_hilo = threading.local()
+_marca_proceso = {}
+_lock_escritura = threading.Lock()
+
+def usar_marca(estado):
+    """Asocia las escrituras y lecturas de este hilo al estado de un usuario (dict o st.session_state)"""
+    _marca_hilo.estado = estado
+
+def _marca():
+    estado = getattr(_marca_hilo, "estado", None)
+    return _marca_proceso if estado is None else estado
+
+def _replica_al_dia():
+    with _lock_escritura:
+        ts, lsn = _marca().get("ultima_escritura", (None, None))
+    if ts is None or time.time() - ts > REPLICA_LAG_S:
+        return True
+    if lsn is None:
+        return False  # sin LSN (otro motor) solo queda esperar la ventana
+    try:
+        with replica_engine.connect() as conn:
+            return bool(conn.execute(
+                text("SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)"), {"lsn": lsn}
+            ).scalar())
+    except Exception:
+        return False
+
+def _registrar_escritura():
+    lsn = None
+    if engine.dialect.name == "postgresql":
+        try:
+            with engine.connect() as conn:
+                lsn = conn.execute(text("SELECT CAST(pg_current_wal_lsn() AS text)")).scalar()
+        except Exception:
+            pass
+    with _lock_escritura:
+        _marca()["ultima_escritura"] = (time.time(), lsn)
+
+@event.listens_for(RoutingSession, "after_flush")
+def _marcar_flush(session, flush_context):
+    session.info["escribio"] = True
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _marcar_dml(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["escribio"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def _despues_commit(session):
+    if session.info.pop("escribio", False) and replica_engine is not None:
+        _registrar_escritura()
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _despues_rollback(session, previous_transaction):
+    session.info.pop("escribio", None)
+
+def upsert(session, model):
+    """INSERT con soporte ON CONFLICT según el dialecto de la sesión"""
+    if session.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(model)
+
 def test_connection():
     """Prueba la conexión a la base de datos"""
     try:
@@ -136,19 +529,6 @@ def test_connection():
     except Exception:
         return False
 
-def force_recreate_tables():
-    """Elimina y recrea todas las tablas"""
-    try:
-        print("Eliminando tablas existentes...")
-        Base.metadata.drop_all(engine)
-        print("Creando tablas con esquema correcto...")
-        Base.metadata.create_all(engine)
-        print("Tablas recreadas exitosamente")
-        return True
-    except Exception as e:
-        print(f"Error al recrear tablas: {e}")
-        return False
-
 # Verificar conexión al importar
 try:
     test_connection()
@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict, deque
+from decimal import Decimal
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from db import Order
+from money import precio_decimal
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURACIÓN ===
+# "local": pub/sub en proceso (un solo worker de Streamlit)
+# "postgres": LISTEN/NOTIFY, para varios workers contra la misma base
+EVENTS_MODE = os.environ.get("CHAMO_EVENTS", "local")
+CANAL_VENTAS = "ventas"
+
+
+class EventBus:
+    """Pub/sub en proceso: los suscriptores reciben cada payload publicado"""
+
+    def __init__(self):
+        self._subs = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, canal, callback):
+        with self._lock:
+            self._subs[canal].append(callback)
+
+    def publish(self, canal, payload):
+        with self._lock:
+            callbacks = list(self._subs[canal])
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Error en suscriptor del canal %s", canal)
+
+
+bus = EventBus()
+
+
+# === PUBLICACIÓN DESDE EL CHECKOUT ===
+
+def publicar_venta(session, orden):
+    """Publica la venta; el evento solo sale si la transacción hace commit
+
+    `orden.total_centimos` lo pone procesar_venta: la suma de líneas ya
+    redondeadas, los mismos céntimos que quedan en orders.total.
+    """
+    payload = {
+        "order_id": orden.id,
+        "store_id": orden.store_id,
+        "total_centimos": orden.total_centimos,
+        "ts": orden.ts.isoformat() if orden.ts else None,
+    }
+    if EVENTS_MODE == "postgres":
+        # NOTIFY es transaccional: Postgres lo entrega al confirmar
+        session.execute(func.pg_notify(CANAL_VENTAS, json.dumps(payload)).select())
+    else:
+        session.info.setdefault("ventas_pendientes", []).append(payload)
+
+
+@event.listens_for(Session, "after_commit")
+def _al_confirmar(session):
+    for payload in session.info.pop("ventas_pendientes", []):
+        bus.publish(CANAL_VENTAS, payload)
+
+
+@event.listens_for(Session, "after_rollback")
+def _al_revertir(session):
+    session.info.pop("ventas_pendientes", None)
+
+
+# === LISTENER POSTGRESQL ===
+
+_listener = None
+
+def iniciar_listener(engine):
+    """Reenvía al bus local las notificaciones de todos los workers (solo modo postgres)"""
+    global _listener
+    if EVENTS_MODE != "postgres" or _listener is not None:
+        return
+    _listener = threading.Thread(target=_escuchar, args=(engine,), name="ventas-listener", daemon=True)
+    _listener.start()
+
+
+def _escuchar(engine):
+    while True:
+        raw = None
+        try:
+            raw = engine.raw_connection()
+            conn = raw.driver_connection
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {CANAL_VENTAS}")
+            if engine.dialect.driver == "psycopg":
+                # psycopg 3: notifies() es un generador que bloquea hasta cada notificación
+                for n in conn.notifies():
+                    bus.publish(n.channel, json.loads(n.payload))
+                raise ConnectionError("la conexión de LISTEN se cerró")
+            # psycopg2: esperar con select() y vaciar conn.notifies tras poll()
+            while True:
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    n = conn.notifies.pop(0)
+                    bus.publish(n.channel, json.loads(n.payload))
+        except Exception:
+            logger.exception("Listener de ventas caído, reintentando en 5s")
+            if raw is not None:
+                raw.invalidate()
+            time.sleep(5)
+
+
+# === TICKER DE VENTAS ===
+
+class SalesTicker:
+    """Totales de ventas en memoria, actualizados en O(1) por cada evento de venta"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ordenes = 0
+        self.total = Decimal("0")
+        self._ultimo_id = None  # id máximo incluido en la carga inicial
+        # Ventas llegadas antes de la carga inicial (que solo ocurre al abrir un dashboard).
+        # Con tope: las más viejas ya están confirmadas y las cuenta el agregado de cargar()
+        self._pendientes = deque(maxlen=1000)
+
+    @property
+    def listo(self):
+        return self._ultimo_id is not None
+
+    def cargar(self, session):
+        """Carga inicial: un único agregado sobre orders al arrancar el proceso"""
+        ordenes, total, max_id = session.query(
+            func.count(Order.id), func.coalesce(func.sum(Order.total), 0), func.max(Order.id)
+        ).one()
+        with self._lock:
+            self.ordenes = ordenes or 0
+            self.total = Decimal(total or 0)
+            self._ultimo_id = max_id or 0
+            for payload in self._pendientes:
+                self._aplicar(payload)
+            self._pendientes.clear()
+
+    def on_venta(self, payload):
+        with self._lock:
+            if self._ultimo_id is None:
+                self._pendientes.append(payload)
+            else:
+                self._aplicar(payload)
+
+    def _aplicar(self, payload):
+        # Las ventas ya contadas en la carga inicial se ignoran
+        if payload["order_id"] <= self._ultimo_id:
+            return
+        self.ordenes += 1
+        self.total += precio_decimal(payload["total_centimos"])
+
+
+ticker = SalesTicker()
+bus.subscribe(CANAL_VENTAS, ticker.on_venta)
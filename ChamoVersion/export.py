@@ -0,0 +1,105 @@
+"""Exportación de órdenes, clientes y productos a CSV/XLSX en streaming
+
+Uso: python export.py <orders|customers|products> <archivo.csv|archivo.xlsx>
+"""
+import csv
+import sys
+from importlib.util import find_spec
+
+from sqlalchemy import select
+
+from db import Customer, Order, OrderItem, Product, Store, User, get_read_session
+
+CHUNK = 5000  # filas por lote leído del cursor del servidor
+FORMATOS = ["csv"] + (["xlsx"] if find_spec("openpyxl") else [])  # xlsx solo si openpyxl está instalado
+
+EXPORTS = {
+    "orders": (
+        # Outer join: una orden sin items sale igual, con las columnas del item vacías
+        ["orden_id", "fecha", "tienda", "cajero", "cliente_id", "total_orden", "sku", "producto", "cantidad", "precio", "descuento"],
+        lambda: select(
+            Order.id, Order.ts, Store.name, User.username, Order.customer_id, Order.total,
+            Product.sku, Product.name, OrderItem.qty, OrderItem.price, OrderItem.discount
+        ).outerjoin(OrderItem, OrderItem.order_id == Order.id)
+         .outerjoin(Product, Product.id == OrderItem.product_id)
+         .join(Store, Store.id == Order.store_id)
+         .join(User, User.id == Order.user_id)
+         .order_by(Order.id, OrderItem.id)
+    ),
+    "customers": (
+        ["id", "nombre", "apellido", "tipo_doc", "documento", "telefono", "email", "direccion", "activo", "registrado"],
+        lambda: select(
+            Customer.id, Customer.name, Customer.last_name, Customer.document_type, Customer.document_number,
+            Customer.phone, Customer.email, Customer.address, Customer.is_active, Customer.created_at
+        ).order_by(Customer.id)
+    ),
+    "products": (
+        ["id", "sku", "nombre", "descripcion", "precio", "categoria", "activo"],
+        lambda: select(
+            Product.id, Product.sku, Product.name, Product.description, Product.price,
+            Product.category, Product.is_active
+        ).order_by(Product.id)
+    ),
+}
+
+
+def iterar_lotes(session, tipo, chunk=CHUNK):
+    """Devuelve lotes de filas leídos con un cursor del lado del servidor
+
+    yield_per activa stream_results: nunca se materializa el resultado completo.
+    """
+    _, consulta = EXPORTS[tipo]
+    result = session.execute(consulta().execution_options(yield_per=chunk))
+    for lote in result.partitions():
+        yield lote
+
+
+def exportar_csv(session, tipo, archivo, chunk=CHUNK):
+    """Escribe el export en `archivo` (abierto en modo texto) y devuelve las filas escritas"""
+    encabezados, _ = EXPORTS[tipo]
+    writer = csv.writer(archivo)
+    writer.writerow(encabezados)
+    total = 0
+    for lote in iterar_lotes(session, tipo, chunk):
+        writer.writerows(lote)
+        total += len(lote)
+    return total
+
+
+def exportar_xlsx(session, tipo, ruta, chunk=CHUNK):
+    """Escribe el export en un XLSX en modo write-only (memoria acotada)"""
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("Para exportar a Excel instala openpyxl (pip install openpyxl)")
+
+    encabezados, _ = EXPORTS[tipo]
+    wb = Workbook(write_only=True)
+    hoja = wb.create_sheet(tipo)
+    hoja.append(encabezados)
+    total = 0
+    for lote in iterar_lotes(session, tipo, chunk):
+        for fila in lote:
+            hoja.append(list(fila))
+        total += len(lote)
+    wb.save(ruta)
+    return total
+
+
+def exportar(session, tipo, ruta, chunk=CHUNK):
+    if ruta.endswith(".xlsx"):
+        return exportar_xlsx(session, tipo, ruta, chunk)
+    with open(ruta, "w", newline="", encoding="utf-8") as archivo:
+        return exportar_csv(session, tipo, archivo, chunk)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in EXPORTS:
+        print(__doc__)
+        sys.exit(1)
+    session = get_read_session()
+    try:
+        filas = exportar(session, sys.argv[1], sys.argv[2])
+    finally:
+        session.close()
+    print(f"{filas} filas exportadas a {sys.argv[2]}")
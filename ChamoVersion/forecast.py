@@ -0,0 +1,101 @@
+"""Pronóstico de demanda y plan de producción del día siguiente
+
+Uso: python forecast.py [--fecha AAAA-MM-DD] [--workers N]
+"""
+import argparse
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert, select
+
+from db import DailyProductSales, ProductionPlan, get_session
+
+SEMANAS = 6    # semanas de historia para cada día de la semana
+ALPHA = 0.4    # peso de la semana más reciente (suavizado exponencial)
+MARGEN = 0.10  # colchón de producción sobre la demanda estimada
+
+
+def pronosticar_tienda(store_id, historia, fecha, semanas=SEMANAS, alpha=ALPHA, margen=MARGEN):
+    """Demanda por producto para `fecha` a partir del mismo día de la semana en semanas anteriores
+
+    `historia` tiene columnas day, product_id, qty de una sola tienda.
+    """
+    dias = pd.date_range(end=pd.Timestamp(fecha) - pd.Timedelta(days=7), periods=semanas, freq="7D")
+    tabla = historia.pivot_table(index="day", columns="product_id", values="qty", aggfunc="sum")
+    tabla = tabla.reindex(dias).fillna(0.0)
+
+    # Pesos exponenciales: la semana más reciente (última fila) pesa alpha
+    pesos = alpha * (1 - alpha) ** np.arange(semanas)[::-1]
+    estimado = tabla.to_numpy().T @ pesos / pesos.sum()
+
+    return [
+        {"store_id": store_id, "product_id": int(product_id), "day": fecha,
+         "qty": math.ceil(demanda * (1 + margen)), "forecast": round(float(demanda), 2)}
+        for product_id, demanda in zip(tabla.columns, estimado)
+        if demanda > 0
+    ]
+
+
+def generar_plan(session, fecha=None, workers=None, semanas=SEMANAS):
+    """Pronostica por tienda en paralelo y guarda el plan de `fecha`
+
+    Lee los contadores diarios que el checkout mantiene en daily_product_sales.
+    """
+    tiempos = {}
+    inicio = time.perf_counter()
+    fecha = fecha or date.today() + timedelta(days=1)
+
+    t = time.perf_counter()
+    historia = pd.read_sql(
+        select(DailyProductSales.store_id, DailyProductSales.product_id, DailyProductSales.day, DailyProductSales.qty)
+        .where(DailyProductSales.day >= fecha - timedelta(weeks=semanas)),
+        session.connection()
+    )
+    historia["day"] = pd.to_datetime(historia["day"])
+    historia["qty"] = historia["qty"].astype(float)
+    grupos = [(store_id, g[["day", "product_id", "qty"]]) for store_id, g in historia.groupby("store_id")]
+    tiempos["cargar"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    if workers == 1 or len(grupos) <= 1:
+        resultados = [pronosticar_tienda(store_id, g, fecha, semanas) for store_id, g in grupos]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            resultados = list(pool.map(
+                pronosticar_tienda, [s for s, _ in grupos], [g for _, g in grupos], repeat(fecha), repeat(semanas)
+            ))
+    plan = [fila for filas in resultados for fila in filas]
+    tiempos["pronosticar"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    session.query(ProductionPlan).filter(ProductionPlan.day == fecha).delete()
+    if plan:
+        ahora = datetime.utcnow()
+        session.execute(insert(ProductionPlan), [{**fila, "generated_at": ahora} for fila in plan])
+    session.commit()
+    tiempos["guardar"] = time.perf_counter() - t
+    tiempos["total"] = time.perf_counter() - inicio
+
+    return {"fecha": fecha, "tiendas": len(grupos), "filas": len(plan), "tiempos": tiempos}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan de producción del día siguiente")
+    parser.add_argument("--fecha", type=date.fromisoformat, help="día a planificar (por defecto mañana)")
+    parser.add_argument("--workers", type=int, help="procesos para pronosticar tiendas en paralelo")
+    args = parser.parse_args()
+
+    session = get_session()
+    try:
+        resumen = generar_plan(session, fecha=args.fecha, workers=args.workers)
+    finally:
+        session.close()
+
+    print(f"Plan para {resumen['fecha']}: {resumen['filas']} productos en {resumen['tiendas']} tiendas")
+    for etapa, segundos in resumen["tiempos"].items():
+        print(f"  {etapa:<12} {segundos * 1000:8.1f} ms")
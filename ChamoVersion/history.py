@@ -0,0 +1,38 @@
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import joinedload, selectinload
+
+from db import Order, OrderItem
+
+PAGINA = 20
+
+
+def historial_pedidos(session, customer_id=None, user_id=None, store_id=None, despues=None, limite=PAGINA):
+    """Página de órdenes (más recientes primero) con paginación por llave (ts, id)
+
+    `despues` es el cursor (ts, id) de la última orden de la página anterior.
+    Siempre son dos consultas por página: órdenes con cajero/cliente/tienda y
+    luego todos los items con su producto (selectinload), sin N+1.
+    Devuelve (ordenes, cursor_siguiente o None).
+    """
+    q = select(Order).options(
+        joinedload(Order.user),
+        joinedload(Order.customer),
+        joinedload(Order.store),
+        selectinload(Order.items).joinedload(OrderItem.product),
+    )
+    if customer_id is not None:
+        q = q.where(Order.customer_id == customer_id)
+    if user_id is not None:
+        q = q.where(Order.user_id == user_id)
+    if store_id is not None:
+        q = q.where(Order.store_id == store_id)
+    if despues is not None:
+        q = q.where(tuple_(Order.ts, Order.id) < tuple_(*despues))
+
+    # Se pide una fila de más para saber si hay otra página
+    ordenes = session.scalars(q.order_by(Order.ts.desc(), Order.id.desc()).limit(limite + 1)).unique().all()
+    siguiente = None
+    if len(ordenes) > limite:
+        ordenes = ordenes[:limite]
+        siguiente = (ordenes[-1].ts, ordenes[-1].id)
+    return ordenes, siguiente
@@ -0,0 +1,197 @@
+"""Importación masiva desde CSV de productos, clientes, ingredientes y proveedores
+
+Uso: python importer.py <products|customers|ingredients|suppliers> <archivo.csv>
+"""
+import csv
+import sys
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import insert
+
+from db import Customer, Ingredient, Product, Supplier, get_session, upsert
+from pricing import registrar_cambios_externos
+
+CHUNK = 1000  # filas validadas y escritas por transacción
+
+
+# --- CONVERSORES: reciben el texto de la celda y devuelven el valor o ValueError ---
+
+def _texto(max_len):
+    def convertir(valor):
+        if len(valor) > max_len:
+            raise ValueError(f"máximo {max_len} caracteres")
+        return valor
+    return convertir
+
+def _decimal(valor):
+    try:
+        numero = Decimal(valor.replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"'{valor}' no es un número")
+    if not numero.is_finite():
+        raise ValueError(f"'{valor}' no es un número finito")
+    if numero < 0:
+        raise ValueError("no puede ser negativo")
+    return numero
+
+def _booleano(valor):
+    v = valor.strip().lower()
+    if v in ("1", "true", "si", "sí", "x", "activo"):
+        return True
+    if v in ("0", "false", "no", "inactivo"):
+        return False
+    raise ValueError(f"'{valor}' no es sí/no")
+
+
+# columna: (conversor, obligatoria)
+IMPORTS = {
+    "products": {
+        "modelo": Product,
+        "clave": "sku",
+        "columnas": {
+            "sku": (_texto(50), True),
+            "name": (_texto(120), True),
+            "price": (_decimal, True),
+            "category": (_texto(80), False),
+            "description": (str, False),
+            "is_active": (_booleano, False),
+        },
+    },
+    "suppliers": {
+        "modelo": Supplier,
+        "clave": "name",
+        "columnas": {
+            "name": (_texto(120), True),
+            "contact": (_texto(120), False),
+            "phone": (_texto(50), False),
+            "email": (_texto(120), False),
+            "is_active": (_booleano, False),
+        },
+    },
+    "ingredients": {
+        "modelo": Ingredient,
+        "clave": "name",
+        "columnas": {
+            "name": (_texto(120), True),
+            "unit": (_texto(20), True),
+            "cost_per_unit": (_decimal, True),
+        },
+    },
+    "customers": {
+        "modelo": Customer,
+        "clave": None,  # sin columna única: siempre se insertan
+        "columnas": {
+            "name": (_texto(120), True),
+            "last_name": (_texto(120), False),
+            "document_type": (_texto(20), False),
+            "document_number": (_texto(20), False),
+            "phone": (_texto(50), False),
+            "email": (_texto(120), False),
+            "address": (str, False),
+        },
+    },
+}
+
+
+def validar_fila(spec, fila):
+    """Convierte una fila del CSV; devuelve (valores, errores)"""
+    valores, errores = {}, []
+    for columna, (convertir, obligatoria) in spec["columnas"].items():
+        crudo = (fila.get(columna) or "").strip()
+        if not crudo:
+            if obligatoria:
+                errores.append(f"{columna}: obligatorio")
+            continue
+        try:
+            valores[columna] = convertir(crudo)
+        except ValueError as e:
+            errores.append(f"{columna}: {e}")
+    return valores, errores
+
+
+def _escribir_lote(session, spec, lote):
+    modelo, clave = spec["modelo"], spec["clave"]
+    if clave is None:
+        for filas in _agrupar_por_columnas(lote).values():
+            session.execute(insert(modelo), filas)
+        return
+    # Dentro de un mismo INSERT no puede repetirse la clave: gana la última fila
+    por_clave = {fila[clave]: fila for fila in lote}
+    for columnas, filas in _agrupar_por_columnas(por_clave.values()).items():
+        stmt = upsert(session, modelo)
+        set_ = {c: stmt.excluded[c] for c in columnas if c != clave}
+        if "updated_at" in modelo.__table__.c:
+            set_["updated_at"] = datetime.utcnow()  # el ON CONFLICT no dispara el onupdate del modelo
+        stmt = stmt.on_conflict_do_update(index_elements=[clave], set_=set_)
+        session.execute(stmt, filas)
+
+
+def _agrupar_por_columnas(filas):
+    # Cada executemany necesita el mismo juego de columnas; las celdas vacías no pisan datos existentes
+    grupos = {}
+    for fila in filas:
+        grupos.setdefault(tuple(sorted(fila)), []).append(fila)
+    return grupos
+
+
+def _guardar(session, spec, lote, errores):
+    """Escribe un lote en una transacción; si falla, reintenta fila por fila para ubicar el error"""
+    try:
+        _escribir_lote(session, spec, [valores for _, valores in lote])
+        session.commit()
+        return len(lote)
+    except Exception:
+        session.rollback()
+    escritas = 0
+    for linea, valores in lote:
+        try:
+            _escribir_lote(session, spec, [valores])
+            session.commit()
+            escritas += 1
+        except Exception as e:
+            session.rollback()
+            errores.append((linea, f"rechazada por la base de datos: {str(e).splitlines()[0]}"))
+    return escritas
+
+
+def importar_csv(session, tipo, archivo, chunk=CHUNK):
+    """Valida e importa el CSV por lotes; devuelve filas escritas y errores por línea"""
+    spec = IMPORTS[tipo]
+    reader = csv.DictReader(archivo)
+    faltantes = [c for c, (_, obligatoria) in spec["columnas"].items() if obligatoria and c not in (reader.fieldnames or [])]
+    if faltantes:
+        return {"escritas": 0, "errores": [(1, f"faltan columnas: {', '.join(faltantes)}")]}
+
+    escritas, errores, lote = 0, [], []
+    for linea, fila in enumerate(reader, start=2):
+        valores, errores_fila = validar_fila(spec, fila)
+        if errores_fila:
+            errores.append((linea, "; ".join(errores_fila)))
+            continue
+        lote.append((linea, valores))
+        if len(lote) >= chunk:
+            escritas += _guardar(session, spec, lote, errores)
+            lote = []
+    if lote:
+        escritas += _guardar(session, spec, lote, errores)
+    if tipo == "products" and escritas:
+        # Los precios importados abren un rango nuevo en el historial
+        registrar_cambios_externos(session)
+        session.commit()
+    return {"escritas": escritas, "errores": errores}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in IMPORTS:
+        print(__doc__)
+        sys.exit(1)
+    session = get_session()
+    try:
+        with open(sys.argv[2], newline="", encoding="utf-8-sig") as archivo:
+            resultado = importar_csv(session, sys.argv[1], archivo)
+    finally:
+        session.close()
+    print(f"{resultado['escritas']} filas importadas, {len(resultado['errores'])} con errores")
+    for linea, error in resultado["errores"]:
+        print(f"  línea {linea}: {error}")
@@ -0,0 +1,182 @@
+"""Instrumentación opcional de consultas SQL sobre el engine
+
+Se activa con CHAMO_SQL_PROFILE=1. Umbrales: CHAMO_SLOW_QUERY_MS (por defecto 200)
+y CHAMO_N1_THRESHOLD (repeticiones de una misma sentencia en un rerun, por defecto 10).
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from sqlalchemy import event
+
+ACTIVO = os.environ.get("CHAMO_SQL_PROFILE") == "1"
+LENTA_MS = float(os.environ.get("CHAMO_SLOW_QUERY_MS", "200"))
+UMBRAL_N1 = int(os.environ.get("CHAMO_N1_THRESHOLD", "10"))
+
+logger = logging.getLogger("chamo.sql")
+
+# Listas IN expandidas: (?, ?, ?) o (%(p_1)s, %(p_2)s) cuentan como la misma sentencia
+_LISTA_PARAMETROS = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|:\w+)\s*\)")
+
+
+def normalizar_sentencia(sql):
+    return _LISTA_PARAMETROS.sub("(...)", " ".join(sql.split()))
+
+
+def id_sentencia(sql):
+    return hashlib.sha1(sql.encode()).hexdigest()[:10]
+
+
+class QueryProfiler:
+    """Tiempos por sentencia y por página, detección de N+1 y registro de consultas lentas"""
+
+    def __init__(self, lenta_ms=LENTA_MS, umbral_n1=UMBRAL_N1):
+        self.lenta_ms = lenta_ms
+        self.umbral_n1 = umbral_n1
+        self._lock = threading.Lock()
+        self._ctx = threading.local()  # cada sesión de Streamlit corre su script en su propio hilo
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.sentencias = {}  # sql normalizado -> {"count", "total", "max"}
+            self.paginas = defaultdict(lambda: {"reruns": 0, "consultas": 0, "segundos": 0.0})
+            self.n_mas_1 = {}     # (página, sql) -> repeticiones máximas en un rerun
+            self.lentas = deque(maxlen=100)
+
+    def instalar(self, engine):
+        event.listen(engine, "before_cursor_execute", self._antes)
+        event.listen(engine, "after_cursor_execute", self._despues)
+        event.listen(engine, "handle_error", self._error)
+
+    def desinstalar(self, engine):
+        event.remove(engine, "before_cursor_execute", self._antes)
+        event.remove(engine, "after_cursor_execute", self._despues)
+        event.remove(engine, "handle_error", self._error)
+
+    # --- CONTEXTO DE RERUN ---
+
+    def iniciar_rerun(self, pagina):
+        if getattr(self._ctx, "conteo", None) is not None:
+            self.terminar_rerun()  # el rerun anterior terminó con st.rerun()/st.stop()
+        self._ctx.pagina = pagina
+        self._ctx.conteo = Counter()
+        with self._lock:
+            self.paginas[pagina]["reruns"] += 1
+
+    def terminar_rerun(self):
+        conteo = getattr(self._ctx, "conteo", None)
+        pagina = getattr(self._ctx, "pagina", None)
+        self._ctx.conteo = None
+        if not conteo:
+            return
+        for sql, veces in conteo.items():
+            if veces >= self.umbral_n1:
+                with self._lock:
+                    clave = (pagina, sql)
+                    self.n_mas_1[clave] = max(self.n_mas_1.get(clave, 0), veces)
+                logger.warning("Posible N+1 en %s: %d ejecuciones de %s", pagina, veces, sql[:200])
+
+    # --- EVENTOS DEL ENGINE ---
+
+    def _antes(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("chamo_inicios", []).append(time.perf_counter())
+        if context is not None:
+            context._chamo_medida = True
+
+    def _error(self, contexto):
+        # Una sentencia que falla no llega a after_cursor_execute: se descarta su inicio
+        if getattr(contexto.execution_context, "_chamo_medida", False):
+            contexto.connection.info["chamo_inicios"].pop()
+
+    def _despues(self, conn, cursor, statement, parameters, context, executemany):
+        segundos = time.perf_counter() - conn.info["chamo_inicios"].pop()
+        sql = normalizar_sentencia(statement)
+        pagina = getattr(self._ctx, "pagina", None) or "(sin página)"
+        with self._lock:
+            st = self.sentencias.setdefault(sql, {"count": 0, "total": 0.0, "max": 0.0})
+            st["count"] += 1
+            st["total"] += segundos
+            st["max"] = max(st["max"], segundos)
+            self.paginas[pagina]["consultas"] += 1
+            self.paginas[pagina]["segundos"] += segundos
+        self._ctx.segundos = getattr(self._ctx, "segundos", 0.0) + segundos
+        conteo = getattr(self._ctx, "conteo", None)
+        if conteo is not None:
+            conteo[sql] += 1
+        if segundos * 1000 >= self.lenta_ms:
+            lenta = {
+                "ts": time.time(), "pagina": pagina, "ms": round(segundos * 1000, 1),
+                "sql": sql, "parametros": repr(parameters)[:500],
+            }
+            with self._lock:
+                self.lentas.append(lenta)
+            logger.warning("Consulta lenta (%.0f ms) en %s: %s -- %s", lenta["ms"], pagina, sql[:500], lenta["parametros"])
+
+    def segundos_hilo(self):
+        """Tiempo SQL acumulado por el hilo actual (para repartirlo entre tramos de un rerun)"""
+        return getattr(self._ctx, "segundos", 0.0)
+
+    # --- REPORTES ---
+
+    def resumen(self):
+        with self._lock:
+            filas = [
+                {"id": id_sentencia(sql), "sql": sql, "count": st["count"], "total_ms": st["total"] * 1000,
+                 "avg_ms": st["total"] / st["count"] * 1000, "max_ms": st["max"] * 1000}
+                for sql, st in self.sentencias.items()
+            ]
+        return sorted(filas, key=lambda f: f["total_ms"], reverse=True)
+
+    def a_json(self):
+        with self._lock:
+            paginas = {p: dict(v) for p, v in self.paginas.items()}
+            n_mas_1 = [{"pagina": p, "sql": sql, "veces": n} for (p, sql), n in self.n_mas_1.items()]
+            lentas = list(self.lentas)
+        return json.dumps({
+            "sentencias": self.resumen(), "paginas": paginas, "n_mas_1": n_mas_1, "lentas": lentas
+        }, ensure_ascii=False, indent=2)
+
+    def a_prometheus(self):
+        """Formato de texto de Prometheus (exposición 0.0.4)"""
+        lineas = [
+            "# HELP chamo_sql_queries_total Consultas SQL ejecutadas por página",
+            "# TYPE chamo_sql_queries_total counter",
+        ]
+        with self._lock:
+            paginas = {p: dict(v) for p, v in self.paginas.items()}
+        for pagina, v in paginas.items():
+            lineas.append(f'chamo_sql_queries_total{{page="{_etiqueta(pagina)}"}} {v["consultas"]}')
+        lineas += [
+            "# HELP chamo_sql_seconds_total Tiempo total en consultas SQL por página",
+            "# TYPE chamo_sql_seconds_total counter",
+        ]
+        for pagina, v in paginas.items():
+            lineas.append(f'chamo_sql_seconds_total{{page="{_etiqueta(pagina)}"}} {v["segundos"]:.6f}')
+        sentencias = self.resumen()
+        lineas += [
+            "# HELP chamo_sql_statement_seconds_total Tiempo total por sentencia (id = hash del SQL normalizado)",
+            "# TYPE chamo_sql_statement_seconds_total counter",
+        ]
+        for fila in sentencias:
+            lineas.append(f'chamo_sql_statement_seconds_total{{statement="{fila["id"]}"}} {fila["total_ms"] / 1000:.6f}')
+        # Cada familia de métricas va contigua, con su propio HELP/TYPE
+        lineas += [
+            "# HELP chamo_sql_statement_executions_total Ejecuciones por sentencia (id = hash del SQL normalizado)",
+            "# TYPE chamo_sql_statement_executions_total counter",
+        ]
+        for fila in sentencias:
+            lineas.append(f'chamo_sql_statement_executions_total{{statement="{fila["id"]}"}} {fila["count"]}')
+        return "\n".join(lineas) + "\n"
+
+
+def _etiqueta(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+profiler = QueryProfiler()
@@ -0,0 +1,150 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import func, insert, text
+
+from db import IngredientStock, InventoryMovement, RecipeItem, StockSnapshot, upsert
+
+TIPOS_MOVIMIENTO = ["compra", "consumo", "merma", "ajuste"]
+
+
+def registrar_movimientos(session, movimientos):
+    """Agrega movimientos al libro y actualiza el stock materializado en lote
+
+    No hace commit: corre dentro de la transacción de quien llama.
+    """
+    if not movimientos:
+        return
+    ahora = datetime.utcnow()
+    filas = [{"supplier_id": None, "order_id": None, "note": None, **m, "ts": ahora} for m in movimientos]
+    session.execute(insert(InventoryMovement), filas)
+
+    deltas = defaultdict(Decimal)
+    for m in movimientos:
+        deltas[m["ingredient_id"]] += Decimal(m["qty"])
+
+    # Un solo upsert para todos los ingredientes, en orden fijo para evitar deadlocks
+    stmt = upsert(session, IngredientStock)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IngredientStock.ingredient_id],
+        set_={"qty": IngredientStock.qty + stmt.excluded.qty, "updated_at": stmt.excluded.updated_at}
+    )
+    session.execute(stmt, [
+        {"ingredient_id": ing_id, "qty": deltas[ing_id], "updated_at": ahora}
+        for ing_id in sorted(deltas)
+    ])
+
+
+def consumir_por_venta(session, order_id, lineas):
+    """Descuenta los ingredientes de una venta según las recetas ([(product_id, qty)])"""
+    cantidades = defaultdict(Decimal)
+    for product_id, qty in lineas:
+        cantidades[product_id] += Decimal(qty)
+    if not cantidades:
+        return
+
+    consumo = defaultdict(Decimal)
+    recetas = session.query(RecipeItem.product_id, RecipeItem.ingredient_id, RecipeItem.qty).filter(
+        RecipeItem.product_id.in_(list(cantidades))
+    ).all()
+    for product_id, ingredient_id, qty in recetas:
+        consumo[ingredient_id] += qty * cantidades[product_id]
+
+    registrar_movimientos(session, [
+        {"ingredient_id": ing_id, "kind": "consumo", "qty": -qty, "order_id": order_id}
+        for ing_id, qty in consumo.items()
+    ])
+
+
+def registrar_compra(session, ingredient_id, qty, supplier_id=None, note=None):
+    registrar_movimientos(session, [{
+        "ingredient_id": ingredient_id, "kind": "compra", "qty": Decimal(qty),
+        "supplier_id": supplier_id, "note": note
+    }])
+
+
+def registrar_merma(session, ingredient_id, qty, note=None):
+    registrar_movimientos(session, [{
+        "ingredient_id": ingredient_id, "kind": "merma", "qty": -Decimal(qty), "note": note
+    }])
+
+
+# === SNAPSHOTS Y RECONSTRUCCIÓN ===
+
+def reconstruir_stock(session, hasta=None):
+    """Stock por ingrediente = último snapshot + movimientos posteriores
+
+    Solo se recorren los movimientos desde el último snapshot, nunca el libro completo.
+    """
+    corte = session.query(func.max(StockSnapshot.movement_id)).scalar()
+    stock = defaultdict(Decimal)
+    if corte is not None:
+        for ingredient_id, qty in session.query(StockSnapshot.ingredient_id, StockSnapshot.qty).filter(
+            StockSnapshot.movement_id == corte
+        ):
+            stock[ingredient_id] = qty
+
+    replay = session.query(InventoryMovement.ingredient_id, func.sum(InventoryMovement.qty)).filter(
+        InventoryMovement.id > (corte or 0)
+    )
+    if hasta is not None:
+        replay = replay.filter(InventoryMovement.id <= hasta)
+    for ingredient_id, qty in replay.group_by(InventoryMovement.ingredient_id):
+        stock[ingredient_id] += qty
+    return dict(stock)
+
+
+def _congelar_movimientos(session):
+    """En PostgreSQL, lock SHARE sobre los movimientos hasta el fin de la transacción"""
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text(f"LOCK TABLE {InventoryMovement.__tablename__} IN SHARE MODE"))
+
+
+def tomar_snapshot(session):
+    """Guarda una foto del stock hasta el último movimiento registrado
+
+    En PostgreSQL los ids salen de una secuencia al insertar, no al confirmar: una
+    venta en curso puede tener un id menor que el máximo ya visible y confirmar
+    después, y quedaría fuera del snapshot y del replay. El lock SHARE espera a que
+    confirmen las transacciones que están insertando movimientos y frena las nuevas
+    hasta el commit del snapshot. En SQLite hay un solo escritor y no hace falta.
+    """
+    _congelar_movimientos(session)
+    hasta = session.query(func.max(InventoryMovement.id)).scalar()
+    if hasta is None:
+        session.rollback()  # suelta el lock
+        return None
+    stock = reconstruir_stock(session, hasta=hasta)
+    ahora = datetime.utcnow()
+    session.execute(insert(StockSnapshot), [
+        {"ingredient_id": ing_id, "movement_id": hasta, "qty": qty, "ts": ahora}
+        for ing_id, qty in stock.items()
+    ])
+    session.commit()
+    return hasta
+
+
+def verificar_stock(session, reparar=False):
+    """Compara el stock materializado con snapshot + replay; devuelve las diferencias
+
+    Para reparar toma el mismo lock que tomar_snapshot: sin él, una venta que
+    confirma entre la lectura de los movimientos y la escritura del stock
+    quedaría pisada por un valor calculado sin ella.
+    """
+    if reparar:
+        _congelar_movimientos(session)
+    esperado = reconstruir_stock(session)
+    actual = dict(session.query(IngredientStock.ingredient_id, IngredientStock.qty))
+    diferencias = {
+        ing_id: (actual.get(ing_id, Decimal("0")), esperado.get(ing_id, Decimal("0")))
+        for ing_id in set(esperado) | set(actual)
+        if actual.get(ing_id, Decimal("0")) != esperado.get(ing_id, Decimal("0"))
+    }
+    if reparar and diferencias:
+        ahora = datetime.utcnow()
+        for ing_id, (_, qty) in diferencias.items():
+            session.merge(IngredientStock(ingredient_id=ing_id, qty=qty, updated_at=ahora))
+    if reparar:
+        session.commit()  # suelta el lock
+    return diferencias
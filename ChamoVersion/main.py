@@ -3,7 +3,7 @@ from db import test_connection, get_session, User, Product, Store, init_db
 
 # Inicializa la base de datos si la conexión es válida
 if test_connection():
-    init_db()  # Esto crea las tablas si no existen
+    init_db()  # Aplica las migraciones pendientes
     session = get_session()
     users = session.query(User).count()
     print(f"Usuarios en la base: {users}")
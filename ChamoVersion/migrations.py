@@ -0,0 +1,493 @@
+"""Migraciones versionadas del esquema de db.py
+
+Reemplazan a create_all, force_recreate_tables y drop_all_cascade: cada migración
+se aplica una sola vez, en orden, y queda registrada en schema_version con su
+duración. Todas revisan qué existe antes de tocarlo, así una base creada con
+cualquier versión anterior del código llega al esquema actual sin perder datos.
+
+En PostgreSQL el DDL toma locks cortos:
+  - lock_timeout: un ALTER que no consigue su lock en pocos segundos se reintenta
+    en vez de dejar a todas las ventas esperando detrás de él
+  - índices con CREATE INDEX CONCURRENTLY (fuera de transacción)
+  - llaves foráneas NOT VALID y validadas aparte (sin bloquear escrituras)
+  - columnas NOT NULL con DEFAULT constante: solo metadatos desde PostgreSQL 11;
+    en versiones anteriores se rellenan por lotes de ids y el NOT NULL se apoya
+    en un CHECK ya validado
+  - los rellenos de datos van por rangos de id, con un commit por lote
+  - un cambio de tipo que reescribiría la tabla (escala de un Numeric) se hace
+    con columna nueva, relleno por lotes y un cambio de nombre al final
+
+Uso: python migrations.py [estado]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, delete, func, inspect, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+
+from db import (
+    Base, CustomerStats, DailyProductSales, Ingredient, Order, OrderItem, Product, ProductSalesTotal, RecipeItem, engine
+)
+
+LOTE = int(os.environ.get("CHAMO_MIGRATE_BATCH", "5000"))  # filas por transacción en los rellenos
+LOCK_TIMEOUT = "3s"
+REINTENTOS = 5
+_LLAVE_LOCK = 4242_0050  # pg_advisory_lock: un solo proceso migra a la vez
+
+_meta = MetaData()
+schema_version = Table(
+    "schema_version", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(120), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+    Column("seconds", Float, nullable=False),
+)
+
+MIGRACIONES = {}
+
+
+def migracion(version, nombre):
+    def registrar(fn):
+        MIGRACIONES[version] = (nombre, fn)
+        return fn
+    return registrar
+
+
+class Migrador:
+    """Operaciones de esquema idempotentes sobre un engine"""
+
+    def __init__(self, engine, lote=LOTE, salida=print):
+        self.engine = engine
+        self.pg = engine.dialect.name == "postgresql"
+        self.lote = lote
+        self.salida = salida
+
+    # --- INSPECCIÓN ---
+
+    def existe_columna(self, tabla, columna):
+        return columna in {c["name"] for c in inspect(self.engine).get_columns(tabla)}
+
+    def existe_indice(self, nombre):
+        with self.engine.connect() as conn:
+            if not self.pg:
+                return conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :n"), {"n": nombre}
+                ).first() is not None
+            valido = conn.execute(text(
+                "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :n"
+            ), {"n": nombre}).scalar()
+        if valido is False:
+            # Un CONCURRENTLY interrumpido deja el índice inválido: se borra y se vuelve a crear
+            self.ddl(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}")
+            return False
+        return valido is not None
+
+    def tiene_unico(self, tabla, columna):
+        insp = inspect(self.engine)
+        return any(u["column_names"] == [columna] for u in insp.get_unique_constraints(tabla)) or any(
+            i["unique"] and i["column_names"] == [columna] for i in insp.get_indexes(tabla)
+        )
+
+    def existe_restriccion(self, nombre):
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT 1 FROM pg_constraint WHERE conname = :n"), {"n": nombre}).first() is not None
+
+    # --- DDL ---
+
+    def ddl(self, sql):
+        """Una sentencia en autocommit; en PostgreSQL con lock_timeout y reintentos si no consigue el lock"""
+        for intento in range(1, REINTENTOS + 1):
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                try:
+                    if self.pg:
+                        conn.execute(text(f"SET lock_timeout = '{LOCK_TIMEOUT}'"))
+                    conn.execute(text(sql))
+                    return
+                except OperationalError as e:
+                    if not _lock_ocupado(e) or intento == REINTENTOS:
+                        raise
+                    self.salida(f"    lock ocupado, reintento {intento} en {intento} s")
+                finally:
+                    if self.pg:
+                        conn.execute(text("RESET lock_timeout"))
+            time.sleep(intento)
+
+    def ddl_atomico(self, *sentencias):
+        """Varias sentencias en una transacción (todas o ninguna), con lock_timeout y reintentos (PostgreSQL)"""
+        for intento in range(1, REINTENTOS + 1):
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+                    for sql in sentencias:
+                        conn.execute(text(sql))
+                return
+            except OperationalError as e:
+                if not _lock_ocupado(e) or intento == REINTENTOS:
+                    raise
+                self.salida(f"    lock ocupado, reintento {intento} en {intento} s")
+            time.sleep(intento)
+
+    def crear_tablas(self):
+        """Crea las tablas del modelo que falten (con sus índices); las existentes no se tocan"""
+        faltantes = [t for t in Base.metadata.sorted_tables if not inspect(self.engine).has_table(t.name)]
+        Base.metadata.create_all(self.engine, tables=faltantes)
+        return [t.name for t in faltantes]
+
+    def agregar_columna(self, modelo, nombre):
+        tabla = modelo.__table__
+        col = tabla.c[nombre]
+        if self.existe_columna(tabla.name, nombre):
+            return False
+        tipo = col.type.compile(dialect=self.engine.dialect)
+        default = _literal(col.default.arg) if col.default is not None and col.default.is_scalar else None
+        fk = next(iter(col.foreign_keys), None)
+
+        if not self.pg:
+            # SQLite: ADD COLUMN no reescribe la tabla; NOT NULL exige DEFAULT
+            sql = f"ALTER TABLE {tabla.name} ADD COLUMN {nombre} {tipo}"
+            if default is not None:
+                sql += f" DEFAULT {default}"
+            if not col.nullable:
+                sql += " NOT NULL"
+            if fk is not None:
+                sql += f" REFERENCES {fk.column.table.name} ({fk.column.name})"
+            self.ddl(sql)
+            return True
+
+        if default is not None and self.engine.dialect.server_version_info >= (11,):
+            # DEFAULT constante: PostgreSQL 11+ lo guarda en el catálogo sin reescribir la tabla
+            self.ddl(f"ALTER TABLE {tabla.name} ADD COLUMN {nombre} {tipo} DEFAULT {default}"
+                     + ("" if col.nullable else " NOT NULL"))
+        else:
+            self.ddl(f"ALTER TABLE {tabla.name} ADD COLUMN {nombre} {tipo}")
+            if default is not None:
+                self.ddl(f"ALTER TABLE {tabla.name} ALTER COLUMN {nombre} SET DEFAULT {default}")
+                self.rellenar(tabla.name, f"{nombre} = {default}", f"{nombre} IS NULL")
+            if not col.nullable:
+                self.no_nulo(tabla.name, nombre)
+        if fk is not None:
+            self.agregar_fk(tabla.name, nombre, fk.column.table.name, fk.column.name)
+        return True
+
+    def no_nulo(self, tabla, columna):
+        """SET NOT NULL sin recorrer la tabla con lock exclusivo: CHECK NOT VALID, VALIDATE y luego NOT NULL"""
+        check = f"{tabla}_{columna}_not_null"
+        self.ddl(f"ALTER TABLE {tabla} ADD CONSTRAINT {check} CHECK ({columna} IS NOT NULL) NOT VALID")
+        self.ddl(f"ALTER TABLE {tabla} VALIDATE CONSTRAINT {check}")
+        self.ddl(f"ALTER TABLE {tabla} ALTER COLUMN {columna} SET NOT NULL")
+        self.ddl(f"ALTER TABLE {tabla} DROP CONSTRAINT {check}")
+
+    def agregar_fk(self, tabla, columna, ref_tabla, ref_columna):
+        nombre = f"{tabla}_{columna}_fkey"
+        if self.existe_restriccion(nombre):
+            return
+        self.ddl(f"ALTER TABLE {tabla} ADD CONSTRAINT {nombre} FOREIGN KEY ({columna}) "
+                 f"REFERENCES {ref_tabla} ({ref_columna}) NOT VALID")
+        self.ddl(f"ALTER TABLE {tabla} VALIDATE CONSTRAINT {nombre}")
+
+    def crear_indice(self, modelo, nombre):
+        """Crea un índice declarado en el modelo; CONCURRENTLY en PostgreSQL"""
+        if self.existe_indice(nombre):
+            return False
+        indice = next(i for i in modelo.__table__.indexes if i.name == nombre)
+        sql = str(CreateIndex(indice).compile(dialect=self.engine.dialect))
+        if self.pg:
+            sql = sql.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)
+        self.ddl(sql)
+        return True
+
+    def crear_unico(self, tabla, columna):
+        """Índice único de una columna con unique=True (CONCURRENTLY en PostgreSQL)"""
+        if self.tiene_unico(tabla, columna):
+            return False
+        concurrente = " CONCURRENTLY" if self.pg else ""
+        self.ddl(f"CREATE UNIQUE INDEX{concurrente} {tabla}_{columna}_key ON {tabla} ({columna})")
+        return True
+
+    def ampliar_numeric(self, modelo, nombre):
+        """Lleva una columna Numeric a la precisión y escala del modelo
+
+        En SQLite no hace falta (el tipo declarado no limita lo guardado). En
+        PostgreSQL un ALTER COLUMN TYPE que cambia la escala reescribe la tabla
+        bajo ACCESS EXCLUSIVE; en su lugar:
+          - columna nueva con el tipo del modelo (solo metadatos) y un trigger que
+            la copia en cada INSERT/UPDATE mientras dura el relleno
+          - relleno por lotes, NOT NULL con CHECK validado y los índices que usan
+            la columna construidos CONCURRENTLY sobre la nueva
+          - una transacción corta que borra la vieja, renombra la nueva y sus índices
+        Si se interrumpe, la siguiente corrida retoma donde quedó.
+        """
+        if not self.pg:
+            return False
+        tabla = modelo.__table__
+        col = tabla.c[nombre]
+        with self.engine.connect() as conn:
+            actual = conn.execute(text(
+                "SELECT numeric_precision, numeric_scale FROM information_schema.columns "
+                "WHERE table_name = :t AND column_name = :c"
+            ), {"t": tabla.name, "c": nombre}).one()
+        if tuple(actual) == (col.type.precision, col.type.scale):
+            return False
+
+        nueva, copia = f"{nombre}_nuevo", f"{tabla.name}_{nombre}_copia"
+        if not self.existe_columna(tabla.name, nueva):
+            self.ddl(f"ALTER TABLE {tabla.name} ADD COLUMN {nueva} {col.type.compile(dialect=self.engine.dialect)}")
+        self.ddl(f"CREATE OR REPLACE FUNCTION {copia}() RETURNS trigger LANGUAGE plpgsql AS "
+                 f"$$ BEGIN NEW.{nueva} := NEW.{nombre}; RETURN NEW; END $$")
+        self.ddl_atomico(
+            f"DROP TRIGGER IF EXISTS {copia} ON {tabla.name}",
+            f"CREATE TRIGGER {copia} BEFORE INSERT OR UPDATE ON {tabla.name} "
+            f"FOR EACH ROW EXECUTE PROCEDURE {copia}()",
+        )
+        if "id" in tabla.c:
+            self.rellenar(tabla.name, f"{nueva} = {nombre}", f"{nueva} IS NULL")
+        else:
+            # Sin id para recorrer por rangos (contadores): lotes de `lote` filas por ctid
+            while True:
+                with self.engine.begin() as conn:
+                    if not conn.execute(text(
+                        f"UPDATE {tabla.name} SET {nueva} = {nombre} WHERE ctid IN "
+                        f"(SELECT ctid FROM {tabla.name} WHERE {nueva} IS NULL LIMIT :n)"
+                    ), {"n": self.lote}).rowcount:
+                        break
+        if not col.nullable and not any(
+            c["name"] == nueva and not c["nullable"] for c in inspect(self.engine).get_columns(tabla.name)
+        ):
+            self.no_nulo(tabla.name, nueva)
+
+        # Índices que usan la columna (como clave o en INCLUDE): réplica sobre la nueva antes del cambio
+        renombrar = []
+        for indice in tabla.indexes:
+            columnas = [c.name for c in indice.columns]
+            incluidas = list(indice.dialect_options["postgresql"]["include"] or [])
+            if nombre not in columnas + incluidas:
+                continue
+            temporal = f"{indice.name}_nuevo"
+            if not self.existe_indice(temporal):
+                def cambiar(nombres):
+                    return ", ".join(nueva if c == nombre else c for c in nombres)
+                self.ddl(f"CREATE {'UNIQUE ' if indice.unique else ''}INDEX CONCURRENTLY {temporal} "
+                         f"ON {tabla.name} ({cambiar(columnas)})"
+                         + (f" INCLUDE ({cambiar(incluidas)})" if incluidas else ""))
+            renombrar.append(f"ALTER INDEX {temporal} RENAME TO {indice.name}")
+
+        # El cambio en sí: solo catálogo, un instante con lock exclusivo (los índices viejos caen con la columna)
+        self.ddl_atomico(
+            f"DROP TRIGGER {copia} ON {tabla.name}",
+            f"ALTER TABLE {tabla.name} DROP COLUMN {nombre}",
+            f"ALTER TABLE {tabla.name} RENAME COLUMN {nueva} TO {nombre}",
+            *renombrar,
+        )
+        self.ddl(f"DROP FUNCTION IF EXISTS {copia}()")
+        return True
+
+    # --- RELLENOS ---
+
+    def rangos(self, modelo):
+        """Rangos [desde, hasta) de ids de `lote` filas, para recorrer una tabla grande por partes"""
+        with self.engine.connect() as conn:
+            minimo, maximo = conn.execute(select(func.min(modelo.id), func.max(modelo.id))).one()
+        if minimo is None:
+            return
+        for desde in range(minimo, maximo + 1, self.lote):
+            yield desde, desde + self.lote
+
+    def rellenar(self, tabla, asignacion, condicion):
+        """UPDATE por rangos de id con un commit por lote: cada transacción bloquea pocas filas y poco tiempo"""
+        modelo = Base.metadata.tables[tabla]
+        filas = 0
+        for desde, hasta in self.rangos(modelo.c):
+            with self.engine.begin() as conn:
+                filas += conn.execute(text(
+                    f"UPDATE {tabla} SET {asignacion} WHERE id >= :desde AND id < :hasta AND ({condicion})"
+                ), {"desde": desde, "hasta": hasta}).rowcount
+        return filas
+
+
+def _lock_ocupado(error):
+    codigo = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    return codigo == "55P03"  # lock_not_available
+
+
+def _literal(valor):
+    if isinstance(valor, bool):
+        return "TRUE" if valor else "FALSE"
+    if isinstance(valor, (int, float, Decimal)):
+        return str(valor)
+    return "'" + str(valor).replace("'", "''") + "'"
+
+
+# === MIGRACIONES ===
+
+@migracion(1, "tablas nuevas")
+def _tablas(m):
+    creadas = m.crear_tablas()
+    if creadas:
+        m.salida(f"    creadas: {', '.join(creadas)}")
+
+
+@migracion(2, "orders: llave de idempotencia, medio de pago y turno")
+def _columnas_orders(m):
+    for columna in ("idempotency_key", "payment_method", "shift_id"):
+        if m.agregar_columna(Order, columna):
+            m.salida(f"    orders.{columna}")
+    m.crear_unico("orders", "idempotency_key")
+
+
+@migracion(3, "order_items: descuentos por promoción")
+def _columnas_order_items(m):
+    for columna in ("discount", "promotion_id"):
+        if m.agregar_columna(OrderItem, columna):
+            m.salida(f"    order_items.{columna}")
+
+
+@migracion(4, "índices de historial, turnos e items")
+def _indices(m):
+    for modelo, nombre in (
+        (Order, "ix_orders_ts_id"),
+        (Order, "ix_orders_customer_ts_id"),
+        (Order, "ix_orders_user_ts_id"),
+        (Order, "ix_orders_store_ts_id"),
+        (Order, "ix_orders_shift_id"),
+        (OrderItem, "ix_order_items_order_id"),
+    ):
+        inicio = time.perf_counter()
+        if m.crear_indice(modelo, nombre):
+            m.salida(f"    {nombre} ({time.perf_counter() - inicio:.1f} s)")
+
+
+@migracion(5, "acumulados de ventas por producto, por cliente e historial de precios")
+def _acumulados(m):
+    from customer_stats import recalcular_estadisticas
+    from pricing import inicializar_historial
+    from product_sales import sumar_rango_ordenes
+
+    with Session(m.engine) as session:
+        sin_contadores = session.scalar(select(func.count()).select_from(ProductSalesTotal)) == 0
+        sin_estadisticas = session.scalar(select(func.count()).select_from(CustomerStats)) == 0
+
+    # Tablas de acumulados recién creadas sobre una base con ventas: se llenan por lotes de órdenes
+    if sin_contadores:
+        lotes = 0
+        try:
+            for desde, hasta in m.rangos(Order):
+                with Session(m.engine) as session:
+                    sumar_rango_ordenes(session, desde, hasta)
+                    session.commit()
+                lotes += 1
+        except BaseException:
+            # Sin lotes a medias: la próxima corrida vuelve a encontrar las tablas vacías
+            with Session(m.engine) as session:
+                session.execute(delete(DailyProductSales))
+                session.execute(delete(ProductSalesTotal))
+                session.commit()
+            raise
+        if lotes:
+            m.salida(f"    contadores de productos: {lotes} lotes de {m.lote} órdenes")
+    if sin_estadisticas:
+        with Session(m.engine) as session:
+            filas = recalcular_estadisticas(session)
+        if filas:
+            m.salida(f"    customer_stats: {filas} clientes")
+    with Session(m.engine) as session:
+        filas = inicializar_historial(session)
+        session.commit()
+    if filas:
+        m.salida(f"    product_prices: {filas} precios iniciales")
+
+
+
+@migracion(6, "cantidades con tres decimales (pesables en gramos)")
+def _cantidades_milesimas(m):
+    for modelo in (OrderItem, DailyProductSales, ProductSalesTotal):
+        if m.ampliar_numeric(modelo, "qty"):
+            m.salida(f"    {modelo.__tablename__}.qty")
+
+
+@migracion(7, "updated_at para el motor de costos")
+def _marcas_costos(m):
+    for modelo in (Ingredient, Product, RecipeItem):
+        if m.agregar_columna(modelo, "updated_at"):
+            m.salida(f"    {modelo.__tablename__}.updated_at")
+
+
+# === EJECUCIÓN ===
+
+def ultima_version():
+    return max(MIGRACIONES)
+
+
+def estado(engine=engine):
+    """[(version, nombre, aplicada_en o None, segundos o None)] de todas las migraciones conocidas"""
+    _meta.create_all(engine)
+    with engine.connect() as conn:
+        aplicadas = {v: (a, s) for v, a, s in conn.execute(
+            select(schema_version.c.version, schema_version.c.applied_at, schema_version.c.seconds)
+        )}
+    return [(v, nombre, *aplicadas.get(v, (None, None))) for v, (nombre, _) in sorted(MIGRACIONES.items())]
+
+
+def migrar(engine=engine, lote=LOTE, salida=print):
+    """Aplica en orden las migraciones pendientes; devuelve [(version, nombre, segundos)]"""
+    _meta.create_all(engine)
+    bloqueo = None
+    if engine.dialect.name == "postgresql":
+        # Conexión en autocommit: una transacción abierta aquí haría esperar a los CONCURRENTLY
+        bloqueo = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        bloqueo.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _LLAVE_LOCK})
+    try:
+        with engine.connect() as conn:
+            aplicadas = set(conn.scalars(select(schema_version.c.version)))
+        migrador = Migrador(engine, lote=lote, salida=salida)
+        hechas = []
+        for version, (nombre, fn) in sorted(MIGRACIONES.items()):
+            if version in aplicadas:
+                continue
+            salida(f"[{version:03d}] {nombre}")
+            inicio = time.perf_counter()
+            fn(migrador)
+            segundos = time.perf_counter() - inicio
+            with engine.begin() as conn:
+                conn.execute(schema_version.insert().values(
+                    version=version, name=nombre, applied_at=datetime.utcnow(), seconds=segundos
+                ))
+            salida(f"      {segundos:.2f} s")
+            hechas.append((version, nombre, segundos))
+        return hechas
+    finally:
+        if bloqueo is not None:
+            bloqueo.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LLAVE_LOCK})
+            bloqueo.close()
+
+
+_al_dia = False
+
+
+def asegurar_esquema(engine=engine):
+    """Para el arranque de la app: una consulta si ya está al día, migrar si no (una vez por proceso)"""
+    global _al_dia
+    if _al_dia:
+        return
+    try:
+        with engine.connect() as conn:
+            actual = conn.scalar(select(func.max(schema_version.c.version)))
+    except Exception:
+        actual = None  # aún no existe schema_version
+    if actual != ultima_version():
+        migrar(engine, salida=lambda *_: None)
+    _al_dia = True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "estado":
+        for version, nombre, aplicada, segundos in estado():
+            marca = f"{aplicada:%Y-%m-%d %H:%M} ({segundos:.1f} s)" if aplicada else "pendiente"
+            print(f"{version:03d}  {nombre:<70} {marca}")
+    else:
+        hechas = migrar()
+        print(f"{len(hechas)} migraciones aplicadas" if hechas else "El esquema ya está al día")
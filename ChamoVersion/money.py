@@ -0,0 +1,78 @@
+"""Dinero y cantidades como enteros en el camino caliente del POS
+
+Precios en céntimos, cantidades en milésimas de unidad. El importe de una línea
+(milésimas x céntimos) queda en cienmilésimas de sol y es exacto, igual que
+Decimal(str(qty)) * price. Cada línea se redondea una sola vez a céntimos
+(importe_linea, mitad hacia arriba como Numeric(…,2) en PostgreSQL) y el total de
+la orden es la suma de esas líneas: ticket, orders.total, turnos y acumulados
+usan los mismos céntimos. Solo se convierte a Decimal al escribir en la base.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+ESCALA_QTY = 1000       # milésimas de unidad
+ESCALA_PRECIO = 100     # céntimos
+ESCALA_IMPORTE = ESCALA_QTY * ESCALA_PRECIO
+
+
+def _escalar(valor, escala):
+    return int((Decimal(str(valor)) * escala).to_integral_value(ROUND_HALF_UP))
+
+
+def centimos(precio):
+    """Precio (Decimal, str o float) a céntimos"""
+    return _escalar(precio, ESCALA_PRECIO)
+
+
+def milesimas(cantidad):
+    """Cantidad (float del number_input, str o Decimal) a milésimas"""
+    return _escalar(cantidad, ESCALA_QTY)
+
+
+def importe(qty_milesimas, precio_centimos):
+    """Importe exacto de una línea, en cienmilésimas"""
+    return qty_milesimas * precio_centimos
+
+
+def redondear_a_centimos(valor):
+    """Importe en cienmilésimas a céntimos, mitad hacia arriba (lejos de cero, como PostgreSQL)"""
+    centimos_, resto = divmod(abs(valor), ESCALA_QTY)
+    if resto * 2 >= ESCALA_QTY:
+        centimos_ += 1
+    return centimos_ if valor >= 0 else -centimos_
+
+
+def importe_linea(qty_milesimas, precio_centimos, descuento_centimos=0):
+    """Importe neto de una línea en céntimos: el único punto donde se redondea"""
+    return redondear_a_centimos(importe(qty_milesimas, precio_centimos)) - descuento_centimos
+
+
+# === FRONTERA CON LA BASE (Numeric) ===
+
+def qty_decimal(qty_milesimas):
+    return Decimal(qty_milesimas).scaleb(-3)
+
+
+def precio_decimal(precio_centimos):
+    return Decimal(precio_centimos).scaleb(-2)
+
+
+def importe_decimal(valor):
+    return Decimal(valor).scaleb(-5)
+
+
+# === FORMATO ===
+
+def formato_centimos(c):
+    signo = "-" if c < 0 else ""
+    return f"S/ {signo}{abs(c) // 100}.{abs(c) % 100:02d}"
+
+
+def formato_importe(valor):
+    """Importe en cienmilésimas, redondeado como importe_linea"""
+    return formato_centimos(redondear_a_centimos(valor))
+
+
+def formato_cantidad(qty_milesimas):
+    """Milésimas a texto sin ceros de más: 2, 1.5, 0.125"""
+    enteros, fraccion = divmod(qty_milesimas, ESCALA_QTY)
+    return str(enteros) if not fraccion else f"{enteros}.{fraccion:03d}".rstrip("0")
@@ -0,0 +1,202 @@
+"""Historial de precios con vigencias y lista de precios vigente en caché
+
+product_prices guarda cada precio con su rango [valid_from, valid_to); un cambio
+puede programarse a futuro. products.price sigue siendo el precio vigente (lo
+sincroniza aplicar_programados), así reportes y costos no cambian.
+Las fechas se guardan en UTC sin zona; los días que elige el usuario son de la
+zona de la tienda (CHAMO_TZ).
+"""
+import os
+import threading
+from datetime import datetime, time, timedelta, timezone
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import DateTime, and_, delete, func, insert, literal, or_, select, update
+
+from db import Product, ProductPrice
+from money import centimos
+
+# Desde cuándo vale el precio inicial de un producto sin historial
+INICIO = datetime(2000, 1, 1)
+
+ZONA = ZoneInfo(os.environ.get("CHAMO_TZ", "America/Lima"))
+
+
+def hoy():
+    """Fecha de hoy en la zona de la tienda"""
+    return datetime.now(ZONA).date()
+
+
+def inicio_del_dia(fecha):
+    """Medianoche local de `fecha` en UTC sin zona, como se guarda valid_from"""
+    return datetime.combine(fecha, time.min, ZONA).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def fin_del_dia(fecha):
+    """Último instante local de `fecha` en UTC sin zona"""
+    return inicio_del_dia(fecha + timedelta(days=1)) - timedelta(microseconds=1)
+
+
+def a_local(momento):
+    """UTC sin zona (como viene de la base) a hora local de la tienda, para mostrar"""
+    return momento.replace(tzinfo=timezone.utc).astimezone(ZONA)
+
+
+def _vigente(momento):
+    return and_(
+        ProductPrice.valid_from <= momento,
+        or_(ProductPrice.valid_to.is_(None), ProductPrice.valid_to > momento),
+    )
+
+
+def precio_en(session, product_id, momento=None):
+    """Precio de un producto en una fecha; usa el índice (product_id, valid_from) y lee una fila"""
+    momento = momento or datetime.utcnow()
+    fila = session.execute(
+        select(ProductPrice.price, ProductPrice.valid_to)
+        .where(ProductPrice.product_id == product_id, ProductPrice.valid_from <= momento)
+        .order_by(ProductPrice.valid_from.desc()).limit(1)
+    ).first()
+    if fila is None or (fila.valid_to is not None and fila.valid_to <= momento):
+        return None
+    return fila.price
+
+
+def lista_precios(session, momento=None):
+    """{product_id: precio} vigente en una fecha (por defecto ahora)"""
+    momento = momento or datetime.utcnow()
+    filas = session.execute(select(ProductPrice.product_id, ProductPrice.price).where(_vigente(momento)))
+    return {pid: precio for pid, precio in filas}
+
+
+def historial(session, product_id):
+    return session.scalars(
+        select(ProductPrice).where(ProductPrice.product_id == product_id).order_by(ProductPrice.valid_from.desc())
+    ).all()
+
+
+def inicializar_historial(session):
+    """Crea la fila inicial (desde INICIO, sin fin) para los productos que aún no tienen historial"""
+    sin_historial = ~select(ProductPrice.id).where(ProductPrice.product_id == Product.id).exists()
+    resultado = session.execute(
+        insert(ProductPrice).from_select(
+            ["product_id", "price", "valid_from", "created_at"],
+            select(Product.id, Product.price, literal(INICIO, DateTime), func.now()).where(sin_historial),
+        )
+    )
+    return resultado.rowcount
+
+
+def programar_precio(session, product_id, precio, desde=None):
+    """Registra `precio` a partir de `desde` (ahora si es None o ya pasó)
+
+    Cierra el rango anterior en `desde` y el nuevo termina donde empiece el
+    siguiente cambio ya programado. Reprogramar la misma fecha reemplaza el precio.
+    No hace commit.
+    """
+    inicializar_historial(session)
+    _programar(session, product_id, precio, desde)
+
+
+def _programar(session, product_id, precio, desde):
+    ahora = datetime.utcnow()
+    desde = max(desde or ahora, ahora)
+    precio = Decimal(str(precio))
+    session.execute(delete(ProductPrice).where(
+        ProductPrice.product_id == product_id, ProductPrice.valid_from == desde
+    ))
+    siguiente = session.scalar(
+        select(func.min(ProductPrice.valid_from))
+        .where(ProductPrice.product_id == product_id, ProductPrice.valid_from > desde)
+    )
+    session.execute(
+        update(ProductPrice)
+        .where(ProductPrice.product_id == product_id, ProductPrice.valid_from < desde,
+               or_(ProductPrice.valid_to.is_(None), ProductPrice.valid_to > desde))
+        .values(valid_to=desde)
+    )
+    session.add(ProductPrice(product_id=product_id, price=precio, valid_from=desde, valid_to=siguiente))
+    if desde == ahora:
+        session.execute(update(Product).where(Product.id == product_id).values(price=precio))
+    session.flush()
+
+
+def cancelar_programado(session, precio_id):
+    """Borra un cambio futuro y extiende el rango anterior hasta donde terminaba el borrado. No hace commit."""
+    fila = session.get(ProductPrice, precio_id)
+    if fila is None or fila.valid_from <= datetime.utcnow():
+        return False
+    session.execute(
+        update(ProductPrice)
+        .where(ProductPrice.product_id == fila.product_id, ProductPrice.valid_to == fila.valid_from)
+        .values(valid_to=fila.valid_to)
+    )
+    session.delete(fila)
+    session.flush()
+    return True
+
+
+def aplicar_programados(session, momento=None):
+    """Copia a products.price los precios que entraron en vigencia; devuelve cuántos cambiaron. No hace commit."""
+    vigentes = select(ProductPrice.price).where(
+        ProductPrice.product_id == Product.id, _vigente(momento or datetime.utcnow())
+    ).scalar_subquery()
+    resultado = session.execute(
+        update(Product).where(Product.price != vigentes).values(price=vigentes)
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount
+
+
+def registrar_cambios_externos(session):
+    """Abre un rango nuevo para productos cuyo products.price cambió fuera de programar_precio (p. ej. importación)"""
+    ahora = datetime.utcnow()
+    actuales = lista_precios(session, ahora)
+    cambiados = session.execute(select(Product.id, Product.price)).all()
+    cambiados = [(pid, precio) for pid, precio in cambiados if pid in actuales and actuales[pid] != precio]
+    for pid, precio in cambiados:
+        _programar(session, pid, precio, ahora)
+    inicializar_historial(session)
+    return len(cambiados)
+
+
+class PriceListCache:
+    """Lista de precios vigente compartida por las sesiones del POS
+
+    Se recarga solo si cambió el historial (máximo id y cantidad de filas, una
+    consulta indexada) o si llegó la hora del siguiente cambio programado; en
+    ese caso confirma la sesión que recibe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._vence = None
+        self.precios = {}
+        self.centimos = {}
+
+    def refrescar(self, session):
+        ahora = datetime.utcnow()
+        version = session.execute(select(func.max(ProductPrice.id), func.count(ProductPrice.id))).one()
+        if tuple(version) == self._version and (self._vence is None or ahora < self._vence):
+            return False
+        with self._lock:
+            if self._version is None or (self._vence is not None and ahora >= self._vence):
+                # Primera carga o llegó un cambio programado: completar historial y sincronizar products.price
+                inicializar_historial(session)
+                aplicar_programados(session, ahora)
+                session.commit()
+                version = session.execute(select(func.max(ProductPrice.id), func.count(ProductPrice.id))).one()
+            precios = lista_precios(session, ahora)
+            self._vence = session.scalar(select(func.min(ProductPrice.valid_from)).where(ProductPrice.valid_from > ahora))
+            self.precios = precios
+            self.centimos = {pid: centimos(p) for pid, p in precios.items()}
+            self._version = tuple(version)
+        return True
+
+    def invalidar(self):
+        self._version = None
+
+
+precios_vigentes = PriceListCache()
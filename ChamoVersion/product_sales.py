@@ -0,0 +1,185 @@
+"""Contadores de ventas por producto (por tienda y día, e históricos)
+
+Uso: python product_sales.py [--reparar]   (compara los contadores con order_items)
+"""
+import sys
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import Numeric, delete, func, insert, select, text
+
+from db import DailyProductSales, Order, OrderItem, Product, ProductSalesTotal, get_session, upsert
+from statements import TOP_PRODUCTOS
+
+# Neto de una línea redondeado a céntimos como money.importe_linea (mitad hacia
+# arriba); el épsilon solo corrige el float de SQLite: qty*price tiene a lo sumo 5 decimales.
+NETO_LINEA = func.round(OrderItem.qty * OrderItem.price + 0.000001, 2, type_=Numeric(14, 2)) - OrderItem.discount
+
+
+def registrar_ventas_productos(session, store_id, ts, lineas):
+    """Suma las líneas de una venta ([(product_id, qty, importe neto)]) a los contadores
+
+    Corre dentro de la transacción del checkout; las filas se tocan en orden de
+    product_id para que dos ventas simultáneas no se bloqueen mutuamente.
+    """
+    por_producto = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for product_id, qty, neto in lineas:
+        por_producto[product_id][0] += qty
+        por_producto[product_id][1] += neto
+    _sumar(session, {(store_id, pid, ts.date()): v for pid, v in por_producto.items()})
+
+
+def sumar_rango_ordenes(session, desde_id, hasta_id):
+    """Suma a los contadores las órdenes con id en [desde_id, hasta_id) (relleno por lotes). No hace commit."""
+    dia = func.date(Order.ts)
+    filas = session.execute(
+        select(Order.store_id, OrderItem.product_id, dia, func.sum(OrderItem.qty), func.sum(NETO_LINEA))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.id >= desde_id, Order.id < hasta_id)
+        .group_by(Order.store_id, OrderItem.product_id, dia)
+    ).all()
+    _sumar(session, {(s, p, _a_fecha(d)): [q, r] for s, p, d, q, r in filas})
+    return len(filas)
+
+
+def _sumar(session, por_dia):
+    """Upsert aditivo de {(store_id, product_id, día): [qty, revenue]} en los contadores diarios e históricos"""
+    if not por_dia:
+        return
+    claves = sorted(por_dia, key=lambda k: (k[1], k[0], k[2]))
+    por_producto = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for store_id, pid, dia in claves:
+        por_producto[pid][0] += por_dia[(store_id, pid, dia)][0]
+        por_producto[pid][1] += por_dia[(store_id, pid, dia)][1]
+    ids = sorted(por_producto)
+
+    diario = upsert(session, DailyProductSales)
+    diario = diario.on_conflict_do_update(
+        index_elements=[DailyProductSales.store_id, DailyProductSales.product_id, DailyProductSales.day],
+        set_={
+            "qty": DailyProductSales.qty + diario.excluded.qty,
+            "revenue": DailyProductSales.revenue + diario.excluded.revenue,
+        }
+    )
+    session.execute(diario, [
+        {"store_id": s, "product_id": pid, "day": dia, "qty": por_dia[(s, pid, dia)][0], "revenue": por_dia[(s, pid, dia)][1]}
+        for s, pid, dia in claves
+    ])
+
+    total = upsert(session, ProductSalesTotal)
+    total = total.on_conflict_do_update(
+        index_elements=[ProductSalesTotal.product_id],
+        set_={
+            "qty": ProductSalesTotal.qty + total.excluded.qty,
+            "revenue": ProductSalesTotal.revenue + total.excluded.revenue,
+        }
+    )
+    session.execute(total, [
+        {"product_id": pid, "qty": por_producto[pid][0], "revenue": por_producto[pid][1]}
+        for pid in ids
+    ])
+
+
+def top_productos(session, limite=10, store_id=None, desde=None, hasta=None):
+    """Productos más vendidos: (id, sku, nombre, cantidad, ingresos)
+
+    Sin filtros usa product_sales_totals (índice por cantidad); con tienda o
+    fechas agrega solo las filas de daily_product_sales de ese rango.
+    """
+    if store_id is None and desde is None and hasta is None:
+        return session.execute(TOP_PRODUCTOS, {"limite": limite}).all()
+
+    qty = func.sum(DailyProductSales.qty)
+    q = select(
+        Product.id, Product.sku, Product.name, qty, func.sum(DailyProductSales.revenue)
+    ).join(Product, Product.id == DailyProductSales.product_id)
+    if store_id is not None:
+        q = q.where(DailyProductSales.store_id == store_id)
+    if desde is not None:
+        q = q.where(DailyProductSales.day >= desde)
+    if hasta is not None:
+        q = q.where(DailyProductSales.day <= hasta)
+    q = q.group_by(Product.id, Product.sku, Product.name).order_by(qty.desc()).limit(limite)
+    return session.execute(q).all()
+
+
+# === VERIFICACIÓN Y RECONSTRUCCIÓN ===
+
+def _a_fecha(valor):
+    # SQLite devuelve DATE(ts) como texto, PostgreSQL como date
+    return valor if isinstance(valor, date) else date.fromisoformat(str(valor)[:10])
+
+
+def verificar_contadores(session, reparar=False):
+    """Compara los contadores con order_items; con reparar=True los reconstruye desde cero
+
+    Devuelve la cantidad de filas diarias e históricas que no coinciden. Para
+    reparar, en PostgreSQL bloquea los contadores (SHARE ROW EXCLUSIVE) antes de
+    leer order_items: espera a los checkouts que ya los tocaron y frena los
+    nuevos hasta el commit, que después suman su venta sobre lo reconstruido.
+    """
+    if reparar and session.get_bind().dialect.name == "postgresql":
+        session.execute(text(
+            f"LOCK TABLE {DailyProductSales.__tablename__}, {ProductSalesTotal.__tablename__} "
+            "IN SHARE ROW EXCLUSIVE MODE"
+        ))
+    dia = func.date(Order.ts)
+    crudo = session.execute(
+        select(Order.store_id, OrderItem.product_id, dia, func.sum(OrderItem.qty), func.sum(NETO_LINEA))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .group_by(Order.store_id, OrderItem.product_id, dia)
+    ).all()
+    milesima, centimo = Decimal("0.001"), Decimal("0.01")
+    esperado_diario = {
+        (s, p, _a_fecha(d)): (Decimal(q).quantize(milesima), Decimal(r).quantize(centimo))
+        for s, p, d, q, r in crudo
+    }
+    esperado_total = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for (_, p, _), (q, r) in esperado_diario.items():
+        esperado_total[p][0] += q
+        esperado_total[p][1] += r
+
+    actual_diario = {
+        (s, p, d): (q, r) for s, p, d, q, r in session.execute(select(
+            DailyProductSales.store_id, DailyProductSales.product_id, DailyProductSales.day,
+            DailyProductSales.qty, DailyProductSales.revenue
+        ))
+    }
+    actual_total = {
+        p: [q, r] for p, q, r in session.execute(select(
+            ProductSalesTotal.product_id, ProductSalesTotal.qty, ProductSalesTotal.revenue
+        ))
+    }
+    diferencias_diario = sum(
+        1 for k in set(esperado_diario) | set(actual_diario)
+        if esperado_diario.get(k) != actual_diario.get(k)
+    )
+    diferencias_total = sum(
+        1 for k in set(esperado_total) | set(actual_total)
+        if esperado_total.get(k) != actual_total.get(k)
+    )
+
+    if reparar and (diferencias_diario or diferencias_total):
+        session.execute(delete(DailyProductSales))
+        session.execute(delete(ProductSalesTotal))
+        if esperado_diario:
+            session.execute(insert(DailyProductSales), [
+                {"store_id": s, "product_id": p, "day": d, "qty": q, "revenue": r}
+                for (s, p, d), (q, r) in esperado_diario.items()
+            ])
+            session.execute(insert(ProductSalesTotal), [
+                {"product_id": p, "qty": q, "revenue": r} for p, (q, r) in esperado_total.items()
+            ])
+    if reparar:
+        session.commit()  # suelta el lock
+    return diferencias_diario, diferencias_total
+
+
+if __name__ == "__main__":
+    session = get_session()
+    try:
+        diario, total = verificar_contadores(session, reparar="--reparar" in sys.argv)
+    finally:
+        session.close()
+    print(f"Diferencias: {diario} filas diarias, {total} productos")
@@ -0,0 +1,180 @@
+"""Perfilado por rerun de la app (activar con CHAMO_PROFILE=1)
+
+Cada rerun se divide en tramos con marca("nombre"): el tramo mide desde la marca
+anterior, y si la instrumentación SQL está activa también cuánto de ese tiempo
+fue SQL. Los tiempos se guardan en una base SQLite local (CHAMO_METRICS_DB)
+para sacar p50/p95 por página y tramo. Un rerun puede correrse bajo
+pyinstrument (si está instalado) o cProfile.
+"""
+import io
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from instrumentation import profiler as profiler_sql
+
+ACTIVO = os.environ.get("CHAMO_PROFILE") == "1"
+RUTA_METRICAS = os.environ.get(
+    "CHAMO_METRICS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metricas.sqlite3")
+)
+VENTANA = 500  # reruns más recientes por página y tramo para los percentiles
+MAX_FILAS = 200_000  # tope de rerun_spans: al insertar se borran las filas más viejas
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not valores:
+        return 0.0
+    return valores[min(len(valores), max(1, math.ceil(p / 100 * len(valores)))) - 1]
+
+
+class RerunProfiler:
+    def __init__(self, ruta=RUTA_METRICAS, activo=ACTIVO):
+        self.ruta = ruta
+        self.activo = activo
+        self._ctx = threading.local()
+        self._creada = False
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.ruta, timeout=5)
+        if not self._creada:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rerun_spans ("
+                "id INTEGER PRIMARY KEY, ts REAL NOT NULL, pagina TEXT NOT NULL, "
+                "tramo TEXT NOT NULL, ms REAL NOT NULL, sql_ms REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_rerun_spans_pagina ON rerun_spans (pagina, tramo, id)")
+            self._creada = True
+        return conn
+
+    # --- RERUN ---
+
+    def iniciar_rerun(self, perfilar=False):
+        if not self.activo:
+            return
+        if getattr(self._ctx, "tramos", None) is not None:
+            self.terminar_rerun()  # el rerun anterior terminó con st.rerun()/st.stop()
+        self._ctx.inicio = self._ctx.ultima = time.perf_counter()
+        self._ctx.sql_inicio = self._ctx.sql = profiler_sql.segundos_hilo()
+        self._ctx.tramos = []
+        self._ctx.pagina = "(inicio)"
+        self._ctx.perfilador = _iniciar_perfilador() if perfilar else None
+
+    def pagina(self, nombre):
+        if self.activo:
+            self._ctx.pagina = nombre
+
+    def marca(self, nombre):
+        """Cierra el tramo que va desde la marca anterior hasta aquí"""
+        if not self.activo or getattr(self._ctx, "tramos", None) is None:
+            return
+        ahora, sql = time.perf_counter(), profiler_sql.segundos_hilo()
+        self._ctx.tramos.append((nombre, (ahora - self._ctx.ultima) * 1000, (sql - self._ctx.sql) * 1000))
+        self._ctx.ultima, self._ctx.sql = ahora, sql
+
+    @contextmanager
+    def tramo(self, nombre):
+        """Mide un bloque puntual (p. ej. el PDF); queda anidado dentro del tramo de marcas en curso"""
+        if not self.activo or getattr(self._ctx, "tramos", None) is None:
+            yield
+            return
+        inicio, sql = time.perf_counter(), profiler_sql.segundos_hilo()
+        try:
+            yield
+        finally:
+            self._ctx.tramos.append((
+                f"↳ {nombre}", (time.perf_counter() - inicio) * 1000, (profiler_sql.segundos_hilo() - sql) * 1000
+            ))
+
+    def terminar_rerun(self):
+        """Guarda los tramos del rerun; devuelve (tramos, texto del perfil o None)"""
+        tramos = getattr(self._ctx, "tramos", None)
+        if not self.activo or tramos is None:
+            return [], None
+        self.marca("(resto)")
+        self._ctx.tramos = None
+        total = ((time.perf_counter() - self._ctx.inicio) * 1000, (profiler_sql.segundos_hilo() - self._ctx.sql_inicio) * 1000)
+        tramos.append(("total", *total))
+        texto = _detener_perfilador(self._ctx.perfilador) if self._ctx.perfilador else None
+
+        ahora = time.time()
+        try:
+            conn = self._conectar()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO rerun_spans (ts, pagina, tramo, ms, sql_ms) VALUES (?, ?, ?, ?, ?)",
+                        [(ahora, self._ctx.pagina, nombre, ms, sql_ms) for nombre, ms, sql_ms in tramos]
+                    )
+                    conn.execute(
+                        "DELETE FROM rerun_spans WHERE id <= (SELECT max(id) FROM rerun_spans) - ?", (MAX_FILAS,)
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass  # las métricas nunca deben tumbar la página
+        return tramos, texto
+
+    # --- CONSULTA ---
+
+    def percentiles(self, ventana=VENTANA):
+        """[{pagina, tramo, n, p50, p95, sql_p50}] con los últimos `ventana` reruns de cada tramo"""
+        valores = defaultdict(list)
+        conn = self._conectar()
+        try:
+            filas = conn.execute("SELECT pagina, tramo, ms, sql_ms FROM rerun_spans ORDER BY id DESC LIMIT ?", (MAX_FILAS,))
+            for pagina, tramo, ms, sql_ms in filas:
+                lista = valores[(pagina, tramo)]
+                if len(lista) < ventana:
+                    lista.append((ms, sql_ms))
+        finally:
+            conn.close()
+        resultado = []
+        for (pagina, tramo), lista in sorted(valores.items()):
+            ms = sorted(v[0] for v in lista)
+            sql_ms = sorted(v[1] for v in lista)
+            resultado.append({
+                "pagina": pagina, "tramo": tramo, "n": len(lista),
+                "p50": percentil(ms, 50), "p95": percentil(ms, 95), "sql_p50": percentil(sql_ms, 50),
+            })
+        return resultado
+
+    def borrar(self):
+        conn = self._conectar()
+        try:
+            with conn:
+                conn.execute("DELETE FROM rerun_spans")
+        finally:
+            conn.close()
+
+
+def _iniciar_perfilador():
+    try:
+        from pyinstrument import Profiler
+        perfilador = Profiler()
+    except ImportError:
+        import cProfile
+        perfilador = cProfile.Profile()
+    try:
+        perfilador.start() if hasattr(perfilador, "output_text") else perfilador.enable()
+    except (RuntimeError, ValueError):
+        return None  # ya hay otro perfilador activo en el proceso
+    return perfilador
+
+
+def _detener_perfilador(perfilador):
+    if hasattr(perfilador, "output_text"):
+        perfilador.stop()
+        return perfilador.output_text(unicode=True)
+    import pstats
+    perfilador.disable()
+    salida = io.StringIO()
+    pstats.Stats(perfilador, stream=salida).sort_stats("cumulative").print_stats(40)
+    return salida.getvalue()
+
+
+perfil = RerunProfiler()
@@ -0,0 +1,141 @@
+"""Motor de promociones evaluado sobre el carrito
+
+Las reglas activas se compilan una vez en índices por producto, categoría,
+cliente y tipo de documento; cada línea del carrito solo revisa las reglas de
+su producto, de su categoría y las del cliente, así el costo crece con el
+tamaño del carrito y no con el número de reglas. Por línea se aplica la
+promoción que más descuenta (no se acumulan). Todo en enteros, como money.py.
+"""
+import threading
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import func, select
+
+from db import Promotion
+from money import ESCALA_QTY, centimos, importe, milesimas, redondear_a_centimos
+
+TIPOS = {
+    "mayorista": "Precio mayorista desde una cantidad",
+    "porcentaje": "Porcentaje de descuento",
+    "combo": "Combo con otro producto",
+}
+
+
+class Regla:
+    """Promoción compilada: cantidades en milésimas, precios en céntimos, porcentaje en centésimas de %"""
+    __slots__ = ("id", "nombre", "tipo", "producto", "categoria", "cliente", "documento",
+                 "combo", "min_qty", "precio", "puntos", "inicio", "fin")
+
+    def __init__(self, promo):
+        self.id = promo.id
+        self.nombre = promo.name
+        self.tipo = promo.kind
+        self.producto = promo.product_id
+        self.categoria = promo.category
+        self.cliente = promo.customer_id
+        self.documento = promo.document_type
+        self.combo = promo.combo_product_id
+        self.min_qty = milesimas(promo.min_qty or 0)
+        self.precio = centimos(promo.price) if promo.price is not None else None
+        self.puntos = centimos(promo.percent) if promo.percent is not None else 0
+        self.inicio = promo.starts_at
+        self.fin = promo.ends_at
+
+    def aplica(self, product_id, categoria, cliente_id, documento, momento):
+        return (
+            (self.producto is None or self.producto == product_id)
+            and (self.categoria is None or self.categoria == categoria)
+            and (self.cliente is None or self.cliente == cliente_id)
+            and (self.documento is None or self.documento == documento)
+            and (self.inicio is None or self.inicio <= momento)
+            and (self.fin is None or momento < self.fin)
+        )
+
+    def descuento(self, qty, precio, carrito):
+        """Descuento de la línea en cienmilésimas (0 si no corresponde)"""
+        if self.tipo == "combo":
+            pares = min(qty, carrito.get(self.combo, 0)) // ESCALA_QTY
+            return pares * ESCALA_QTY * (self.precio or 0)
+        if qty < self.min_qty:
+            return 0
+        if self.tipo == "mayorista":
+            return importe(qty, precio - self.precio) if self.precio is not None and self.precio < precio else 0
+        if self.tipo == "porcentaje":
+            return importe(qty, precio) * self.puntos // 10000
+        return 0
+
+
+class MotorPromociones:
+    """Reglas activas compiladas en índices; se recompilan solo si cambió la tabla"""
+
+    def __init__(self, promociones=()):
+        self._lock = threading.Lock()
+        self._version = None
+        self.compilar(promociones)
+
+    def compilar(self, promociones):
+        por_producto, por_categoria, por_cliente, por_documento, globales = {}, {}, {}, {}, []
+        reglas = [Regla(p) for p in promociones if p.is_active and p.kind in TIPOS]
+        for regla in reglas:
+            # Cada regla va al índice más selectivo de su alcance; aplica() revisa el resto
+            if regla.producto is not None:
+                por_producto.setdefault(regla.producto, []).append(regla)
+            elif regla.categoria is not None:
+                por_categoria.setdefault(regla.categoria, []).append(regla)
+            elif regla.cliente is not None:
+                por_cliente.setdefault(regla.cliente, []).append(regla)
+            elif regla.documento is not None:
+                por_documento.setdefault(regla.documento, []).append(regla)
+            else:
+                globales.append(regla)
+        self.reglas = {r.id: r for r in reglas}
+        self.por_producto, self.por_categoria = por_producto, por_categoria
+        self.por_cliente, self.por_documento, self.globales = por_cliente, por_documento, globales
+
+    def refrescar(self, session):
+        version = tuple(session.execute(
+            select(func.count(Promotion.id), func.max(Promotion.id), func.max(Promotion.updated_at))
+        ).one())
+        if version == self._version:
+            return False
+        with self._lock:
+            self.compilar(session.scalars(select(Promotion).where(Promotion.is_active == True)).all())
+            self._version = version
+        return True
+
+    def invalidar(self):
+        self._version = None
+
+    def evaluar(self, carrito, catalogo, cliente=None, momento=None):
+        """{product_id: (descuento en céntimos, promotion_id)} para las líneas con promoción
+
+        `catalogo` es el ProductCatalog del POS (productos y céntimos vigentes);
+        `cliente` un Customer o None.
+        """
+        momento = momento or datetime.utcnow()
+        cliente_id = cliente.id if cliente is not None else None
+        documento = cliente.document_type if cliente is not None else None
+        # Reglas que dependen solo del cliente: se buscan una vez por carrito
+        generales = list(chain(self.por_cliente.get(cliente_id, ()), self.por_documento.get(documento, ()), self.globales))
+
+        descuentos = {}
+        for product_id, qty in carrito.items():
+            producto = catalogo.por_id.get(product_id)
+            if producto is None:
+                continue
+            precio = catalogo.centimos[product_id]
+            mejor, mejor_id = 0, None
+            for regla in chain(self.por_producto.get(product_id, ()), self.por_categoria.get(producto.category, ()), generales):
+                if not regla.aplica(product_id, producto.category, cliente_id, documento, momento):
+                    continue
+                valor = regla.descuento(qty, precio, carrito)
+                if valor > mejor:
+                    mejor, mejor_id = valor, regla.id
+            if mejor_id is not None:
+                mejor = min(mejor, importe(qty, precio))
+                descuentos[product_id] = (redondear_a_centimos(mejor), mejor_id)
+        return descuentos
+
+
+promociones = MotorPromociones()
@@ -0,0 +1,6 @@
+#!/bin/bash
+# Usuario de replicación para la réplica local (docker-compose.replica.yml)
+set -e
+psql -v ON_ERROR_STOP=1 -U "$POSTGRES_USER" -d "$POSTGRES_DB" \
+    -c "CREATE ROLE replicador WITH REPLICATION LOGIN PASSWORD 'replicador';"
+echo "host replication replicador all scram-sha-256" >> "$PGDATA/pg_hba.conf"
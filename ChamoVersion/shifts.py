@@ -0,0 +1,152 @@
+"""Turnos de caja y reporte Z
+
+Cada checkout suma la venta a shift_totals (una fila por turno y medio de pago),
+así el cierre lee unas pocas filas en vez de recorrer orders.
+
+Uso: python shifts.py [--reparar]   (compara los acumulados con orders)
+"""
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import selectinload
+
+from db import Order, Shift, ShiftTotal, get_session, upsert
+
+METODOS_PAGO = {
+    "efectivo": "💵 Efectivo",
+    "tarjeta": "💳 Tarjeta",
+    "yape": "📱 Yape / Plin",
+    "transferencia": "🏦 Transferencia",
+}
+
+
+def turno_abierto(session, user_id, store_id):
+    return session.scalars(
+        select(Shift).where(Shift.user_id == user_id, Shift.store_id == store_id, Shift.closed_at.is_(None))
+    ).first()
+
+
+def abrir_turno(session, user_id, store_id, fondo=Decimal("0")):
+    """Abre un turno (o devuelve el que ya está abierto) y hace commit"""
+    turno = turno_abierto(session, user_id, store_id)
+    if turno is None:
+        turno = Shift(user_id=user_id, store_id=store_id, opening_cash=Decimal(str(fondo)))
+        session.add(turno)
+        session.commit()
+    return turno
+
+
+def registrar_venta_turno(session, shift_id, metodo, total):
+    """Suma una venta a los acumulados del turno (dentro de la transacción del checkout)
+
+    Bloquea la fila del turno hasta el commit de la venta y falla con ValueError si
+    ya está cerrado: cerrar_turno espera a las ventas en curso y ninguna venta entra
+    a un turno cuyo reporte Z ya se emitió.
+    """
+    abierto = session.scalar(
+        select(Shift.id).where(Shift.id == shift_id, Shift.closed_at.is_(None)).with_for_update()
+    )
+    if abierto is None:
+        raise ValueError(f"El turno #{shift_id} ya fue cerrado; abre un turno nuevo para seguir vendiendo")
+    stmt = upsert(session, ShiftTotal).values(shift_id=shift_id, payment_method=metodo, sales_count=1, revenue=total)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ShiftTotal.shift_id, ShiftTotal.payment_method],
+        set_={
+            "sales_count": ShiftTotal.sales_count + 1,
+            "revenue": ShiftTotal.revenue + stmt.excluded.revenue,
+        }
+    )
+    session.execute(stmt)
+
+
+def reporte_z(session, turno):
+    """Totales del turno por medio de pago, efectivo esperado en caja y diferencia con lo contado"""
+    return reportes_z(session, [turno])[0]
+
+
+def reportes_z(session, turnos):
+    """Reportes Z de varios turnos con una sola consulta a shift_totals"""
+    por_turno = {t.id: {} for t in turnos}
+    if por_turno:
+        for shift_id, metodo, n, total in session.execute(
+            select(ShiftTotal.shift_id, ShiftTotal.payment_method, ShiftTotal.sales_count, ShiftTotal.revenue)
+            .where(ShiftTotal.shift_id.in_(list(por_turno)))
+        ):
+            por_turno[shift_id][metodo] = (n, total)
+    return [_reporte(t, por_turno[t.id]) for t in turnos]
+
+
+def turnos_recientes(session, store_id=None, limite=20):
+    q = (
+        select(Shift).options(selectinload(Shift.user), selectinload(Shift.store))
+        .order_by(Shift.opened_at.desc()).limit(limite)
+    )
+    if store_id is not None:
+        q = q.where(Shift.store_id == store_id)
+    return session.scalars(q).all()
+
+
+def _reporte(turno, por_metodo):
+    efectivo = turno.opening_cash + por_metodo.get("efectivo", (0, Decimal("0")))[1]
+    return {
+        "turno": turno.id,
+        "abierto": turno.opened_at,
+        "cerrado": turno.closed_at,
+        "por_metodo": por_metodo,
+        "ventas": sum(n for n, _ in por_metodo.values()),
+        "total": sum((t for _, t in por_metodo.values()), Decimal("0")),
+        "fondo": turno.opening_cash,
+        "efectivo_esperado": efectivo,
+        "efectivo_contado": turno.counted_cash,
+        "diferencia": turno.counted_cash - efectivo if turno.counted_cash is not None else None,
+    }
+
+
+def cerrar_turno(session, turno, contado):
+    """Cierra el turno con el efectivo contado, hace commit y devuelve su reporte Z"""
+    turno.closed_at = datetime.utcnow()
+    turno.counted_cash = Decimal(str(contado))
+    session.commit()
+    return reporte_z(session, turno)
+
+
+def verificar_turnos(session, reparar=False):
+    """Compara shift_totals con orders agrupadas por turno y medio de pago (una sola consulta)
+
+    Devuelve la cantidad de filas que no coinciden; con reparar=True las reconstruye.
+    """
+    esperado = {
+        (s, m): (n, Decimal(t).quantize(Decimal("0.01")))
+        for s, m, n, t in session.execute(
+            select(Order.shift_id, Order.payment_method, func.count(Order.id), func.sum(Order.total))
+            .where(Order.shift_id.is_not(None))
+            .group_by(Order.shift_id, Order.payment_method)
+        )
+    }
+    actual = {
+        (s, m): (n, t) for s, m, n, t in session.execute(
+            select(ShiftTotal.shift_id, ShiftTotal.payment_method, ShiftTotal.sales_count, ShiftTotal.revenue)
+        )
+    }
+    diferencias = [k for k in set(esperado) | set(actual) if esperado.get(k) != actual.get(k)]
+
+    if reparar and diferencias:
+        session.execute(delete(ShiftTotal))
+        if esperado:
+            session.execute(insert(ShiftTotal), [
+                {"shift_id": s, "payment_method": m, "sales_count": n, "revenue": t}
+                for (s, m), (n, t) in esperado.items()
+            ])
+        session.commit()
+    return len(diferencias)
+
+
+if __name__ == "__main__":
+    session = get_session()
+    try:
+        diferencias = verificar_turnos(session, reparar="--reparar" in sys.argv)
+    finally:
+        session.close()
+    print(f"Diferencias: {diferencias} filas de turno")
@@ -0,0 +1,96 @@
+"""Servidor SMTP de depuración local (solo biblioteca estándar)
+
+Acepta cualquier mensaje y lo guarda en memoria o lo imprime; sirve para probar
+el envío de recibos sin un servidor real.
+
+Uso: python smtp_local.py [puerto]   (por defecto 1025; luego CHAMO_SMTP_URL=smtp://localhost:1025)
+"""
+import socketserver
+import sys
+import threading
+
+
+class _Manejador(socketserver.StreamRequestHandler):
+    def _responder(self, linea):
+        self.wfile.write(linea.encode() + b"\r\n")
+
+    def handle(self):
+        servidor = self.server
+        self._responder("220 chamo-smtp-local listo")
+        remitente, destinatarios = None, []
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            comando = linea.decode("utf-8", "replace").strip()
+            verbo = comando[:4].upper()
+            if verbo in ("EHLO", "HELO"):
+                self._responder("250 chamo-smtp-local")
+            elif verbo == "MAIL":
+                remitente, destinatarios = comando[10:].strip(), []
+                self._responder("250 OK")
+            elif verbo == "RCPT":
+                destinatarios.append(comando[8:].strip())
+                self._responder("250 OK")
+            elif verbo == "DATA":
+                self._responder("354 Terminar con <CRLF>.<CRLF>")
+                partes = []
+                while True:
+                    dato = self.rfile.readline()
+                    if not dato or dato in (b".\r\n", b".\n"):
+                        break
+                    partes.append(dato[1:] if dato.startswith(b"..") else dato)
+                servidor.recibir(remitente, destinatarios, b"".join(partes))
+                self._responder("250 OK")
+            elif verbo in ("RSET", "NOOP"):
+                self._responder("250 OK")
+            elif verbo == "QUIT":
+                self._responder("221 Adiós")
+                return
+            else:
+                self._responder("502 Comando no implementado")
+
+
+class ServidorSMTPLocal(socketserver.ThreadingTCPServer):
+    """Guarda los mensajes en `self.mensajes` (o los imprime con imprimir=True)"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", puerto=1025, imprimir=False):
+        super().__init__((host, puerto), _Manejador)
+        self.imprimir = imprimir
+        self.mensajes = []
+        self.conexiones = 0
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.conexiones += 1
+        super().process_request(request, client_address)
+
+    def recibir(self, remitente, destinatarios, datos):
+        with self._lock:
+            self.mensajes.append((remitente, destinatarios, datos))
+        if self.imprimir:
+            print(f"--- De {remitente} para {', '.join(destinatarios)} ---")
+            print(datos.decode("utf-8", "replace"))
+
+    @property
+    def url(self):
+        host, puerto = self.server_address[:2]
+        return f"smtp://{host}:{puerto}"
+
+    def iniciar(self):
+        """Atiende en un hilo de fondo; devuelve el servidor para encadenar"""
+        threading.Thread(target=self.serve_forever, name="smtp-local", daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    puerto = int(sys.argv[1]) if len(sys.argv) > 1 else 1025
+    servidor = ServidorSMTPLocal(puerto=puerto, imprimir=True)
+    print(f"SMTP de depuración en {servidor.url} (Ctrl+C para salir)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,57 @@
+"""Registro de sentencias de los caminos calientes, construidas una sola vez
+
+Al reutilizar el mismo objeto de sentencia SQLAlchemy no vuelve a armar la
+consulta en cada rerun y encuentra su SQL compilado en el caché del engine
+(query_cache_size en db.py); con psycopg 3 el servidor además la prepara.
+Los valores van siempre como parámetros.
+"""
+from sqlalchemy import bindparam, func, insert, select
+
+from db import Customer, CustomerStats, Order, OrderItem, Product, ProductSalesTotal, User
+
+# Login
+USUARIO_POR_NOMBRE = select(User).where(User.username == bindparam("username"))
+
+# Catálogo del POS
+CATALOGO_ACTIVO = select(Product).where(Product.is_active == True).order_by(Product.name)
+
+# Checkout
+ORDEN_POR_LLAVE = select(Order).where(Order.idempotency_key == bindparam("llave"))
+INSERTAR_ITEMS = insert(OrderItem)  # executemany con [{order_id, product_id, qty, price}]
+
+# Reportes
+_dia = func.date(Order.ts)
+VENTAS_POR_DIA = (
+    select(_dia, func.count(Order.id), func.sum(Order.total))
+    .group_by(_dia).order_by(_dia.desc()).limit(bindparam("limite"))
+)
+TOP_PRODUCTOS = (
+    select(Product.id, Product.sku, Product.name, ProductSalesTotal.qty, ProductSalesTotal.revenue)
+    .join(Product, Product.id == ProductSalesTotal.product_id)
+    .where(ProductSalesTotal.qty > 0)
+    .order_by(ProductSalesTotal.qty.desc()).limit(bindparam("limite"))
+)
+_top_clientes = (
+    select(
+        (Customer.name + " " + func.coalesce(Customer.last_name, "")).label("cliente"),
+        CustomerStats.order_count,
+        CustomerStats.total_spent,
+        CustomerStats.last_purchase,
+    ).join(Customer, Customer.id == CustomerStats.customer_id)
+    .where(Customer.is_active == True, CustomerStats.order_count > 0)
+)
+TOP_CLIENTES = {
+    "order_count": _top_clientes.order_by(CustomerStats.order_count.desc()).limit(bindparam("limite")),
+    "total_spent": _top_clientes.order_by(CustomerStats.total_spent.desc()).limit(bindparam("limite")),
+}
+
+REGISTRO = {
+    "usuario_por_nombre": USUARIO_POR_NOMBRE,
+    "catalogo_activo": CATALOGO_ACTIVO,
+    "orden_por_llave": ORDEN_POR_LLAVE,
+    "insertar_items": INSERTAR_ITEMS,
+    "ventas_por_dia": VENTAS_POR_DIA,
+    "top_productos": TOP_PRODUCTOS,
+    "top_clientes_por_compras": TOP_CLIENTES["order_count"],
+    "top_clientes_por_gasto": TOP_CLIENTES["total_spent"],
+}